@@ -0,0 +1,47 @@
+# Signed pings and ticks for the benchmarks, and the tests
+from utils.pki import get_kp, sign
+from utils.common import config
+from utils.helpers import standard_encode, hasher
+from utils.mining import mine_parallel
+
+GENESIS_REF = 'cd' * 32
+
+# Previous tick with old timestamps, so that new ticks pass the timediff check
+PREV_TICK = {'pubkey': 'pubkey', 'nonce': 1, 'prev_tick': 'prev_tick',
+             'height': 0, 'list': [{'timestamp': 0, 'pubkey': 'pubkey'}]}
+
+
+def lower_difficulty():
+    # So that building big ticks doesn't take minutes, validation uses the
+    # same config
+    config['difficulty'] = 1
+
+
+def make_keypairs(amount):
+    return [get_kp() for _ in range(amount)]
+
+
+def signed(item, keypair):
+    """
+    Mine item at the configured difficulty and sign it, in place
+
+    :param item: <dict> ping or tick content, without pubkey
+    :param keypair: <tuple> (pubkey, privkey) from get_kp
+    :return: <dict> item, with pubkey, nonce and signature
+    """
+    pubkey, privkey = keypair
+    item['pubkey'] = pubkey
+    mine_parallel(item, processes=1)
+    item['signature'] = sign(standard_encode(item), privkey)
+    return item
+
+
+def make_ping(keypair, reference=GENESIS_REF, timestamp=1521393955):
+    return signed({'timestamp': timestamp, 'reference': reference}, keypair)
+
+
+def make_tick(keypair, pings, prev_tick=GENESIS_REF, height=1):
+    tick = signed({'list': pings, 'prev_tick': prev_tick, 'height': height},
+                  keypair)
+    tick['this_tick'] = hasher(tick, exclude=('signature',))
+    return tick
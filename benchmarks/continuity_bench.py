@@ -0,0 +1,46 @@
+# Cost of scoring a candidate tick: walking the whole chain with
+# helpers.measure_tick_continuity versus Clockchain's running tally
+# Run from repository root: PYTHONPATH=. python benchmarks/continuity_bench.py
+import timeit
+from utils.common import config
+from utils.helpers import measure_tick_continuity
+from datastructures.clockchain import Clockchain
+
+PINGS = 100
+SCORINGS = 200
+
+
+def make_tick(ref, prev_ref):
+    return {'this_tick': ref, 'prev_tick': prev_ref, 'height': 0,
+            'pubkey': 'pubkey', 'nonce': 0,
+            'list': [{'pubkey': 'pubkey' + str(idx), 'timestamp': 0}
+                     for idx in range(PINGS)]}
+
+
+def build_chain(length):
+    config['chain_max_length'] = length
+    clockchain = Clockchain()
+    for slot in range(length):
+        prev_ref = next(iter(clockchain.possible_previous_ticks()))
+        tick = make_tick('tick' + str(slot), prev_ref)
+        clockchain.append_to_chain(clockchain.json_tick_to_chain_tick(tick))
+    return clockchain
+
+
+if __name__ == '__main__':
+    print("{:>8} {:>16} {:>16}".format("chain", "full walk (us)",
+                                       "running (us)"))
+    for length in [5, 50, 500]:
+        clockchain = build_chain(length)
+        candidate = make_tick('candidate', 'tick' + str(length - 1))
+        chain_tick = clockchain.json_tick_to_chain_tick(candidate)
+
+        full = timeit.timeit(lambda: measure_tick_continuity(
+            chain_tick, clockchain.chainlist()), number=SCORINGS)
+        running = timeit.timeit(lambda: clockchain.measure_continuity(
+            candidate), number=SCORINGS)
+        assert measure_tick_continuity(chain_tick, clockchain.chainlist()) \
+            == clockchain.measure_continuity(candidate)
+
+        print("{:>8} {:>16.1f} {:>16.1f}".format(
+            length, full / SCORINGS * 1e6, running / SCORINGS * 1e6))
@@ -0,0 +1,79 @@
+# Duplicate check per forwarded ping: hashing the canonical encoding of the
+# whole payload twice into a cache capped at 1000 entries (as
+# API.check_duplicate did with its ExpiringDict) versus the signature keyed
+# DedupFilter. Every ping arrives twice, the copy from a second peer either
+# shortly after the original or only after LATE other pings. Duplicates
+# that aren't recognized go on to full validation.
+# Run from repository root: PYTHONPATH=. python benchmarks/dedup_bench.py
+import time
+from collections import OrderedDict
+from utils.helpers import hasher
+from utils.common import config
+from datastructures.dedup_filter import DedupFilter
+
+PINGS = 10000
+LATE = 2000
+OLD_CAP = 1000
+
+
+def make_ping(idx):
+    return {'pubkey': 'ab' * 64, 'nonce': idx, 'timestamp': 1521393955,
+            'reference': 'cd' * 32, 'signature': '%0128x' % idx}
+
+
+def arrivals(pings, distance):
+    # Each ping followed by its copy, distance pings later
+    order = []
+    for idx, ping in enumerate(pings):
+        order.append(ping)
+        if idx >= distance:
+            order.append(pings[idx - distance])
+    return order + pings[len(pings) - distance:]
+
+
+def hash_twice(order):
+    seen = OrderedDict()
+    missed = 0
+    for ping in order:
+        if seen.get(hasher(ping)):
+            continue
+        seen[hasher(ping)] = True
+        if len(seen) > OLD_CAP:
+            seen.popitem(last=False)
+        missed += 1
+    return missed - PINGS
+
+
+def dedup_filter(order):
+    dedup = DedupFilter(config['dedup_window'], config['dedup_buckets'],
+                        config['dedup_capacity'],
+                        config['dedup_false_positive'],
+                        config['dedup_exact_size'])
+    missed = sum(not dedup.seen(ping['signature']) for ping in order)
+    return missed - PINGS, dedup
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == '__main__':
+    pings = [make_ping(idx) for idx in range(PINGS)]
+
+    print("{:>22} {:>10} {:>14} {:>18}".format(
+        "check", "copy after", "us per item", "duplicates missed"))
+    for distance in [1, LATE]:
+        order = arrivals(pings, distance)
+        old_time, old_missed = timed(hash_twice, order)
+        new_time, (new_missed, dedup) = timed(dedup_filter, order)
+        for name, seconds, missed in [
+                ("hash payload twice", old_time, old_missed),
+                ("dedup filter", new_time, new_missed)]:
+            print("{:>22} {:>10} {:>14.2f} {:>18}".format(
+                name, distance, seconds / len(order) * 1e6, missed))
+
+    print()
+    for key, value in sorted(dedup.stats().items()):
+        print("{:>24} {}".format(key, value))
@@ -0,0 +1,79 @@
+# Propagation time of one forward to 10, 50 and 100 peers: posting to one
+# peer after the other (as forward used to) versus the concurrent fan-out,
+# waiting for every peer to acknowledge. Peers are one local server reached
+# through different loopback addresses, each answering after DELAY seconds,
+# and with one peer taking SLOW_DELAY the fan-out only waits for the others.
+# Run from repository root: PYTHONPATH=. python benchmarks/forward_bench.py
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils.common import config, credentials
+from threads.networker import Networker
+
+DELAY = 0.01
+SLOW_DELAY = 1.0
+SLOW_HOST = '127.0.0.2'
+
+
+class PeerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        slow = self.server.slow and self.headers['Host'].startswith(
+            SLOW_HOST + ':')
+        time.sleep(SLOW_DELAY if slow else DELAY)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def sequential(networker, message):
+    for peer in list(networker.peers):
+        networker.sessions.post(
+            url=peer + '/forward/ping?addr=a&redistribute=1', json=message,
+            timeout=config['timeout'])
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(('', 0), PeerHandler)
+    server.daemon_threads = True
+    server.slow = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    message = {'pubkey': credentials.pubkey, 'nonce': 1, 'timestamp': 0,
+               'reference': 'ab' * 32, 'signature': 'cd' * 64}
+
+    print("{:>6} {:>16} {:>16} {:>22}".format(
+        "peers", "sequential (ms)", "fan-out (ms)", "1 slow, quorum (ms)"))
+    for amount in [10, 50, 100]:
+        networker = Networker()
+        networker.peers = {'http://127.0.0.' + str(idx + 2) + ':'
+                           + str(server.server_port): 'peer' + str(idx)
+                           for idx in range(amount)}
+        # Warm up connections, like an established node has them
+        networker.forward(message, 'ping', 'origin', 0, quorum=amount)
+        sequential(networker, message)
+
+        server.slow = False
+        sequential_time = timed(lambda: sequential(networker, message))
+        fanout_time = timed(lambda: networker.forward(
+            message, 'ping', 'origin', 0, quorum=amount))
+        server.slow = True
+        slow_time = timed(lambda: networker.forward(
+            message, 'ping', 'origin', 0, quorum=amount - 1))
+
+        print("{:>6} {:>16.1f} {:>16.1f} {:>22.1f}".format(
+            amount, sequential_time * 1e3, fanout_time * 1e3,
+            slow_time * 1e3))
+        time.sleep(SLOW_DELAY)  # Let the slow post finish
+    server.shutdown()
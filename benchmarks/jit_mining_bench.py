@@ -0,0 +1,59 @@
+# Hashrate of the numba backend versus the python template backend, and
+# versus re-encoding the whole content per nonce (what mining did before
+# the template). On a 1 core VM (H/s at 1, 100 and 1000 pings): template
+# 884k/923k/750k, numba 574k/708k/541k
+# Run from repository root: PYTHONPATH=. python benchmarks/jit_mining_bench.py
+import time
+from utils import jit_mining
+from utils.common import config
+from utils.helpers import hasher
+from utils.mining import MiningTemplate
+from utils.validation import validate_difficulty
+
+ATTEMPTS = 200000
+IMPOSSIBLE = 64  # No hash ends in 64 zeros, so every nonce gets tested
+
+
+def make_tick(pings):
+    ping = {'pubkey': 'ab' * 64, 'timestamp': 1521393955, 'nonce': 123456789,
+            'reference': 'cd' * 32, 'signature': 'ef' * 64}
+    return {'list': [ping] * pings, 'pubkey': 'ab' * 64,
+            'prev_tick': 'cd' * 32, 'height': 100}
+
+
+def hasher_hashrate(tick):
+    attempts = ATTEMPTS // 100
+    start = time.time()
+    for nonce in range(attempts):
+        tick['nonce'] = nonce
+        validate_difficulty(hasher(tick))
+    return attempts / (time.time() - start)
+
+
+def python_hashrate(template):
+    start = time.time()
+    for nonce in range(ATTEMPTS):
+        validate_difficulty(template.hash(nonce))
+    return ATTEMPTS / (time.time() - start)
+
+
+def jit_hashrate(template):
+    start = time.time()
+    template.jit.search(0, 1, ATTEMPTS, IMPOSSIBLE)
+    return ATTEMPTS / (time.time() - start)
+
+
+if __name__ == '__main__':
+    if not jit_mining.available:
+        print("numba not installed, nothing to compare")
+        exit()
+
+    config['mining_backend'] = 'numba'
+    print("{:>6} {:>14} {:>14} {:>14}".format(
+        "pings", "hasher (H/s)", "template (H/s)", "numba (H/s)"))
+    for pings in [1, 100, 1000]:
+        tick = make_tick(pings)
+        template = MiningTemplate(tick)
+        print("{:>6} {:>14.0f} {:>14.0f} {:>14.0f}".format(
+            pings, hasher_hashrate(tick), python_hashrate(template),
+            jit_hashrate(template)))
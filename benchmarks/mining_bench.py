@@ -0,0 +1,25 @@
+# Hashrate of the nonce search per amount of worker processes
+# Run from repository root: PYTHONPATH=. python benchmarks/mining_bench.py
+from utils.common import config
+from utils.mining import mine_parallel, mining_processes, last_run
+
+RUNS = 5
+
+
+def bench(processes):
+    tick = {'pubkey': 'pubkey', 'prev_tick': 'prev_tick', 'height': 1,
+            'list': [{'pubkey': 'pubkey', 'timestamp': 0, 'nonce': 0,
+                      'reference': 'ref', 'signature': 'sig'}] * 10}
+    hashes, seconds = 0, 0.0
+    for _ in range(RUNS):
+        mine_parallel(tick, processes=processes)
+        hashes += last_run['hashes']
+        seconds += last_run['seconds']
+    return hashes / seconds
+
+
+if __name__ == '__main__':
+    print("difficulty " + str(config['difficulty']))
+    for processes in sorted({1, 2, 4, mining_processes()}):
+        print("{:>3} process(es): {:>10.0f} H/s".format(processes,
+                                                       bench(processes)))
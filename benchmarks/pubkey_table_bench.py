@@ -0,0 +1,67 @@
+# Continuity counting (as in BranchTally) on pubkey hex strings versus on
+# interned pubkey ids, and the memory per ping of a ping pool of wire dicts
+# versus one of records keyed on ids. Pings are parsed from JSON, like they
+# arrive from peers. Run from repository root:
+# PYTHONPATH=. python benchmarks/pubkey_table_bench.py
+import json
+import time
+import tracemalloc
+from utils.pki import get_kp, pubkeys
+from datastructures.records import Ping
+
+ROUNDS = 20
+WINDOW = 10  # Ticks in the chain window, every participant pings in each
+
+
+def count(keys):
+    counts = {}
+    for key in keys:
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def timed_count(make_keys):
+    seconds = 0.0
+    for _ in range(ROUNDS):
+        keys = make_keys()
+        start = time.perf_counter()
+        count(keys)
+        seconds += time.perf_counter() - start
+    return seconds / ROUNDS
+
+
+def pool_footprint(build):
+    tracemalloc.start()
+    pool = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / len(pool)
+
+
+if __name__ == '__main__':
+    print("{:>8} {:>12} {:>12} {:>16} {:>18}".format(
+        "pubkeys", "hex (us)", "ids (us)", "dict pool (B)", "record pool (B)"))
+    for participants in [100, 1000, 5000]:
+        wire = json.dumps([{'pubkey': get_kp()[0], 'nonce': 1,
+                            'reference': 'ab' * 32, 'timestamp': 1521393955,
+                            'signature': 'cd' * 64}
+                           for _ in range(participants)])
+        for ping in json.loads(wire):
+            pubkeys.intern(ping['pubkey'])
+
+        hex_time = timed_count(lambda: [
+            ping['pubkey'] for _ in range(WINDOW)
+            for ping in json.loads(wire)])
+        id_time = timed_count(lambda: [
+            record.pubkey for _ in range(WINDOW)
+            for record in map(Ping.from_dict, json.loads(wire))])
+
+        dict_pool = pool_footprint(lambda: {
+            ping['pubkey']: ping for ping in json.loads(wire)})
+        record_pool = pool_footprint(lambda: {
+            record.pubkey: record
+            for record in map(Ping.from_dict, json.loads(wire))})
+
+        print("{:>8} {:>12.1f} {:>12.1f} {:>16.0f} {:>18.0f}".format(
+            participants, hex_time * 1e6, id_time * 1e6, dict_pool,
+            record_pool))
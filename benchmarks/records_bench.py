@@ -0,0 +1,47 @@
+# Memory held per tick (tracemalloc) as the wire dict loaded from JSON versus
+# as a Tick record, and as a record that was validated and then compacted the
+# way the Clockchain stores it (hashes cached, encodings dropped)
+# Run from repository root: PYTHONPATH=. python benchmarks/records_bench.py
+import json
+import tracemalloc
+from benchmarks.common import lower_difficulty, make_keypairs, make_ping
+from benchmarks.common import make_tick, PREV_TICK
+from datastructures.records import Tick
+from utils.validation import validate_tick
+
+COPIES = 20
+
+
+def footprint(build):
+    # Average memory still held per object after building COPIES of them
+    tracemalloc.start()
+    kept = [build() for _ in range(COPIES)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / len(kept)
+
+
+def validated_record(wire):
+    record = Tick.from_dict(json.loads(wire))
+    validate_tick(record, PREV_TICK)
+    record.compact()
+    return record
+
+
+if __name__ == '__main__':
+    lower_difficulty()
+    keypairs = make_keypairs(500)
+    print("{:>6} {:>12} {:>14} {:>18}".format(
+        "pings", "dict (KiB)", "record (KiB)", "stored (KiB)"))
+    for pings in [10, 100, 500]:
+        tick = make_tick(keypairs[0],
+                         [make_ping(keypair) for keypair in keypairs[:pings]])
+        wire = json.dumps(tick)
+        assert Tick.from_dict(json.loads(wire)).to_dict() == tick
+        # Warm the signature cache, so that it doesn't count per tick
+        assert validate_tick(Tick.from_dict(tick), PREV_TICK)
+
+        print("{:>6} {:>12.1f} {:>14.1f} {:>18.1f}".format(
+            pings, footprint(lambda: json.loads(wire)) / 1024,
+            footprint(lambda: Tick.from_dict(json.loads(wire))) / 1024,
+            footprint(lambda: validated_record(wire)) / 1024))
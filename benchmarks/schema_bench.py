@@ -0,0 +1,47 @@
+# Schema validations per second of ticks, loading the schema from disk on
+# every call (as before the registry) versus the precompiled registry
+# Run from repository root: PYTHONPATH=. python benchmarks/schema_bench.py
+import os
+import time
+import jsonref
+from jsonschema import validate
+from utils.common import dir_path
+from utils.validation import validate_schema
+
+DURATION = 1.0
+
+
+def validate_from_disk(dictionary, schema_file):
+    absolute_path = dir_path + '/schemas/' + schema_file
+    base_uri = 'file://{}/'.format(os.path.dirname(absolute_path))
+    with open(absolute_path) as schema_bytes:
+        schema = jsonref.loads(schema_bytes.read(), base_uri=base_uri,
+                               jsonschema=True)
+    validate(dictionary, schema)
+    return True
+
+
+def make_tick(pings):
+    ping = {'pubkey': 'ab' * 64, 'timestamp': 1521393955, 'nonce': 123456789,
+            'reference': 'cd' * 32, 'signature': 'ef' * 64}
+    return {'list': [dict(ping) for _ in range(pings)], 'pubkey': 'ab' * 64,
+            'prev_tick': 'cd' * 32, 'height': 100, 'nonce': 1,
+            'signature': 'ef' * 64}
+
+
+def rate(function, tick):
+    count = 0
+    start = time.time()
+    while time.time() - start < DURATION:
+        assert function(tick, 'tick_schema.json')
+        count += 1
+    return count / (time.time() - start)
+
+
+if __name__ == '__main__':
+    print("{:>6} {:>16} {:>16}".format("pings", "from disk (/s)",
+                                       "registry (/s)"))
+    for pings in [1, 100, 1000]:
+        tick = make_tick(pings)
+        print("{:>6} {:>16.0f} {:>16.0f}".format(
+            pings, rate(validate_from_disk, tick), rate(validate_schema, tick)))
@@ -0,0 +1,37 @@
+# Cost per nonce attempt of hashing the full tick versus the mining template
+# Run from repository root: PYTHONPATH=. python benchmarks/template_bench.py
+import timeit
+from utils.helpers import hasher
+from utils.mining import MiningTemplate
+
+ATTEMPTS = 2000
+
+
+def make_tick(pings):
+    ping = {'pubkey': 'ab' * 64, 'timestamp': 1521393955, 'nonce': 123456789,
+            'reference': 'cd' * 32, 'signature': 'ef' * 64}
+    return {'list': [ping] * pings, 'pubkey': 'ab' * 64,
+            'prev_tick': 'cd' * 32, 'height': 100}
+
+
+def full_hash(tick):
+    for nonce in range(ATTEMPTS):
+        tick['nonce'] = nonce
+        hasher(tick)
+
+
+def template_hash(tick):
+    template = MiningTemplate(tick)
+    for nonce in range(ATTEMPTS):
+        template.hash(nonce)
+
+
+if __name__ == '__main__':
+    print("{:>6} {:>14} {:>14} {:>9}".format("pings", "full (us)",
+                                             "template (us)", "speedup"))
+    for pings in [1, 10, 100, 500, 1000]:
+        tick = make_tick(pings)
+        full = timeit.timeit(lambda: full_hash(tick), number=1) / ATTEMPTS
+        tmpl = timeit.timeit(lambda: template_hash(tick), number=1) / ATTEMPTS
+        print("{:>6} {:>14.2f} {:>14.2f} {:>8.1f}x".format(
+            pings, full * 1e6, tmpl * 1e6, full / tmpl))
@@ -0,0 +1,35 @@
+# Peak memory allocated while validating a tick (tracemalloc), compared to
+# a single deep copy of that tick (validation used to make several) and to
+# the canonical encoding of the tick, which hashing it needs regardless.
+# Validation peaking at about the encoding means no copies are left.
+# Run from repository root:
+# PYTHONPATH=. python benchmarks/validation_alloc_bench.py
+import copy
+import tracemalloc
+from benchmarks.common import lower_difficulty, make_keypairs, make_ping
+from benchmarks.common import make_tick, PREV_TICK
+from utils.helpers import standard_encode
+from utils.validation import validate_tick
+
+
+def peak_allocation(function, *args):
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == '__main__':
+    lower_difficulty()
+    keypairs = make_keypairs(500)
+    print("{:>6} {:>16} {:>16} {:>16}".format(
+        "pings", "deepcopy (KiB)", "encode (KiB)", "validate (KiB)"))
+    for pings in [10, 100, 500]:
+        tick = make_tick(keypairs[0],
+                         [make_ping(keypair) for keypair in keypairs[:pings]])
+        assert validate_tick(tick, PREV_TICK)
+        print("{:>6} {:>16.1f} {:>16.1f} {:>16.1f}".format(
+            pings, peak_allocation(copy.deepcopy, tick) / 1024,
+            peak_allocation(standard_encode, tick) / 1024,
+            peak_allocation(validate_tick, tick, PREV_TICK) / 1024))
@@ -0,0 +1,38 @@
+# Signature verification throughput of a tick's ping list, one by one versus
+# verify_batch on a pool of processes
+# Run from repository root: PYTHONPATH=. python benchmarks/verify_batch_bench.py
+import os
+import time
+from utils.pki import get_kp, sign, verify, verify_batch
+
+
+def make_items(amount):
+    items = []
+    for idx in range(amount):
+        pubkey, privkey = get_kp()
+        message = b'ping' + str(idx).encode()
+        items.append((message, sign(message, privkey), pubkey))
+    return items
+
+
+def sequential(items):
+    return all(verify(message, sig, pubkey) for message, sig, pubkey in items)
+
+
+def timed(function, *args):
+    start = time.time()
+    assert function(*args)
+    return len(args[0]) / (time.time() - start)
+
+
+if __name__ == '__main__':
+    processes = os.cpu_count() or 1
+    items = make_items(1000)
+    verify_batch(items[:100], processes)  # Start the pool up front
+    print("{:>6} {:>18} {:>24}".format(
+        "pings", "sequential (sig/s)",
+        "batch " + str(processes) + " procs (sig/s)"))
+    for pings in [10, 100, 1000]:
+        print("{:>6} {:>18.0f} {:>24.0f}".format(
+            pings, timed(sequential, items[:pings]),
+            timed(verify_batch, items[:pings], processes)))
@@ -0,0 +1,55 @@
+# Size and encode/decode time of peer messages as json (what was sent until
+# now) versus the binary wire format, for a ping and ticks of 10, 100 and
+# 1000 pings (the ones of 100 and more are zlib compressed). Then the size
+# of those ticks as compact ticks, which reference their pings by id.
+# Run from repository root: PYTHONPATH=. python benchmarks/wire_bench.py
+import json
+import time
+from utils import wire
+from benchmarks.common import lower_difficulty, make_keypairs, make_ping
+from benchmarks.common import make_tick
+
+REPEATS = 20
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        function(*args)
+    return (time.perf_counter() - start) / REPEATS
+
+
+if __name__ == '__main__':
+    lower_difficulty()
+    keypairs = make_keypairs(1000)
+    pings = [make_ping(keypair) for keypair in keypairs]
+
+    messages = [('ping', 'ping', pings[0])]
+    for amount in [10, 100, 1000]:
+        messages.append(('tick of ' + str(amount), 'tick',
+                         make_tick(keypairs[0], pings[:amount])))
+
+    print("{:>14} {:>10} {:>10} {:>7} {:>12} {:>12} {:>12} {:>12}".format(
+        "message", "json (B)", "binary (B)", "ratio", "json enc us",
+        "bin enc us", "json dec us", "bin dec us"))
+    for name, route, message in messages:
+        text = json.dumps(message)
+        frame = wire.encode(message, route)
+        assert wire.decode(frame, route) == message
+
+        print("{:>14} {:>10} {:>10} {:>7.2f} {:>12.1f} {:>12.1f} {:>12.1f} "
+              "{:>12.1f}".format(
+                  name, len(text), len(frame), len(frame) / len(text),
+                  timed(json.dumps, message) * 1e6,
+                  timed(wire.encode, message, route) * 1e6,
+                  timed(json.loads, text) * 1e6,
+                  timed(wire.decode, frame, route) * 1e6))
+
+    print()
+    print("{:>14} {:>10} {:>12} {:>7}".format(
+        "message", "json (B)", "compact (B)", "ratio"))
+    for name, route, message in messages[1:]:
+        text = json.dumps(message)
+        compact = json.dumps(wire.compact_tick(message, 5000))
+        print("{:>14} {:>10} {:>12} {:>7.2f}".format(
+            name, len(text), len(compact), len(compact) / len(text)))
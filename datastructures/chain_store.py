@@ -0,0 +1,300 @@
+import os
+import json
+import mmap
+import atexit
+import struct
+import hashlib
+from threading import Lock
+
+# Every record in a segment is a length header followed by the json slot
+RECORD_HEADER = struct.Struct('<I')
+# Height index: entry i is for height i -> (segment number, offset, length)
+# A length of 0 means nothing was stored at that height
+INDEX_ENTRY = struct.Struct('<IQI')
+# Ref index: hash table with open addressing, read and updated in place
+# through mmap. A header (capacity, count) followed by capacity entries of
+# (key of the tick ref, height + 1), where a height of 0 marks a free entry
+REF_HEADER = struct.Struct('<QQ16x')
+REF_ENTRY = struct.Struct('<32sQ')
+REF_MIN_CAPACITY = 1024
+
+
+def ref_key(ref):
+    # Tick refs are sha256 hex digests, anything else gets hashed to 32 bytes
+    try:
+        key = bytes.fromhex(ref)
+        if len(key) == 32:
+            return key
+    except ValueError:
+        pass
+    return hashlib.sha256(ref.encode('utf-8')).digest()
+
+
+def new_ref_table(file, capacity):
+    # Extending with truncate keeps the free entries sparse on disk
+    file.truncate(REF_HEADER.size + capacity * REF_ENTRY.size)
+    file.seek(0)
+    file.write(REF_HEADER.pack(capacity, 0))
+    file.flush()
+
+
+def probe_ref(table, key):
+    """
+    Linear probing from the entry key hashes to
+
+    :param table: <mmap> ref table
+    :param key: <bytes> from ref_key
+    :return: <tuple> (offset of key's entry or the free one it goes in,
+        stored height + 1 there, 0 if free)
+    """
+    capacity = REF_HEADER.unpack_from(table, 0)[0]
+    mask = capacity - 1  # Capacities are powers of 2
+    idx = int.from_bytes(key[-8:], 'little') & mask
+    while True:
+        offset = REF_HEADER.size + idx * REF_ENTRY.size
+        stored_key, stored = REF_ENTRY.unpack_from(table, offset)
+        if stored == 0 or stored_key == key:
+            return offset, stored
+        idx = (idx + 1) & mask
+
+
+class ChainStore(object):
+    """
+    Append-only disk store of the chain slots ({ref: tick} dicts of ticks
+    selected at one height). Slots are appended to segment files, and found
+    back through memory-mapped indexes by height and by tick ref.
+    Appends are buffered and written + fsync'd in batches of batch_size.
+    Heights more than max_height_gap past the stored ones are refused
+    """
+    def __init__(self, path, batch_size=1, segment_max_bytes=16 * 1024 ** 2,
+                 max_height_gap=10 ** 6):
+        self.path = path
+        self.batch_size = batch_size
+        self.segment_max_bytes = segment_max_bytes
+        self.max_height_gap = max_height_gap
+        self.lock = Lock()
+        self.pending = []  # (height, slot) not written yet
+
+        os.makedirs(path, exist_ok=True)
+
+        self.index_file = self.open_file('index.bin')
+        self.refs_file = self.open_file('refs.bin')
+
+        # Drop a partially written entry of a crash mid-flush
+        size = os.fstat(self.index_file.fileno()).st_size
+        self.index_file.truncate(size - size % INDEX_ENTRY.size)
+
+        self.index_map = None
+        self.remap_index()
+
+        if os.fstat(self.refs_file.fileno()).st_size < REF_HEADER.size:
+            new_ref_table(self.refs_file, REF_MIN_CAPACITY)
+        self.refs_map = mmap.mmap(self.refs_file.fileno(), 0)
+
+        segments = [int(name[len('segment_'):-len('.log')])
+                    for name in os.listdir(path)
+                    if name.startswith('segment_') and name.endswith('.log')]
+        self.segment_number = max(segments) if segments else 0
+        self.segment_file = self.open_file(self.segment_name(
+            self.segment_number))
+        self.readers = {}
+
+        atexit.register(self.flush)
+
+    def open_file(self, name):
+        full_path = os.path.join(self.path, name)
+        if not os.path.exists(full_path):
+            open(full_path, 'wb').close()
+        return open(full_path, 'r+b')
+
+    @staticmethod
+    def segment_name(number):
+        return 'segment_' + str(number).zfill(6) + '.log'
+
+    def remap_index(self):
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_map = None
+        if os.fstat(self.index_file.fileno()).st_size > 0:
+            self.index_map = mmap.mmap(self.index_file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+
+    def accepts(self, height):
+        # False for heights so far ahead that the gap would fill the index
+        return height <= self.next_height() + self.max_height_gap
+
+    def append(self, slot):
+        height = next(iter(slot.values()))['height']
+        if not self.accepts(height):
+            raise ValueError("Height " + str(height) + " is too far ahead of "
+                             "the stored chain")
+        with self.lock:
+            self.pending.append((height, slot))
+            if len(self.pending) >= self.batch_size:
+                self.write_pending()
+
+    def flush(self):
+        with self.lock:
+            self.write_pending()
+
+    def write_pending(self):
+        if len(self.pending) == 0:
+            return
+
+        # Segments first, so the index never points at data not on disk
+        entries = []
+        self.segment_file.seek(0, os.SEEK_END)
+        for height, slot in self.pending:
+            record = bytes(json.dumps(slot, sort_keys=True,
+                                      separators=(',', ':')), 'utf-8')
+            offset = self.segment_file.tell()
+            if offset > 0 and offset + RECORD_HEADER.size + len(record) \
+                    > self.segment_max_bytes:
+                self.sync(self.segment_file)
+                self.segment_file.close()
+                self.segment_number += 1
+                self.segment_file = self.open_file(
+                    self.segment_name(self.segment_number))
+                offset = 0
+            self.segment_file.write(RECORD_HEADER.pack(len(record)) + record)
+            entries.append((height, slot, self.segment_number, offset,
+                            RECORD_HEADER.size + len(record)))
+        self.sync(self.segment_file)
+
+        index_size = os.fstat(self.index_file.fileno()).st_size
+        self.refs_file.seek(0, os.SEEK_END)
+        for height, slot, segment, offset, length in entries:
+            position = height * INDEX_ENTRY.size
+            if position > index_size:  # Heights nothing was selected for
+                self.index_file.truncate(position)
+            self.index_file.seek(position)
+            self.index_file.write(INDEX_ENTRY.pack(segment, offset, length))
+            index_size = max(index_size, position + INDEX_ENTRY.size)
+
+            for ref in slot:
+                self.put_ref(ref_key(ref), height)
+        self.sync(self.index_file)
+        self.refs_map.flush()
+
+        self.pending = []
+        self.remap_index()
+
+    def put_ref(self, key, height):
+        capacity, count = REF_HEADER.unpack_from(self.refs_map, 0)
+        if (count + 1) * 2 > capacity:
+            self.grow_refs(capacity * 2)
+            capacity, count = REF_HEADER.unpack_from(self.refs_map, 0)
+        offset, stored = probe_ref(self.refs_map, key)
+        REF_ENTRY.pack_into(self.refs_map, offset, key, height + 1)
+        if stored == 0:
+            REF_HEADER.pack_into(self.refs_map, 0, capacity, count + 1)
+
+    def grow_refs(self, capacity):
+        # Rehash into a bigger table next to the old one, then swap it in
+        table_path = os.path.join(self.path, 'refs.bin')
+        grown_path = table_path + '.grow'
+        with open(grown_path, 'w+b') as grown_file:
+            new_ref_table(grown_file, capacity)
+            grown = mmap.mmap(grown_file.fileno(), 0)
+            count = 0
+            for key, stored in REF_ENTRY.iter_unpack(
+                    self.refs_map[REF_HEADER.size:]):
+                if stored != 0:
+                    offset, _ = probe_ref(grown, key)
+                    REF_ENTRY.pack_into(grown, offset, key, stored)
+                    count += 1
+            REF_HEADER.pack_into(grown, 0, capacity, count)
+            grown.flush()
+            grown.close()
+            os.fsync(grown_file.fileno())
+
+        self.refs_map.close()
+        self.refs_file.close()
+        os.replace(grown_path, table_path)
+        self.refs_file = self.open_file('refs.bin')
+        self.refs_map = mmap.mmap(self.refs_file.fileno(), 0)
+
+    @staticmethod
+    def sync(file):
+        file.flush()
+        os.fsync(file.fileno())
+
+    def read_record(self, segment, offset, length):
+        if segment not in self.readers:
+            self.readers[segment] = open(os.path.join(
+                self.path, self.segment_name(segment)), 'rb')
+        reader = self.readers[segment]
+        reader.seek(offset + RECORD_HEADER.size)
+        return json.loads(reader.read(length - RECORD_HEADER.size).decode())
+
+    def read(self, height):
+        """
+        :param height: <int> height of the slot
+        :return: <dict> {ref: tick} slot stored at height, None if none
+        """
+        with self.lock:
+            for pending_height, slot in reversed(self.pending):
+                if pending_height == height:
+                    return slot
+
+            position = height * INDEX_ENTRY.size
+            if height < 0 or self.index_map is None \
+                    or position + INDEX_ENTRY.size > len(self.index_map):
+                return None
+            segment, offset, length = INDEX_ENTRY.unpack_from(self.index_map,
+                                                              position)
+            if length == 0:
+                return None
+            return self.read_record(segment, offset, length)
+
+    def read_range(self, start, end):
+        # Yields (height, slot) for every stored height in [start, end)
+        for height in range(max(start, 0), min(end, self.next_height())):
+            slot = self.read(height)
+            if slot is not None:
+                yield height, slot
+
+    def read_ref(self, ref):
+        # The stored tick with this reference, None if unknown
+        height = self.height_of(ref)
+        if height is None:
+            return None
+        slot = self.read(height)
+        return slot.get(ref, None) if slot is not None else None
+
+    def height_of(self, ref):
+        with self.lock:
+            for height, slot in self.pending:
+                if ref in slot:
+                    return height
+            _, stored = probe_ref(self.refs_map, ref_key(ref))
+            return stored - 1 if stored != 0 else None
+
+    def next_height(self):
+        with self.lock:
+            indexed = len(self.index_map) // INDEX_ENTRY.size \
+                if self.index_map is not None else 0
+            pending = max([height + 1 for height, _ in self.pending],
+                          default=0)
+            return max(indexed, pending)
+
+    # Last `amount` stored slots, oldest first. Used to restore the hot tail
+    def tail(self, amount):
+        slots = []
+        height = self.next_height() - 1
+        while height >= 0 and len(slots) < amount:
+            slot = self.read(height)
+            if slot is not None:
+                slots.append(slot)
+            height -= 1
+        return list(reversed(slots))
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        if self.index_map is not None:
+            self.index_map.close()
+        self.refs_map.close()
+        for file in [self.index_file, self.refs_file, self.segment_file] \
+                + list(self.readers.values()):
+            file.close()
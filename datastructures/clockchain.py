@@ -1,43 +1,68 @@
-from utils.helpers import hasher, measure_tick_continuity
+from utils.helpers import hasher, remap
 from utils.common import logger, credentials, config
-from utils.pki import pubkey_to_addr
-from queue import Queue, PriorityQueue
-import copy
-import time
+from utils.pki import pubkeys
+from datastructures.tick_dag import TickDag
+from datastructures.tick_pool import TickPool
+from datastructures.vote_tally import VoteTally
+from datastructures.records import Ping, Tick, slot_from_dict, slot_to_dict
+from datastructures.records import pubkey_id, ping_id
+from threading import Condition
+
+# TODO: Create valid genesis tick
+GENESIS_TICK = {
+    'pubkey': 'pubkey',
+    'nonce': 68696043434,
+    'list': [
+        {'timestamp': 0, 'pubkey': 'pubkey'}
+    ],
+    'prev_tick': 'prev_tick',
+    'height': 0,
+    'this_tick': '55f5b323471532d860b11d4fc079ba38'
+                 '819567aa0915d83d4636d12e498a8f3e'
+}
 
 
 class Clockchain(object):
-    def __init__(self):
-        self.chain = Queue(maxsize=config['chain_max_length'])
+    def __init__(self, store=None):
+        # In-memory hot tail of the chain, as a DAG of the selected ticks.
+        # If there is a ChainStore, all selected slots also get persisted there
+        # and the tail is restored from it on startup
+        self.store = store
+        self.dag = TickDag(config['chain_max_length'])
+        # Pings, ticks and chain slots are kept as records, see records.py
+        # Ping and vote pool are keyed on pubkey id (utils.pki.pubkeys)
         self.ping_pool = {}
         self.vote_pool = {}
-        # Priority queue because we want to sort by cumulative continuity
-        self.tick_pool = PriorityQueue()
+        # Pings of the ping pool and of the ticks in the tick pool, by id
+        # (records.ping_id), to rebuild compact ticks from
+        self.ping_index = {}
+        # Vote counts per tick reference, kept up to date by add_to_vote_pool
+        self.vote_tally = VoteTally()
+        # Sorted by cumulative continuity, and indexed by tick reference
+        self.tick_pool = TickPool()
+        # Notified when the tick pool gets a tick and when the chain advances
+        self.updated = Condition()
 
         logger.debug("This node is " + credentials.addr)
 
-        # TODO: Create valid genesis tick
-        tick = {
-            'pubkey': 'pubkey',
-            'nonce': 68696043434,
-            'list': [
-                {'timestamp': 0, 'pubkey': 'pubkey'}
-            ],
-            'prev_tick': 'prev_tick',
-            'height': 0,
-            'this_tick': '55f5b323471532d860b11d4fc079ba38'
-                         '819567aa0915d83d4636d12e498a8f3e'
-        }
-
-        genesis_dict = self.json_tick_to_chain_tick(tick)
-        self.chain.put(genesis_dict)
+        restored = store.tail(config['chain_max_length']) if store else []
+        if len(restored) > 0:
+            logger.info("Restoring chain from store up to height "
+                        + str(store.next_height() - 1))
+            for tick_dict in restored:
+                self.append_to_chain(slot_from_dict(tick_dict), persist=False)
+        else:
+            genesis_dict = self.json_tick_to_chain_tick(GENESIS_TICK)
+            self.append_to_chain(genesis_dict)
 
     # Returns most recent tick reference: highest continuity tick from tickpool
-    # Used for voting
-    def current_tick_ref(self):
-        while self.active_tick() is None:
-            time.sleep(0.1)
-        return self.get_tick_ref(self.active_tick())
+    # Used for voting. Blocks until there is a tick, None if timeout passes
+    def current_tick_ref(self, timeout=None):
+        with self.updated:
+            if not self.updated.wait_for(
+                    lambda: self.active_tick() is not None, timeout):
+                return None
+            return self.get_tick_ref(self.active_tick())
 
     # Returns the reference of any of previous ticks that was selected to chain
     def prev_tick_ref(self):
@@ -46,13 +71,8 @@ class Clockchain(object):
     # Helper function to get the reference of a tick
     @staticmethod
     def get_tick_ref(tick):
-        tick_copy = copy.deepcopy(tick)
-
-        # Removing signature and this_tick in order to return correct hash
-        tick_copy.pop('signature', None)
-        tick_copy.pop('this_tick', None)
-
-        return hasher(tick_copy)
+        # Leaving out signature and this_tick in order to return correct hash
+        return hasher(tick, exclude=('signature', 'this_tick'))
 
     # Helper function to convert a json tick to a tick format used in our chain
     # Essentially instead of having a tick with its reference in ['this_tick'],
@@ -61,10 +81,11 @@ class Clockchain(object):
     def json_tick_to_chain_tick(tick):
         dictified = {}
 
-        tick_copy = copy.deepcopy(tick)
-        tick_ref = tick_copy.pop('this_tick', None)
+        # The chain tick is the same record as in the tick pool. It keeps its
+        # "this_tick", which is left out when the slot goes to disk or peers
+        tick_ref = tick.get('this_tick', None)
         if tick_ref is not None:
-            dictified[tick_ref] = tick_copy
+            dictified[tick_ref] = Tick.from_dict(tick)
         else:
             # TODO: Create the ref from scratch if it wasn't found in dict
             pass
@@ -76,120 +97,183 @@ class Clockchain(object):
 
     # Returns the current highest continuity tick from tick_pool
     def active_tick(self):
-        if self.tick_pool_size() > 0:
-            _, _, tick = list(self.tick_pool.queue)[0]
-            return tick
-        else:
-            return None
+        return self.tick_pool.peek()
 
     # Named possible since the chain might have orphans / be forked
     def possible_previous_ticks(self):
-        if len(self.chainlist()) > 0:
-            return self.chainlist()[-1]
+        tips = self.dag.tips()
+        if len(tips) > 0:
+            return {ref: node.tick for ref, node in tips.items()}
         else:
             return None
 
     def chainlist(self):
-        return list(self.chain.queue)
+        return self.dag.slot_dicts()
+
+    # Chain as wire dicts, e.g. for info endpoints and peers
+    def chainlist_dicts(self):
+        return [slot_to_dict(slot) for slot in self.chainlist()]
 
     def restart_cycle(self):
         # Ping_pool is not cleared here since we might have received pings
         # at vote/select stage already, by faster peers
-        self.vote_pool = {}
-        self.tick_pool = PriorityQueue()
+        with self.updated:
+            # Same lock as add_to_vote_pool, so no vote lands in between
+            with self.vote_tally.condition:
+                self.vote_pool = {}
+                self.vote_tally.clear()
+            self.tick_pool = TickPool()
+            self.ping_index = {ping_id(ping): ping
+                               for ping in self.ping_pool.values()}
+            pubkeys.sweep(self.live_pubkeys())
+
+    # Pubkey ids held by the pools and the chain tail, see PubkeyTable.sweep
+    def live_pubkeys(self):
+        live = set(self.ping_pool) | set(self.vote_pool)
+        ticks = [tick for _, tick in self.tick_pool.snapshot()]
+        for node in list(self.dag.nodes.values()):
+            ticks.append(node.tick)
+            if node.tally is not None:
+                live.update(node.tally.counts)
+        for tick in ticks:
+            live.add(getattr(tick, 'pubkey', None))
+            live.update(getattr(ping, 'pubkey', None)
+                        for ping in getattr(tick, 'list', ()))
+        return live
 
     def tick_pool_size(self):
-        return len(list(self.tick_pool.queue))
+        return len(self.tick_pool)
+
+    # Ping pool by address, as peers and operators know it
+    def ping_pool_dicts(self):
+        # Copied first, the ingress workers add pings meanwhile
+        return {pubkeys.addr(pubkey): ping.to_dict()
+                for pubkey, ping in list(self.ping_pool.items())}
+
+    # Ping of pubkey in the ping pool, None if it has none there
+    def get_ping(self, pubkey):
+        return self.ping_pool.get(pubkeys.lookup(pubkey), None)
+
+    # Pings with one of these ids (see records.ping_id) in the ping pool or
+    # in the ticks of the tick pool, as {id: ping}
+    def find_pings(self, ids):
+        index = self.ping_index
+        return {identifier: index[identifier]
+                for identifier in dict.fromkeys(ids) if identifier in index}
 
     def add_to_ping_pool(self, ping):
-        addr_to_add = pubkey_to_addr(ping['pubkey'])
-        self.ping_pool[addr_to_add] = ping
+        ping = Ping.from_dict(ping)
+        ping.compact()
+        self.ping_pool[ping.pubkey] = ping
+        self.ping_index[ping_id(ping)] = ping
 
     # Different to above: only store the vote reference and not entire structure
+    # Voting twice moves the vote over from the previous reference
     def add_to_vote_pool(self, vote):
-        addr_to_add = pubkey_to_addr(vote['pubkey'])
-        self.vote_pool[addr_to_add] = vote['reference']
+        voter = pubkey_id(vote)
+        with self.vote_tally.condition:
+            previous_ref = self.vote_pool.get(voter, None)
+            self.vote_pool[voter] = vote['reference']
+            self.vote_tally.move(previous_ref, vote['reference'])
 
     # Returns a dict where keys are references of ticks and their nr of votes
     def get_vote_counts(self):
-        count_dict = {}
-
-        for k, v in self.vote_pool.items():
-            if v in count_dict.keys():
-                count_dict[v] = count_dict[v] + 1
-            else:
-                count_dict[v] = 1
-
-        return count_dict
+        return self.vote_tally.get_counts()
+
+    # Equal to helpers.measure_tick_continuity(tick, chain), but only costs
+    # O(pings in tick) thanks to the running tally of the branch it extends
+    def measure_continuity(self, tick):
+        with self.updated:
+            return self.dag.score(tick)
+
+    # Put a slot of (tied) ticks on the chain. Branches not extended by any
+    # of them are dead now, and get pruned from the DAG
+    def append_to_chain(self, tick_dict, persist=True):
+        if persist and self.store is not None:
+            self.store.append(slot_to_dict(tick_dict))
+
+        with self.updated:
+            self.dag.add_slot(tick_dict)
+            self.updated.notify_all()
+
+    # What a new joiner needs, taken together so chain and pool match up
+    def sync_state(self):
+        with self.updated:
+            return {'chain': self.chainlist_dicts(),
+                    'height': self.current_height(),
+                    'ping_pool': list(self.ping_pool_dicts().values())}
+
+    # Replace the chain tail by one synced from peers, all at once. The new
+    # DAG is built aside, so a bad chainlist leaves the chain as it was
+    def install_chain(self, chainlist):
+        slots = [slot_from_dict(tick_dict)
+                 for tick_dict in chainlist[-config['chain_max_length']:]]
+        if len(slots) == 0 or any(len(slot) == 0 for slot in slots):
+            raise ValueError("Synced chain has no ticks in a slot")
+        dag = TickDag(config['chain_max_length'])
+        for slot in slots:
+            dag.add_slot(slot)
+
+        stored_height = self.store.next_height() if self.store else 0
+        persisted = [slot for slot in slots
+                     if next(iter(slot.values()))['height'] >= stored_height]
+        if self.store is not None and len(persisted) > 0 \
+                and not self.store.accepts(
+                    next(iter(persisted[0].values()))['height']):
+            raise ValueError("Synced chain is too far ahead of the store")
+
+        with self.updated:
+            if self.store is not None:
+                for slot in persisted:
+                    self.store.append(slot_to_dict(slot))
+            self.dag = dag
+            self.updated.notify_all()
 
     def add_to_tick_pool(self, tick):
-        tick_copy = copy.deepcopy(tick)
-
-        tick_continuity = measure_tick_continuity(
-            self.json_tick_to_chain_tick(tick_copy), self.chainlist())
-
-        # This tracking number is used to make sure that in the case of
-        # equal valued items, the first one (FIFO) is returned. tick_number
-        # simply keeps track of which equivalued tick was inserted first
-        tick_number = self.tick_pool_size() + 1
-
-        # Putting minus sign on the continuity measurement since PriorityQueue
-        # Returns the *lowest* valued item first, while we want *highest*
-        self.tick_pool.put((-tick_continuity, tick_number, tick_copy))
+        tick = Tick.from_dict(tick)
+        tick.compact()
+        with self.updated:
+            tick_continuity = self.measure_continuity(tick)
+            self.tick_pool.put(tick, tick_continuity)
+            for ping in tick['list']:
+                self.ping_index[ping_id(ping)] = ping
+            self.updated.notify_all()
+
+    # Current state of the vote tally, e.g. for streaming to operators
+    def vote_tally_snapshot(self):
+        with self.vote_tally.condition:
+            return {'version': self.vote_tally.version,
+                    'top_score': self.vote_tally.top_score,
+                    'leaders': self.vote_tally.leaders(),
+                    'counts': remap(self.vote_tally.get_counts())}
 
     # Return highest voted ticks (several if shared top score)
     def top_tick_refs(self):
-        highest_voted_ticks = []
-
-        # Sort by value (amount of votes)
-        sorted_votes = sorted(self.get_vote_counts().items(),
-                              key=lambda x: x[1], reverse=True)
-
-        top_ref, top_score = sorted_votes.pop(0)
-        highest_voted_ticks.append(top_ref)
-
-        logger.debug("Highest amount of votes achieved was: " + str(top_score))
+        logger.debug("Highest amount of votes achieved was: "
+                     + str(self.vote_tally.top_score))
 
         # If any other refs share the same score, we return those too
-        for vote in sorted_votes:
-            next_ref, next_score = vote
-            if next_score == top_score:
-                highest_voted_ticks.append(next_ref)
-            else:
-                break
-
-        return highest_voted_ticks
+        return self.vote_tally.leaders()
 
+    # Return list of all ticks whose ref matches one of the supplied refs
     def get_ticks_by_ref(self, references):
-        # Get the actual tick from the tuple (_, _, tick) which is index 2
-        # And put it in a list
-        list_of_all_ticks = [x[2] for x in list(self.tick_pool.queue)]
-
-        # Return list of all ticks whose ref matches supplied ref
-        filtered_ticks = [tick for tick in list_of_all_ticks if
-                          tick['this_tick'] in references]
-
-        return filtered_ticks
+        return self.tick_pool.get_by_refs(references)
 
-    # Returns one of the tick possibilities (at random?)
-    def latest_selected_tick(self):
-        # TODO: Return the one with highest amount of pings?
-        tick = None
-        while tick is None:
-            try:
-                tick = next(iter(self.possible_previous_ticks().values()))
-            except StopIteration:
-                tick = None
-                pass
-
-        return tick
+    # Returns the tick possibility whose branch has the highest continuity
+    # Blocks until the chain has a tick, None if timeout passes
+    def latest_selected_tick(self, timeout=None):
+        with self.updated:
+            if not self.updated.wait_for(
+                    lambda: self.dag.best_tip() is not None, timeout):
+                return None
+            return self.dag.best_tip().tick
 
     def select_highest_voted_to_chain(self):
         # ---- Add all ticks with same amount of votes to the dictionary ----
         # WARNING: This MUST happen less than 50% of the time and result in
-        # usually only 1 winner, so that chain only branches occasionally
-        # and thus doesn't become an exponentially growing tree.
-        # This is the main condition to achieve network-wide consensus
+        # usually only 1 winner, so that chain only branches occasionally.
+        # This is the main condition to achieve network-wide consensus.
+        # (Memory is safe either way: the DAG prunes branches that die out)
         top_tick_refs = self.top_tick_refs()
 
         highest_ticks = self.get_ticks_by_ref(top_tick_refs)
@@ -204,12 +288,7 @@ class Clockchain(object):
                 to_add = self.json_tick_to_chain_tick(tick)
                 tick_dict = {**tick_dict, **to_add}
 
-            # TODO: Is this atomic? 
-            if self.chain.full():
-                # This removes earliest item from queue
-                self.chain.get()
-
-            self.chain.put(tick_dict)
+            self.append_to_chain(tick_dict)
         else:
             logger.info("Warning!! No ticks added to chain!!")
 
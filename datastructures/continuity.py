@@ -0,0 +1,45 @@
+from collections import deque
+from datastructures.records import pubkey_id
+
+
+class BranchTally(object):
+    """
+    Running continuity tally of one branch of the chain: the ticks on the
+    branch that are still inside the chain window, and how many pings every
+    pubkey (by id, see utils.pki.pubkeys) has on them. Kept per tip by
+    Clockchain, so that scoring a new tick only has to look at the pings of
+    that tick itself
+    """
+    def __init__(self):
+        self.ticks = deque()  # Oldest to newest
+        self.counts = {}
+        self.total = 0
+
+    def extended(self, tick):
+        # New tally for a tick whose prev_tick is the tip of this branch
+        tally = BranchTally()
+        tally.ticks = deque(self.ticks)
+        tally.counts = dict(self.counts)
+        tally.total = self.total
+        tally.add(tick)
+        return tally
+
+    def add(self, tick):
+        self.ticks.append(tick)
+        for ping in tick['list']:
+            pubkey = pubkey_id(ping)
+            self.counts[pubkey] = self.counts.get(pubkey, 0) + 1
+        self.total += len(tick['list'])
+
+    def evict_oldest(self):
+        tick = self.ticks.popleft()
+        for ping in tick['list']:
+            pubkey = pubkey_id(ping)
+            self.counts[pubkey] -= 1
+            if self.counts[pubkey] == 0:
+                del self.counts[pubkey]
+        self.total -= len(tick['list'])
+
+    # Same as helpers.measure_tick_continuity() of a tick on top of this branch
+    def score(self, tick, window):
+        return (self.total + len(tick['list'])) / window
@@ -0,0 +1,154 @@
+import math
+import time
+import hashlib
+from collections import deque
+from threading import Lock
+from datastructures.lru_cache import LRUCache
+
+
+class BloomFilter(object):
+    """
+    Fixed size set of strings that can answer "maybe seen" wrongly, at
+    about false_positive_rate once capacity keys have been added
+    """
+    def __init__(self, capacity, false_positive_rate):
+        self.bits = max(8, int(math.ceil(-capacity * math.log(
+            false_positive_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.added = 0
+
+    def positions(self, key):
+        # k positions out of two 64 bit hashes (Kirsch-Mitzenmacher)
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        bits = self.bits
+        return [(first + idx * second) % bits for idx in range(self.hashes)]
+
+    def add(self, positions):
+        for position in positions:
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.added += 1
+
+    def contains(self, positions):
+        array = self.array
+        for position in positions:
+            if not array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def clear(self):
+        self.array[:] = bytes(len(self.array))
+        self.added = 0
+
+    # Expected false positive rate with the keys added so far
+    def fill_rate(self):
+        return (1 - math.exp(-self.hashes * self.added / self.bits)) \
+            ** self.hashes
+
+
+class DedupFilter(object):
+    """
+    Remembers keys (e.g. signatures) seen in the last window_seconds, in
+    constant memory however many arrive. Keys go into one Bloom filter per
+    time bucket of window_seconds / buckets, and the oldest bucket gets
+    cleared and reused when time moves on. A key is remembered for at least
+    window_seconds, at most one bucket longer.
+
+    An exact LRU of the most recent keys sits in front: it answers most
+    duplicates (which arrive shortly after the original) without hashing.
+    Each filter is sized for capacity keys at its share of the
+    false_positive_rate, so that a check against all of them stays within it.
+    Thread safe
+    """
+    def __init__(self, window_seconds, buckets, capacity, false_positive_rate,
+                 exact_size, clock=time.time):
+        self.bucket_seconds = window_seconds / buckets
+        self.false_positive_rate = false_positive_rate
+        self.clock = clock
+        # Newest first, plus one bucket that is partly out of the window
+        self.filters = deque(BloomFilter(capacity,
+                                         false_positive_rate / (buckets + 1))
+                             for _ in range(buckets + 1))
+        self.bucket_start = clock()
+        self.exact = LRUCache(exact_size)  # Key -> time it was added
+        self.lock = Lock()
+        self.exact_hits = 0
+        self.filter_hits = 0
+        self.misses = 0
+        self.rotations = 0
+
+    def rotate(self, now):
+        elapsed = int((now - self.bucket_start) // self.bucket_seconds)
+        if elapsed <= 0:
+            return
+        for _ in range(min(elapsed, len(self.filters))):
+            oldest = self.filters.pop()
+            oldest.clear()
+            self.filters.appendleft(oldest)
+            self.rotations += 1
+        self.bucket_start += elapsed * self.bucket_seconds
+
+    def lookup(self, key, now):
+        # Filter positions of key, None if it was seen in the window
+        window = len(self.filters) * self.bucket_seconds
+        added = self.exact.get(key)
+        if added is not None and now - added < window:
+            self.exact_hits += 1
+            return None
+
+        positions = self.filters[0].positions(key)
+        for bloom in self.filters:
+            if bloom.contains(positions):
+                self.filter_hits += 1
+                return None
+        self.misses += 1
+        return positions
+
+    def seen(self, key, remember=True):
+        """
+        Check if key was seen in the window, and remember it if not
+
+        :param key: <str>
+        :param remember: <bool> False to only check, the key can then be
+            remembered with add() once the item turned out to be valid
+        :return: <bool> True if seen before (or a false positive)
+        """
+        with self.lock:
+            now = self.clock()
+            self.rotate(now)
+            positions = self.lookup(key, now)
+            if positions is None:
+                return True
+            if remember:
+                self.filters[0].add(positions)
+                self.exact.put(key, now)
+            return False
+
+    def add(self, key):
+        # Remember key without counting it as a check
+        with self.lock:
+            now = self.clock()
+            self.rotate(now)
+            self.filters[0].add(self.filters[0].positions(key))
+            self.exact.put(key, now)
+
+    def stats(self):
+        with self.lock:
+            checks = self.exact_hits + self.filter_hits + self.misses
+            miss_rate = 1.0
+            for bloom in self.filters:
+                miss_rate *= 1 - bloom.fill_rate()
+            return {'exact_hits': self.exact_hits,
+                    'filter_hits': self.filter_hits,
+                    'misses': self.misses,
+                    'hit_rate': (checks - self.misses) / checks
+                    if checks > 0 else 0.0,
+                    'rotations': self.rotations,
+                    'exact_size': len(self.exact),
+                    'filter_bytes': sum(len(bloom.array)
+                                        for bloom in self.filters),
+                    'hashes': self.filters[0].hashes,
+                    'false_positive_budget': self.false_positive_rate,
+                    'false_positive_estimate': 1 - miss_rate}
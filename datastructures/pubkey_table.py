@@ -0,0 +1,93 @@
+from threading import Lock
+
+
+class PubkeyTable(object):
+    """
+    Interns pubkeys: every pubkey gets a small integer id the first time it is
+    seen. Pools and tallies store the id instead of another copy of the 128
+    character hex string, and the address of a pubkey is only derived once.
+    Ids of pubkeys nothing holds any more are given back by sweep() and
+    reused, so the table stays as large as the pools and chain tail are,
+    not as the amount of pubkeys seen since startup. Thread safe
+    """
+    def __init__(self, addr_function):
+        self.addr_function = addr_function
+        self.ids = {}
+        self.pubkeys = []  # Indexed by id, None if the id is free
+        self.addrs = []  # Indexed by id, None until asked for
+        self.touched = []  # Indexed by id, generation it was last interned in
+        self.free = []  # Ids given back by sweep(), reused first
+        self.generation = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def intern(self, pubkey):
+        with self.lock:
+            pubkey_id = self.ids.get(pubkey, None)
+            if pubkey_id is not None:
+                self.hits += 1
+                self.touched[pubkey_id] = self.generation
+                return pubkey_id
+            self.misses += 1
+            if len(self.free) > 0:
+                pubkey_id = self.free.pop()
+                self.pubkeys[pubkey_id] = pubkey
+                self.addrs[pubkey_id] = None
+                self.touched[pubkey_id] = self.generation
+            else:
+                pubkey_id = len(self.pubkeys)
+                self.pubkeys.append(pubkey)
+                self.addrs.append(None)
+                self.touched.append(self.generation)
+            self.ids[pubkey] = pubkey_id
+            return pubkey_id
+
+    # Id of a pubkey seen before, None if unknown. Doesn't intern, so that
+    # unvalidated input can't grow the table
+    def lookup(self, pubkey):
+        return self.ids.get(pubkey, None)
+
+    def pubkey(self, pubkey_id):
+        return self.pubkeys[pubkey_id]
+
+    def addr(self, pubkey_id):
+        addr = self.addrs[pubkey_id]
+        if addr is None:
+            addr = self.addr_function(self.pubkeys[pubkey_id])
+            self.addrs[pubkey_id] = addr
+        return addr
+
+    def sweep(self, live):
+        """
+        Free the ids that are not live and weren't interned since the previous
+        sweep. The latter keeps ids that are on their way into a pool
+
+        :param live: <set> ids still held, e.g. Clockchain.live_pubkeys()
+        :return: <int> amount of ids freed
+        """
+        with self.lock:
+            freed = 0
+            for pubkey_id, pubkey in enumerate(self.pubkeys):
+                if pubkey is None or pubkey_id in live \
+                        or self.touched[pubkey_id] == self.generation:
+                    continue
+                del self.ids[pubkey]
+                self.pubkeys[pubkey_id] = None
+                self.addrs[pubkey_id] = None
+                self.free.append(pubkey_id)
+                freed += 1
+            self.generation += 1
+            self.evicted += freed
+            return freed
+
+    def __len__(self):
+        return len(self.ids)
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.ids),
+                    'addrs': sum(addr is not None for addr in self.addrs),
+                    'hits': self.hits, 'misses': self.misses,
+                    'evicted': self.evicted}
@@ -0,0 +1,210 @@
+import json
+import hashlib
+from utils.pki import pubkeys
+
+# Marks fields a record was created without, so that they stay absent
+MISSING = object()
+
+
+def pack_hex(value):
+    # Lowercase hex strings are stored as raw bytes, at half the size.
+    # Anything else (e.g. the genesis tick's placeholders) is kept as is
+    if type(value) is not str or len(value) % 2 != 0:
+        return value
+    try:
+        packed = bytes.fromhex(value)
+    except ValueError:
+        return value
+    return packed if packed.hex() == value else value
+
+
+def unpack_hex(value):
+    return value.hex() if type(value) is bytes else value
+
+
+class Record(object):
+    """
+    Compact read-only form of a JSON wire dict: known fields live in slots,
+    with the hex fields (signatures, refs) stored as raw bytes and pubkeys as
+    their id in the process-wide pubkey table (utils.pki.pubkeys).
+    Reads like the wire dict (record['pubkey'] gives the hex string back), and
+    to_dict() rebuilds the wire dict exactly. Canonical encodings and hashes
+    are cached per set of excluded keys, so records must not be modified.
+    Once a record is stored its encodings are rarely needed again, compact()
+    drops them (ticks keep their hashes, which are their references)
+    """
+    __slots__ = ('extra', 'cache')
+    fields = ()
+    hex_fields = ()
+    interned_fields = ('pubkey',)
+
+    @classmethod
+    def from_dict(cls, wire):
+        if isinstance(wire, cls):
+            return wire
+        record = cls.__new__(cls)
+        # Keys the schema doesn't know about, kept for the round trip
+        extra = {key: value for key, value in wire.items()
+                 if key not in cls.fields}
+        for field in cls.fields:
+            value = wire.get(field, MISSING)
+            if field in cls.interned_fields and value is not MISSING \
+                    and type(value) is not str:
+                # Only strings get interned, anything else is kept aside
+                extra[field] = value
+                value = MISSING
+            setattr(record, field, record.load(field, value))
+        record.extra = extra if len(extra) > 0 else None
+        record.cache = None
+        return record
+
+    def load(self, field, value):
+        if field in self.interned_fields and value is not MISSING:
+            return pubkeys.intern(value)
+        return pack_hex(value) if field in self.hex_fields else value
+
+    def dump(self, field, value):
+        return self.wire_value(field, value)
+
+    def wire_value(self, field, value):
+        if field in self.interned_fields:
+            return pubkeys.pubkey(value)
+        return unpack_hex(value)
+
+    def to_dict(self, exclude=()):
+        wire = {}
+        for field in self.fields:
+            value = getattr(self, field)
+            if value is not MISSING and field not in exclude:
+                wire[field] = self.dump(field, value)
+        if self.extra is not None:
+            for key, value in self.extra.items():
+                if key not in exclude:
+                    wire[key] = value
+        return wire
+
+    def cached(self, exclude):
+        exclude = tuple(exclude)
+        if self.cache is None:
+            self.cache = {}
+        entry = self.cache.get(exclude, None)
+        if entry is None or entry[0] is None:
+            # Same as helpers.standard_encode on the wire dict
+            encoded = bytes(json.dumps(self.to_dict(exclude), sort_keys=True,
+                                       separators=(',', ':')), 'utf-8')
+            entry = (encoded, hashlib.sha256(encoded).hexdigest())
+            self.cache[exclude] = entry
+        return entry
+
+    def encode(self, exclude=()):
+        return self.cached(exclude)[0]
+
+    def hash(self, exclude=()):
+        entry = self.cache.get(tuple(exclude), None) if self.cache else None
+        if entry is not None:
+            return entry[1]
+        return self.cached(exclude)[1]
+
+    def compact(self):
+        self.cache = None
+
+    # ---- Read access like the wire dict ----
+    # Nested records (a tick's pings) are handed out as records, not dicts
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            value = getattr(self, key)
+            if value is not MISSING:
+                return self.wire_value(key, value)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return type(self).__name__ + '(' + repr(self.to_dict()) + ')'
+
+
+class Ping(Record):
+    __slots__ = ('pubkey', 'nonce', 'reference', 'timestamp', 'signature')
+    fields = __slots__
+    hex_fields = ('reference', 'signature')
+
+
+class Tick(Record):
+    __slots__ = ('pubkey', 'nonce', 'list', 'prev_tick', 'height', 'signature',
+                 'this_tick')
+    fields = __slots__
+    hex_fields = ('prev_tick', 'signature', 'this_tick')
+
+    def load(self, field, value):
+        if field == 'list' and type(value) is list:
+            # Pings that are records already (e.g. from the ping pool) are
+            # shared instead of copied
+            return tuple(Ping.from_dict(ping) if isinstance(ping, dict)
+                         else ping for ping in value)
+        return Record.load(self, field, value)
+
+    def dump(self, field, value):
+        if field == 'list' and type(value) is tuple:
+            return [ping.to_dict() if isinstance(ping, Record) else ping
+                    for ping in value]
+        return Record.dump(self, field, value)
+
+    def compact(self):
+        if self.cache is not None:
+            self.cache = {exclude: (None, hashed)
+                          for exclude, (_, hashed) in self.cache.items()}
+        if type(self.list) is tuple:
+            for ping in self.list:
+                if isinstance(ping, Record):
+                    ping.compact()
+
+
+# Pubkey id of a record or wire dict, for pools and tallies keyed on ids
+def pubkey_id(item):
+    if isinstance(item, Record):
+        return item.pubkey
+    return pubkeys.intern(item['pubkey'])
+
+
+# Short identifier of a ping, by which compact ticks reference it: the start
+# of its signature, which is unique per ping. None if it has no signature
+PING_ID_LENGTH = 16
+
+
+def ping_id(ping):
+    signature = ping.get('signature', None)
+    return signature[:PING_ID_LENGTH] if type(signature) is str else None
+
+
+# Chain slots ({ref: tick}) between their record and their wire/disk form.
+# Chain ticks are keyed on their ref, so they go out without "this_tick"
+def slot_from_dict(slot):
+    return {ref: Tick.from_dict(tick) for ref, tick in slot.items()}
+
+
+def slot_to_dict(slot):
+    return {ref: tick.to_dict(exclude=('this_tick',))
+            if isinstance(tick, Record) else tick
+            for ref, tick in slot.items()}
@@ -0,0 +1,132 @@
+from collections import deque
+from datastructures.continuity import BranchTally
+
+
+class TickNode(object):
+    __slots__ = ('ref', 'tick', 'parent', 'children', 'slot', 'continuity',
+                 'tally')
+
+    def __init__(self, ref, tick, parent, slot):
+        self.ref = ref
+        self.tick = tick
+        self.parent = parent  # Node of tick['prev_tick'], None if not held
+        self.children = []
+        self.slot = slot  # {ref: node} of the slot the node is in
+        self.continuity = 0.0
+        self.tally = None  # Only kept while the node is a tip
+
+
+class TickDag(object):
+    """
+    Ticks selected to the chain, linked to the node of their prev_tick and
+    indexed by ref. Tied ticks make it a tree rather than a line: the tips
+    are the ticks of the latest slot, and every node caches the cumulative
+    continuity its branch had when it was selected. Tips also keep the
+    running tally of their branch (see continuity.py) to score new ticks on.
+
+    Memory stays bounded however often ticks tie: only the last max_length
+    slots are kept, and a tick that no tip descends from any more is pruned
+    right away, together with the ancestors it leaves without descendants
+    """
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self.nodes = {}
+        self.slots = deque()  # {ref: node} per slot, oldest first
+        self.pruned = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, ref):
+        return ref in self.nodes
+
+    def node(self, ref):
+        return self.nodes.get(ref, None)
+
+    def tips(self):
+        return self.slots[-1] if len(self.slots) > 0 else {}
+
+    # Tip with the highest cumulative continuity, first of the slot on ties
+    def best_tip(self):
+        best = None
+        for node in self.tips().values():
+            if best is None or node.continuity > best.continuity:
+                best = node
+        return best
+
+    def ancestors(self, ref):
+        # Nodes from ref back to the oldest one still held
+        node = self.nodes.get(ref, None)
+        while node is not None:
+            yield node
+            node = node.parent
+
+    # Same as helpers.measure_tick_continuity() of tick on top of the chain
+    def score(self, tick):
+        window = len(self.slots) + 1
+        parent = self.nodes.get(tick['prev_tick'], None)
+        if parent is None or parent.tally is None:
+            return len(tick['list']) / window
+        return parent.tally.score(tick, window)
+
+    def add_slot(self, slot):
+        """
+        Append a slot of (tied) ticks on top of the current tips
+
+        :param slot: <dict> {ref: tick} of ticks selected at one height
+        """
+        if len(self.slots) == self.max_length:
+            for node in self.slots.popleft().values():
+                del self.nodes[node.ref]
+                for child in node.children:
+                    child.parent = None
+            # Branches that don't reach back that far have nothing to evict
+            for tip in self.tips().values():
+                if len(tip.tally.ticks) > len(self.slots):
+                    tip.tally.evict_oldest()
+
+        old_tips = self.tips()
+        new_slot = {}
+        for ref, tick in slot.items():
+            parent = self.nodes.get(tick['prev_tick'], None)
+            node = TickNode(ref, tick, parent, new_slot)
+            tally = parent.tally if parent is not None \
+                and parent.tally is not None else BranchTally()
+            node.tally = tally.extended(tick)
+            if parent is not None:
+                parent.children.append(node)
+            new_slot[ref] = node
+            self.nodes[ref] = node
+
+        self.slots.append(new_slot)
+        for node in new_slot.values():
+            node.continuity = node.tally.total / len(self.slots)
+
+        # Old tips are interior nodes now, or dead ends if not extended
+        for node in list(old_tips.values()):
+            node.tally = None
+            if len(node.children) == 0:
+                self.prune(node)
+
+    def prune(self, node):
+        # Remove a node no tip descends from, and then every ancestor that
+        # this leaves without descendants
+        while node is not None and len(node.children) == 0:
+            del self.nodes[node.ref]
+            del node.slot[node.ref]
+            self.pruned += 1
+
+            parent = node.parent
+            if parent is not None:
+                parent.children.remove(node)
+            node = parent
+
+    # Slots as {ref: tick} dicts, oldest first. A slot is only ever pruned
+    # empty below a tick whose prev_tick wasn't held, those are left out
+    def slot_dicts(self):
+        return [{ref: node.tick for ref, node in slot.items()}
+                for slot in self.slots if len(slot) > 0]
+
+    def stats(self):
+        return {'slots': len(self.slots), 'nodes': len(self.nodes),
+                'tips': len(self.tips()), 'pruned': self.pruned}
@@ -0,0 +1,46 @@
+import heapq
+import itertools
+from threading import Lock
+
+
+class TickPool(object):
+    """
+    Ticks received this cycle, as a heap ordered by continuity (highest first)
+    plus an index from tick reference to the ticks carrying it
+    """
+    def __init__(self):
+        self.heap = []
+        self.by_ref = {}
+        # Makes sure that in the case of equal continuity, the first tick
+        # inserted (FIFO) comes first
+        self.counter = itertools.count()
+        self.lock = Lock()
+
+    def put(self, tick, continuity):
+        # Minus sign on continuity since heapq returns the *lowest* item first
+        entry = (-continuity, next(self.counter), tick)
+        with self.lock:
+            heapq.heappush(self.heap, entry)
+            self.by_ref.setdefault(tick.get('this_tick', None), []).append(tick)
+
+    # Highest continuity tick, or None if the pool is empty
+    def peek(self):
+        with self.lock:
+            if len(self.heap) > 0:
+                return self.heap[0][2]
+            return None
+
+    def get_by_refs(self, references):
+        with self.lock:
+            # In the order of references, a set would order them by hash
+            return [tick for ref in dict.fromkeys(references)
+                    for tick in self.by_ref.get(ref, [])]
+
+    # (continuity, tick) pairs, highest continuity first
+    def snapshot(self):
+        with self.lock:
+            entries = sorted(self.heap)
+        return [(-continuity, tick) for continuity, _, tick in entries]
+
+    def __len__(self):
+        return len(self.heap)
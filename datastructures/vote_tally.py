@@ -0,0 +1,69 @@
+from threading import Condition
+
+
+class VoteTally(object):
+    """
+    Live vote counts per tick reference. Refs are also kept in buckets by
+    their count, so the leading refs are known without sorting. Every change
+    bumps version and wakes up anyone waiting in wait_for_change()
+    """
+    def __init__(self):
+        self.condition = Condition()
+        self.counts = {}
+        self.buckets = {}  # count -> refs with that count (dict as ordered set)
+        self.top_score = 0
+        self.version = 0
+
+    def move(self, old_ref, new_ref):
+        # A voter's vote going from old_ref (None if first vote) to new_ref
+        with self.condition:
+            if old_ref == new_ref:
+                return
+            if old_ref is not None:
+                self.change(old_ref, -1)
+            self.change(new_ref, 1)
+            self.version += 1
+            self.condition.notify_all()
+
+    def change(self, ref, delta):
+        count = self.counts.get(ref, 0)
+        if count > 0:
+            del self.buckets[count][ref]
+            if len(self.buckets[count]) == 0:
+                del self.buckets[count]
+
+        count += delta
+        if count > 0:
+            self.counts[ref] = count
+            self.buckets.setdefault(count, {})[ref] = True
+        else:
+            self.counts.pop(ref, None)
+
+        # Counts only ever change by one, so the top moves by one at most
+        if count > self.top_score:
+            self.top_score = count
+        elif self.top_score not in self.buckets:
+            self.top_score = max(self.top_score - 1, 0)
+
+    # Refs sharing the highest amount of votes
+    def leaders(self):
+        with self.condition:
+            return list(self.buckets.get(self.top_score, {}).keys())
+
+    def get_counts(self):
+        with self.condition:
+            return dict(self.counts)
+
+    def clear(self):
+        with self.condition:
+            self.counts = {}
+            self.buckets = {}
+            self.top_score = 0
+            self.version += 1
+            self.condition.notify_all()
+
+    def wait_for_change(self, version, timeout=None):
+        # Blocks until the tally differs from the given version (or timeout)
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
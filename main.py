@@ -1,9 +1,12 @@
+import os
 import socket
 from threads.networker import Networker
 from threads.timeminer import Timeminer
 from utils.common import config, logger
 from utils.helpers import handle_exception
+from utils.validation import start_verify_workers
 from datastructures.clockchain import Clockchain
+from datastructures.chain_store import ChainStore
 
 if config['api_backend'] == "flask":
     from threads.flask_api import API
@@ -11,14 +14,27 @@ else:
     from threads.sanic_api import API
 
 
+# Disk store for the chain, one per port: the node address is random on every
+# start with generate_rand_addr, the port is what a restarted node keeps.
+# None if disabled in config
+def build_chain_store(port):
+    if not config['chain_store_dir']:
+        return None
+    return ChainStore(os.path.join(config['chain_store_dir'], str(port)),
+                      batch_size=config['chain_store_batch_size'],
+                      segment_max_bytes=config['chain_segment_max_bytes'],
+                      max_height_gap=config['chain_store_max_gap'])
+
+
 # Function using gunicorn to launch in production mode. Use below cmd to run
 # G_PORT=5000; gunicorn "main:build_app(g_port=$G_PORT)" -b localhost:$G_PORT
 def build_app(g_port):
     if config['api_backend'] == "flask":
         logger.debug("Running in production mode")
         # Clockchain datastructure and an instance for network messaging
-        g_clockchain = Clockchain()
+        g_clockchain = Clockchain(build_chain_store(g_port))
         g_networker = Networker()
+        start_verify_workers()
 
         # Timeminer handles all network validation, and API exposes messaging
         Timeminer(g_clockchain, g_networker)
@@ -34,35 +50,35 @@ def build_app(g_port):
 
 
 if __name__ == '__main__':
-    clockchain = Clockchain()
-    networker = Networker()
-
-    timeminer = Timeminer(clockchain, networker)
-
-    api = API(clockchain, networker)
-
-    app = api.create_app()
-
     port = config['default_port']
 
     # Check which port to use by check which ones taken with sockets
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
     while True:
         try:
             # This throws exception if we can't bind
             s.bind(("127.0.0.1", port))
             s.close()
-
-            networker.activate(port)
-            if config['api_backend'] == "flask":
-                app.run(host="127.0.0.1", port=port, threaded=True)  # Flask
-            else:
-                app.run(host="127.0.0.1", port=port, access_log=False)  # Sanic
-            break  # Leave break here so infinite loop stops!
+            break
         except socket.error as e:
             port = port+1
-            pass
-        except Exception as e:
-            handle_exception(e)
-            break
+
+    clockchain = Clockchain(build_chain_store(port))
+    networker = Networker()
+    start_verify_workers()
+
+    timeminer = Timeminer(clockchain, networker)
+
+    api = API(clockchain, networker)
+
+    app = api.create_app()
+
+    try:
+        networker.activate(port)
+        if config['api_backend'] == "flask":
+            app.run(host="127.0.0.1", port=port, threaded=True)  # Flask
+        else:
+            app.run(host="127.0.0.1", port=port, access_log=False,
+                    single_process=True)  # Sanic
+    except Exception as e:
+        handle_exception(e)
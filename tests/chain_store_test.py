@@ -0,0 +1,92 @@
+import os
+import pytest
+from utils.common import config
+from datastructures.chain_store import ChainStore, INDEX_ENTRY
+from datastructures.clockchain import Clockchain
+
+
+def make_slot(height, refs):
+    return {ref: {'height': height, 'prev_tick': 'prev', 'pubkey': 'pubkey',
+                  'nonce': 0, 'list': [{'pubkey': ref, 'timestamp': 0}]}
+            for ref in refs}
+
+
+def test_chain_store_append_and_read(tmp_path):
+    store = ChainStore(str(tmp_path), batch_size=2, segment_max_bytes=300)
+    slots = [make_slot(height, ['%064x' % height])
+             for height in [0, 1, 2, 4]]
+    slots.append(make_slot(5, ['%064x' % 5, 'tied']))
+    for slot in slots:
+        store.append(slot)
+
+    # Last slot still pending in the batch, but readable already
+    assert store.read(5) == slots[4]
+    store.close()
+
+    store = ChainStore(str(tmp_path))
+    assert store.read(3) is None
+    assert store.read(4) == slots[3]
+    assert [height for height, _ in store.read_range(1, 10)] == [1, 2, 4, 5]
+    assert store.read_ref('tied') == slots[4]['tied']
+    assert store.height_of('%064x' % 2) == 2
+    assert store.tail(2) == slots[3:]
+    assert len(list(tmp_path.glob('segment_*.log'))) > 1
+    store.close()
+
+
+def test_chain_store_ignores_partial_index_entry(tmp_path):
+    store = ChainStore(str(tmp_path))
+    store.append(make_slot(0, ['a']))
+    store.close()
+
+    with open(str(tmp_path / 'index.bin'), 'ab') as index_file:
+        index_file.write(b'\1' * (INDEX_ENTRY.size // 2))
+
+    store = ChainStore(str(tmp_path))
+    assert store.next_height() == 1
+    assert store.read(0) == make_slot(0, ['a'])
+    store.close()
+
+
+def test_chain_store_ref_table_grows(tmp_path):
+    store = ChainStore(str(tmp_path))
+    refs = ['%064x' % (idx * 7919) for idx in range(1500)] + ['genesis']
+    for height, ref in enumerate(refs):
+        store.append(make_slot(height, [ref]))
+    store.close()
+
+    store = ChainStore(str(tmp_path))
+    assert all(store.height_of(ref) == height
+               for height, ref in enumerate(refs))
+    assert store.height_of('%064x' % 1) is None
+    store.close()
+
+
+def test_chain_store_height_gap(tmp_path):
+    store = ChainStore(str(tmp_path), max_height_gap=10 ** 6)
+    store.append(make_slot(0, ['a']))
+    store.append(make_slot(10 ** 6, ['b']))
+    with pytest.raises(ValueError):
+        store.append(make_slot(3 * 10 ** 6, ['c']))
+    store.close()
+
+    # The gap isn't written out
+    index = os.stat(str(tmp_path / 'index.bin'))
+    assert index.st_size == (10 ** 6 + 1) * INDEX_ENTRY.size
+    assert index.st_blocks * 512 < index.st_size // 10
+    store = ChainStore(str(tmp_path))
+    assert store.read(10 ** 6) == make_slot(10 ** 6, ['b'])
+    store.close()
+
+
+def test_clockchain_restores_tail_from_store(tmp_path):
+    store = ChainStore(str(tmp_path))
+    clockchain = Clockchain(store)
+    for height in range(1, config['chain_max_length'] + 3):
+        slot = make_slot(height, ['%064x' % height])
+        clockchain.append_to_chain(slot)
+    store.close()
+
+    restored = Clockchain(ChainStore(str(tmp_path)))
+    assert restored.chainlist() == clockchain.chainlist()
+    assert restored.current_height() == config['chain_max_length'] + 2
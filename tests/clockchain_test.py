@@ -0,0 +1,68 @@
+import threading
+import random
+from utils.common import config
+from utils.helpers import measure_tick_continuity
+from datastructures.clockchain import Clockchain
+from datastructures.records import ping_id
+
+
+def make_tick(ref, prev_ref, pubkeys):
+    return {'this_tick': ref, 'prev_tick': prev_ref, 'height': 0,
+            'pubkey': 'pubkey', 'nonce': 0,
+            'list': [{'pubkey': pubkey, 'timestamp': 0} for pubkey in pubkeys]}
+
+
+def random_pubkeys():
+    return random.sample(['a', 'b', 'c', 'd', 'e'], random.randint(1, 5))
+
+
+def test_running_continuity_matches_full_walk():
+    random.seed(1)
+    clockchain = Clockchain()
+
+    for slot in range(3 * config['chain_max_length']):
+        tips = list(clockchain.possible_previous_ticks().keys())
+        candidates = [make_tick('t' + str(slot) + '_' + str(idx),
+                                random.choice(tips), random_pubkeys())
+                      for idx in range(3)]
+
+        for tick in candidates:
+            expected = measure_tick_continuity(
+                clockchain.json_tick_to_chain_tick(tick),
+                clockchain.chainlist())
+            assert clockchain.measure_continuity(tick) == expected
+
+        # Sometimes a tie, so the chain forks
+        winners = candidates[:random.randint(1, 2)]
+        tick_dict = {}
+        for tick in winners:
+            tick_dict.update(clockchain.json_tick_to_chain_tick(tick))
+        clockchain.append_to_chain(tick_dict)
+
+
+def test_current_tick_ref_waits_for_first_tick():
+    clockchain = Clockchain()
+    assert clockchain.current_tick_ref(timeout=0.01) is None
+
+    genesis_ref = next(iter(clockchain.possible_previous_ticks()))
+    tick = make_tick('tick', genesis_ref, ['a'])
+    threading.Timer(0.05, clockchain.add_to_tick_pool, [tick]).start()
+
+    assert clockchain.current_tick_ref(timeout=5) == \
+        clockchain.get_tick_ref(tick)
+
+
+def test_ping_index_follows_pools():
+    clockchain = Clockchain()
+    pooled = {'pubkey': 'a', 'timestamp': 0, 'signature': 'aa' * 64}
+    in_tick = {'pubkey': 'b', 'timestamp': 0, 'signature': 'bb' * 64}
+    tick = make_tick('t', clockchain.prev_tick_ref(), [])
+    tick['list'] = [in_tick]
+    clockchain.add_to_ping_pool(pooled)
+    clockchain.add_to_tick_pool(tick)
+
+    ids = [ping_id(pooled), ping_id(in_tick), 'unknown']
+    assert set(clockchain.find_pings(ids)) == set(ids[:2])
+    # Pings of the ping pool outlive the cycle, those of ticks don't
+    clockchain.restart_cycle()
+    assert set(clockchain.find_pings(ids)) == {ids[0]}
@@ -0,0 +1,71 @@
+import json
+import time
+from benchmarks.common import signed
+from utils import wire
+from utils.pki import get_kp
+from utils.common import config
+from utils.helpers import hasher
+from datastructures.clockchain import Clockchain
+from datastructures.records import ping_id
+from threads.networker import Networker, accept_post
+from threads.flask_api import API
+
+
+def test_compact_tick_rebuilt_from_pool(monkeypatch):
+    monkeypatch.setitem(config, 'difficulty', 1)
+    clockchain = Clockchain()
+    reference = clockchain.prev_tick_ref()
+    pings = [signed({'timestamp': 0, 'reference': reference}, get_kp())
+             for _ in range(3)]
+    tick = signed({'list': pings, 'prev_tick': reference, 'height': 1},
+                  get_kp())
+    tick['this_tick'] = hasher(tick, exclude=('signature',))
+
+    # Sender side: peers that advertised it get the compact tick
+    sender = Networker()
+    sender.port = 5001
+    url = 'http://127.0.0.1:5000/forward/tick?addr=a&redistribute=1'
+    sender.note_response(url, 202, {'Accept-Post': accept_post()})
+    bodies = sender.encode_bodies(tick, 'tick')
+    body, headers = sender.body_for(url, bodies)
+    assert headers == wire.COMPACT_TICK_HEADERS
+    assert len(body) * 2 < len(bodies['json'])
+    assert json.loads(body)['ping_ids'] == [ping_id(ping) for ping in pings]
+
+    # Receiver has two of the pings, and fetches the third from the sender
+    for ping in pings[:2]:
+        clockchain.add_to_ping_pool(ping)
+    receiver = Networker()
+    fetched = []
+
+    def fetch_pings(source, ids, timeout):
+        fetched.append((source, ids))
+        return {ping_id(pings[2]): pings[2]}
+    monkeypatch.setattr(receiver, 'fetch_pings', fetch_pings)
+
+    api = API(clockchain, receiver)
+    client = api.create_app().test_client()
+    too_many = ['id'] * (config['compact_max_ping_ids'] + 1)
+    for bad in [dict(json.loads(body), source_port=0),
+                dict(json.loads(body), ping_ids=too_many)]:
+        response = client.post('/forward/tick?addr=a&redistribute=0',
+                               data=json.dumps(bad), headers=headers)
+        assert response.status_code == 400
+    response = client.post('/forward/tick?addr=a&redistribute=0',
+                           data=body, headers=headers)
+    assert response.status_code == 202
+
+    end = time.time() + 10
+    while clockchain.tick_pool_size() == 0 and time.time() < end:
+        time.sleep(0.01)
+    assert fetched == [('http://127.0.0.1:5001', [ping_id(pings[2])])]
+    assert hasher(clockchain.tick_pool.peek(), exclude=('signature',
+                                                         'this_tick')) \
+        == tick['this_tick']
+    assert api.ingress.stats()['compact_ticks'] == {
+        'ticks': 1, 'known_pings': 2, 'fetched_pings': 1,
+        'fetches_dropped': 0}
+
+    # Pings are served by id to the peers we sent compact ticks to
+    response = client.post('/info/pings', json=[ping_id(pings[2]), 'none'])
+    assert response.get_json() == [pings[2]]
@@ -0,0 +1,85 @@
+import time
+from benchmarks.common import make_ping
+from datastructures.clockchain import Clockchain
+from datastructures.dedup_filter import DedupFilter
+from threads.flask_api import API
+from threads.networker import Networker
+from utils.common import config
+from utils.pki import get_kp
+from utils.validation import seen_before
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_keys_expire_after_window():
+    clock = Clock()
+    dedup = DedupFilter(window_seconds=10, buckets=5, capacity=100,
+                        false_positive_rate=0.01, exact_size=2, clock=clock)
+
+    assert not dedup.seen('a')
+    assert dedup.seen('a')
+    for key in ['b', 'c', 'd']:  # Pushes 'a' out of the exact LRU
+        assert not dedup.seen(key)
+    clock.now += 9.9
+    assert dedup.seen('a')  # Answered by the filters
+
+    clock.now += 2.1  # One bucket past the window
+    assert not dedup.seen('a')
+
+    stats = dedup.stats()
+    assert (stats['exact_hits'], stats['filter_hits'], stats['misses']) \
+        == (1, 1, 5)
+    assert stats['rotations'] == 6 and stats['filter_bytes'] > 0
+
+
+def test_false_positives_within_budget():
+    dedup = DedupFilter(window_seconds=10, buckets=5, capacity=2000,
+                        false_positive_rate=0.01, exact_size=16)
+    for idx in range(1000):
+        dedup.seen('key' + str(idx))
+    # New keys get added too, up to capacity
+    false_positives = sum(dedup.seen('other' + str(idx))
+                          for idx in range(1000))
+    assert false_positives / 1000 < 0.01
+    assert dedup.stats()['false_positive_estimate'] < 0.01
+
+
+def test_only_checks_until_added():
+    dedup = DedupFilter(window_seconds=10, buckets=5, capacity=100,
+                        false_positive_rate=0.01, exact_size=16)
+    assert not dedup.seen('a', remember=False)
+    assert not dedup.seen('a', remember=False)
+    dedup.add('a')
+    assert dedup.seen('a', remember=False)
+
+
+def test_forged_copy_does_not_block_original(monkeypatch):
+    monkeypatch.setitem(config, 'difficulty', 1)
+    clockchain = Clockchain()
+    ping = make_ping(get_kp(), clockchain.prev_tick_ref())
+    # Same signature, other contents: fails validation in the worker
+    forged = dict(ping, timestamp=ping['timestamp'] + 1)
+
+    api = API(clockchain, Networker())
+    client = api.create_app().test_client()
+    for processed, item in enumerate([forged, ping], 1):
+        response = client.post('/forward/ping?addr=a&redistribute=0',
+                               json=item)
+        assert response.status_code == 202
+        end = time.time() + 10
+        while sum(api.ingress.stats()['ping'][key]
+                  for key in ('added', 'invalid')) < processed \
+                and time.time() < end:
+            time.sleep(0.01)
+
+    assert api.ingress.stats()['ping']['invalid'] == 1
+    assert len(clockchain.ping_pool) == 1
+    assert seen_before(ping)
+    response = client.post('/forward/ping?addr=a&redistribute=0', json=ping)
+    assert response.status_code == 400
@@ -0,0 +1,51 @@
+import threading
+from utils.common import config
+from utils.fanout import Fanout
+from threads.networker import Networker
+
+
+def test_quorum_and_completion():
+    completed = []
+    fanout = Fanout(3, on_complete=completed.append)
+
+    threading.Timer(0.01, fanout.finish, [True]).start()
+    threading.Timer(0.02, fanout.finish, [True]).start()
+    assert fanout.wait_for_acks(2, timeout=5)
+    assert completed == []
+
+    fanout.finish(False)
+    assert fanout.wait(timeout=0) and completed == [fanout]
+    assert fanout.acks == 2 and fanout.seconds > 0
+
+    # Every post finished without reaching quorum: no waiting for timeout
+    failed = Fanout(1)
+    failed.finish(False)
+    assert not failed.wait_for_acks(1, timeout=60)
+
+
+def test_forwards_beyond_queue_size_are_dropped(monkeypatch):
+    monkeypatch.setitem(config, 'forward_queue_size', 1)
+    monkeypatch.setitem(config, 'forward_timeout', 0.1)
+    networker = Networker()
+    for port in range(3):
+        networker.peers['http://127.0.0.1:' + str(port)] = str(port)
+    release = threading.Event()
+    posted = []
+
+    class Response(object):
+        status_code = 202
+        headers = {}
+
+    def post(url, **kwargs):
+        release.wait(5)
+        posted.append(url)
+        return Response()
+    monkeypatch.setattr(networker.sessions, 'post', post)
+
+    # One post holds the only slot, the other two get dropped
+    assert not networker.forward({'a': 1}, 'ping', 'me', quorum=1)
+    assert networker.forward_stats_dict()['dropped'] == 2
+    release.set()
+    networker.forward_pool.shutdown(wait=True)
+    assert len(posted) == 1
+    assert networker.forward_slots.acquire(blocking=False)
@@ -0,0 +1,92 @@
+import time
+import threading
+from benchmarks.common import make_ping
+from utils.pki import get_kp
+from utils.common import config
+from utils.validation import ping_pipeline
+from datastructures.clockchain import Clockchain
+from threads.ingress import Ingress
+
+
+class StubNetworker(object):
+    def __init__(self, stage):
+        self.stage = stage
+        self.forwarded = []
+
+    def forward(self, **kwargs):
+        self.forwarded.append(kwargs['route'])
+
+
+def test_shedding_and_full_queues():
+    networker = StubNetworker('select')
+    ingress = Ingress(Clockchain(), networker, queue_size=1, workers=0)
+
+    assert ingress.submit('tick', {}, 'origin', 0) == 'shed'
+    assert ingress.submit('ping', {}, 'origin', 0) is None
+    assert ingress.submit('ping', {}, 'origin', 0) == 'full'
+
+    networker.stage = 'vote'
+    assert ingress.submit('ping', {}, 'origin', 0) == 'shed'
+    assert ingress.submit('vote', {}, 'origin', 0) is None
+
+    stats = ingress.stats()
+    assert stats['tick']['shed'] == 1
+    assert stats['ping'] == dict(stats['ping'], accepted=1, dropped=1,
+                                 shed=1, depth=1, capacity=1)
+    assert stats['vote']['depth'] == 1
+
+
+def test_workers_validate_add_and_forward(monkeypatch):
+    monkeypatch.setitem(config, 'difficulty', 1)
+    clockchain = Clockchain()
+    networker = StubNetworker('ping')
+    ingress = Ingress(clockchain, networker, queue_size=10, workers=2)
+
+    ping = make_ping(get_kp(), clockchain.prev_tick_ref(), timestamp=0)
+    assert ingress.submit('ping', ping, 'origin', 1) is None
+    assert ingress.submit('ping', dict(ping, nonce=-1), 'origin', 1) is None
+
+    end = time.time() + 10
+    while ingress.latency['ping'].passed + ingress.latency['ping'].rejected \
+            < 2 and time.time() < end:
+        time.sleep(0.01)
+
+    stats = ingress.stats()['ping']
+    assert stats['added'] == 1 and stats['invalid'] == 1
+    assert clockchain.get_ping(ping['pubkey']) == ping
+    assert networker.forwarded == ['ping']
+
+
+def test_concurrent_copies_validated_once(monkeypatch):
+    monkeypatch.setitem(config, 'difficulty', 1)
+    clockchain = Clockchain()
+    networker = StubNetworker('ping')
+    ingress = Ingress(clockchain, networker, queue_size=10, workers=4)
+
+    # The first copy is held while being added, the other workers take the
+    # rest out of the queue meanwhile
+    others_done = threading.Event()
+    add_to_ping_pool = clockchain.add_to_ping_pool
+
+    def held_add(ping):
+        others_done.wait(10)
+        add_to_ping_pool(ping)
+    monkeypatch.setattr(clockchain, 'add_to_ping_pool', held_add)
+
+    ping = make_ping(get_kp(), clockchain.prev_tick_ref(), timestamp=0)
+    signatures = ping_pipeline.stats['signatures'].to_dict()['passed']
+    for _ in range(4):
+        assert ingress.submit('ping', dict(ping), 'origin', 1) is None
+
+    end = time.time() + 10
+    while ingress.stats()['ping']['invalid'] < 3 and time.time() < end:
+        time.sleep(0.01)
+    others_done.set()
+    while ingress.stats()['ping']['added'] < 1 and time.time() < end:
+        time.sleep(0.01)
+
+    stats = ingress.stats()['ping']
+    assert stats['added'] == 1 and stats['invalid'] == 3
+    assert ping_pipeline.stats['signatures'].to_dict()['passed'] \
+        == signatures + 1
+    assert networker.forwarded == ['ping']
@@ -0,0 +1,50 @@
+import pytest
+from utils.common import config
+from utils.helpers import hasher, standard_encode
+from utils.mining import mine_parallel, last_run, MiningTemplate
+from utils.mining import search_nonces
+from utils.validation import validate_difficulty
+
+
+def test_mine_parallel(monkeypatch):
+    monkeypatch.setitem(config, 'difficulty', 2)
+    ping = {'pubkey': 'pubkey', 'timestamp': 1521393955, 'reference': 'ref'}
+
+    for processes in [1, 2]:
+        hashed, nonce = mine_parallel(ping, processes=processes)
+        assert ping['nonce'] == nonce
+        assert hashed == hasher(ping)
+        assert validate_difficulty(hashed)
+        assert last_run['processes'] == processes
+        assert last_run['hashes'] > 0
+
+
+def test_mining_template_matches_hasher():
+    ping = {'pubkey': 'pubkey', 'timestamp': 1521393955, 'reference': 'ref',
+            'signature': 'sig'}
+    tick = {'list': [dict(ping, nonce=5), dict(ping, nonce=6)],
+            'pubkey': 'pubkey', 'prev_tick': 'prev', 'height': 3}
+    only_nonce = {}
+
+    for content in [ping, tick, only_nonce]:
+        template = MiningTemplate(content)
+        for nonce in [0, 7, 68696043434]:
+            content['nonce'] = nonce
+            assert template.encode(nonce) == standard_encode(content)
+            assert template.hash(nonce) == hasher(content)
+
+
+def test_jit_backend_matches_python(monkeypatch):
+    pytest.importorskip('numba')
+    monkeypatch.setitem(config, 'difficulty', 3)
+    tick = {'list': [{'pubkey': 'ab' * 64, 'nonce': 1, 'timestamp': 2,
+                      'reference': 'cd' * 32, 'signature': 'ef' * 64}] * 5,
+            'pubkey': 'pubkey', 'prev_tick': 'prev', 'height': 3}
+
+    monkeypatch.setitem(config, 'mining_backend', 'python')
+    python_result = search_nonces(MiningTemplate(tick), 12345, 3)
+
+    monkeypatch.setitem(config, 'mining_backend', 'numba')
+    template = MiningTemplate(tick)
+    assert template.jit is not None
+    assert search_nonces(template, 12345, 3) == python_result
@@ -0,0 +1,27 @@
+from utils.pki import get_kp, sign, verify, verify_batch, pubkey_to_addr
+from utils.pki import compute_addr, crypto
+
+
+def test_verify_batch():
+    keypairs = [get_kp() for _ in range(6)]
+    items = [(b'message' + bytes([idx]), sign(b'message' + bytes([idx]), priv),
+              pub) for idx, (pub, priv) in enumerate(keypairs)]
+    forged = items[:3] + [(b'forged', items[3][1], items[3][2])] + items[4:]
+
+    for processes in [1, 2]:
+        assert verify_batch(items, processes, chunk_size=2)
+        assert not verify_batch(forged, processes, chunk_size=2)
+    assert verify_batch([], 2)
+
+
+def test_crypto_context_caches():
+    pubkey, privkey = get_kp()
+    hits = crypto.addresses.hits
+    assert pubkey_to_addr(pubkey) == compute_addr(pubkey)
+    assert pubkey_to_addr(pubkey) == compute_addr(pubkey)
+    assert crypto.addresses.hits == hits + 1
+
+    signature = sign(b'message', privkey)
+    assert crypto.signing_key(privkey) is crypto.signing_key(privkey)
+    assert verify(b'message', signature, pubkey)
+    assert crypto.verifying_key(pubkey) is crypto.verifying_key(pubkey)
@@ -0,0 +1,53 @@
+from utils.pki import get_kp, compute_addr, pubkeys
+from datastructures.pubkey_table import PubkeyTable
+from datastructures.clockchain import Clockchain
+
+
+def test_interning():
+    table = PubkeyTable(compute_addr)
+    pubkey, _ = get_kp()
+
+    assert table.lookup(pubkey) is None and len(table) == 0
+    pubkey_id = table.intern(pubkey)
+    assert table.intern(pubkey) == pubkey_id and table.lookup(pubkey) == 0
+    assert table.pubkey(pubkey_id) == pubkey
+    assert table.addr(pubkey_id) == compute_addr(pubkey)
+    assert table.stats() == {'size': 1, 'addrs': 1, 'hits': 1, 'misses': 1,
+                             'evicted': 0}
+
+
+def test_sweep_frees_unused_ids():
+    table = PubkeyTable(compute_addr)
+    held, dropped, other = [get_kp()[0] for _ in range(3)]
+    held_id = table.intern(held)
+    table.intern(dropped)
+
+    # Interned since the last sweep, so kept once more
+    assert table.sweep({held_id}) == 0
+    assert table.sweep({held_id}) == 1
+    assert table.lookup(dropped) is None and len(table) == 1
+    # Freed ids get reused
+    assert table.intern(other) == 1 and table.pubkey(1) == other
+    assert table.lookup(held) == held_id
+
+
+def test_pools_keyed_on_ids():
+    clockchain = Clockchain()
+    pubkey, _ = get_kp()
+    ping = {'pubkey': pubkey, 'nonce': 1, 'reference': 'ab' * 32,
+            'timestamp': 0, 'signature': 'cd' * 64}
+
+    clockchain.add_to_ping_pool(ping)
+    clockchain.add_to_vote_pool(ping)
+    assert list(clockchain.ping_pool) == [pubkeys.lookup(pubkey)]
+    assert list(clockchain.vote_pool) == [pubkeys.lookup(pubkey)]
+    assert clockchain.get_ping(pubkey) == ping
+    assert clockchain.ping_pool_dicts() == {compute_addr(pubkey): ping}
+
+    # Pubkeys none of the pools or the chain hold are swept per cycle
+    stranger, _ = get_kp()
+    pubkeys.intern(stranger)
+    clockchain.restart_cycle()
+    clockchain.restart_cycle()
+    assert pubkeys.lookup(stranger) is None
+    assert clockchain.get_ping(pubkey) == ping
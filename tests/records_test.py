@@ -0,0 +1,55 @@
+from benchmarks.common import signed
+from utils.pki import get_kp, pubkeys
+from utils.common import config
+from utils.helpers import standard_encode, hasher, median_ts
+from utils.validation import tick_rejection
+from datastructures.records import Ping, Tick, pack_hex
+
+
+def test_round_trip_is_lossless():
+    genesis = {'pubkey': 'pubkey', 'nonce': 68696043434, 'prev_tick':
+               'prev_tick', 'height': 0, 'this_tick': 'ab' * 32,
+               'list': [{'timestamp': 0, 'pubkey': 'pubkey'}]}
+    ping = {'pubkey': 'ab' * 64, 'nonce': 1, 'reference': 'AB' * 32,
+            'timestamp': 1, 'signature': None, 'extra': [1]}
+
+    for record, wire in [(Tick.from_dict(genesis), genesis),
+                         (Ping.from_dict(ping), ping)]:
+        assert record.to_dict() == wire
+        assert record == wire
+        assert standard_encode(record) == standard_encode(wire)
+        assert hasher(record, ('signature',)) == hasher(wire, ('signature',))
+
+    record = Ping.from_dict(ping)
+    assert record.pubkey == pubkeys.lookup('ab' * 64)
+    assert type(record.signature) is not bytes  # None stays None
+    assert Ping.from_dict({**ping, 'pubkey': 5}).to_dict()['pubkey'] == 5
+    assert record['reference'] == 'AB' * 32  # Not lowercase, not packed
+    assert record['extra'] == [1] and 'signature' in record
+    assert 'missing' not in record and record.get('missing') is None
+    assert pack_hex('abc') == 'abc'
+    assert median_ts(Tick.from_dict(genesis)) == 0
+
+
+def test_records_validate_like_dicts(monkeypatch):
+    monkeypatch.setitem(config, 'difficulty', 1)
+    prev_tick = {'pubkey': 'pubkey', 'nonce': 1, 'prev_tick': 'prev',
+                 'height': 0, 'list': [{'timestamp': 0, 'pubkey': 'pubkey'}]}
+    pings = [signed({'timestamp': 0, 'reference': 'cd' * 32}, get_kp())
+             for _ in range(3)]
+    tick = signed({'list': pings, 'prev_tick': 'cd' * 32, 'height': 1},
+                  get_kp())
+
+    record = Tick.from_dict(tick)
+    assert tick_rejection(record, Tick.from_dict(prev_tick)) is None
+    assert tick_rejection(tick, prev_tick) is None
+
+    # Compacting keeps the tick's reference, and pings shared with a pool
+    ref = hasher(tick, exclude=('signature', 'this_tick'))
+    record.compact()
+    assert record.hash(('signature', 'this_tick')) == ref
+    assert Tick.from_dict({**tick, 'list': list(record.list)}).list[0] \
+        is record.list[0]
+
+    forged = Tick.from_dict({**tick, 'height': 2})
+    assert tick_rejection(forged, Tick.from_dict(prev_tick)) is not None
@@ -0,0 +1,132 @@
+import time
+import asyncio
+import pytest
+import aiohttp
+from aiohttp import web
+from benchmarks.common import make_ping
+from utils import wire
+from utils.common import config
+from utils.pki import get_kp
+from datastructures.clockchain import Clockchain
+from threads.networker import Networker, accept_post
+
+pytest.importorskip('sanic')
+from threads.sanic_api import API  # noqa: E402
+
+
+async def start_peer(received, decodes_binary=True):
+    # Peer that takes binary, as advertised in its Accept-Post
+    async def forward_ping(request):
+        received.append((request.query['redistribute'], request.content_type,
+                         await request.read()))
+        status = 202 if decodes_binary \
+            or request.content_type != wire.CONTENT_TYPE else 415
+        return web.Response(status=status,
+                            headers={'Accept-Post': accept_post()})
+
+    app = web.Application()
+    app.router.add_post('/forward/ping', forward_ping)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, 'http://127.0.0.1:' + str(runner.addresses[0][1])
+
+
+async def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        await asyncio.sleep(0.01)
+
+
+def test_forward_posts_from_the_event_loop(monkeypatch):
+    monkeypatch.setitem(config, 'forward_timeout', 1)
+    monkeypatch.setitem(config, 'difficulty', 1)
+    ping = make_ping(get_kp())
+
+    async def run():
+        received = []
+        runner, url = await start_peer(received)
+        networker = Networker()
+        networker.peers[url] = 'peer'
+        networker.peers['http://127.0.0.1:1'] = 'down'  # Nothing listens
+        api = API(Clockchain(), networker)
+        api.http = aiohttp.ClientSession()
+        posts = networker.forward_stats['posts']
+        try:
+            await api.forward(ping, 'ping', 'origin', 0)
+            await wait_for(lambda: posts.passed + posts.rejected == 2)
+            # The peer negotiated binary on the first post
+            await api.forward(ping, 'ping', 'origin', 0)
+            await wait_for(lambda: posts.passed + posts.rejected == 4)
+            # Not sent back to the peer it came from
+            await api.forward(ping, 'ping', 'peer', 0)
+            await wait_for(lambda: posts.passed + posts.rejected == 5)
+        finally:
+            await api.http.close()
+            await runner.cleanup()
+        return received, posts
+
+    received, posts = asyncio.run(run())
+    assert [(hops, content_type) for hops, content_type, _ in received] \
+        == [('1', 'application/json'), ('1', wire.CONTENT_TYPE)]
+    assert wire.decode(received[1][2], 'ping') == ping
+    assert (posts.passed, posts.rejected) == (2, 3)
+
+
+def test_rejected_binary_resent_as_json(monkeypatch):
+    monkeypatch.setitem(config, 'forward_timeout', 1)
+    monkeypatch.setitem(config, 'difficulty', 1)
+    ping = make_ping(get_kp())
+
+    async def run():
+        received = []
+        runner, url = await start_peer(received, decodes_binary=False)
+        networker = Networker()
+        networker.peers[url] = 'peer'
+        api = API(Clockchain(), networker)
+        api.http = aiohttp.ClientSession()
+        posts = networker.forward_stats['posts']
+        try:
+            for forwarded in range(1, 4):
+                await api.forward(ping, 'ping', 'origin', 0)
+                await wait_for(lambda: posts.passed == forwarded)
+        finally:
+            await api.http.close()
+            await runner.cleanup()
+        return received
+
+    assert [content_type for _, content_type, _ in asyncio.run(run())] \
+        == ['application/json', wire.CONTENT_TYPE, 'application/json',
+            'application/json']
+
+
+def test_blocking_work_keeps_the_loop_free(monkeypatch):
+    monkeypatch.setitem(config, 'loop_lag_interval', 0.01)
+    api = API(Clockchain(), Networker())
+
+    async def run():
+        monitor = asyncio.ensure_future(api.monitor_loop_lag())
+        # On the executor, the monitor keeps ticking meanwhile
+        assert await api.blocking(time.sleep, 0.2) is None
+        free_max = api.loop_lag_max
+        time.sleep(0.2)  # On the loop itself
+        await asyncio.sleep(0.05)
+        monitor.cancel()
+        return free_max
+
+    free_max = asyncio.run(run())
+    assert free_max < 0.1
+    assert api.loop_lag_max >= 0.15
+    assert api.loop_lag.to_dict()['rejected'] >= 1
+
+
+def test_worker_forwards_before_server_start():
+    forwarded = []
+    networker = Networker()
+    networker.forward = lambda **kwargs: forwarded.append(kwargs)
+    api = API(Clockchain(), networker)
+    assert api.loop is None
+    api.forward_from_worker({'a': 1}, 'ping', 'origin', 0)
+    assert forwarded == [{'data_dict': {'a': 1}, 'route': 'ping',
+                          'origin': 'origin', 'redistribute': 0}]
@@ -0,0 +1,43 @@
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from utils.sessions import PeerSessions
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+def test_connections_get_reused():
+    server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:' + str(server.server_port)
+
+    sessions = PeerSessions()
+    try:
+        for _ in range(5):
+            assert sessions.get(url + '/info/peers', timeout=5).text == 'ok'
+        stats = sessions.stats()
+        assert stats['open_sessions'] == 1
+        assert stats['requests'] == 5 and stats['connections'] == 1
+        assert stats['reused'] == 4
+
+        sessions.evict(url + '/anything')
+        stats = sessions.stats()
+        assert stats['open_sessions'] == 0 and stats['sessions'] == 1
+        assert stats['requests'] == 5
+
+        sessions.get(url, timeout=5)
+        sessions.evict_idle(-1)
+        assert sessions.stats()['open_sessions'] == 0
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,75 @@
+import copy
+import pytest
+from benchmarks.common import signed
+from utils.pki import get_kp
+from utils.common import config
+from utils.helpers import hasher
+from utils.sync import majority_state, sync_clockchain, validate_chain
+from utils.sync import valid_state
+from datastructures.clockchain import Clockchain
+from datastructures.records import slot_to_dict
+
+
+def make_state(chain, pings=()):
+    return {'chain': chain, 'height': next(iter(chain[-1].values()))['height'],
+            'ping_pool': list(pings), 'stage': 'tick'}
+
+
+def test_sync_installs_majority_chain(monkeypatch):
+    monkeypatch.setitem(config, 'difficulty', 1)
+    keypair = get_kp()
+
+    peer = Clockchain()
+    genesis = peer.chainlist_dicts()
+    ping = signed({'timestamp': 0, 'reference': peer.prev_tick_ref()}, keypair)
+    tick = signed({'list': [ping], 'prev_tick': peer.prev_tick_ref(),
+                   'height': 1}, keypair)
+    tick['this_tick'] = hasher(tick, exclude=('signature',))
+    chain = genesis + [slot_to_dict(peer.json_tick_to_chain_tick(tick))]
+
+    next_ping = signed({'timestamp': 0, 'reference': tick['this_tick']},
+                       get_kp())
+    states = [make_state(chain, [next_ping]), make_state(genesis),
+              make_state(chain)]
+    assert majority_state(states) == (states[0], 2)
+
+    joiner = Clockchain()
+    result = sync_clockchain(joiner, states)
+    assert result['height'] == 1 and result['stage'] == 'tick'
+    assert joiner.current_height() == 1
+    assert joiner.prev_tick_ref() == tick['this_tick']
+    assert list(joiner.ping_pool.values()) == [next_ping]
+
+    # A tampered tick no longer matches its reference
+    forged = copy.deepcopy(chain)
+    forged[1][tick['this_tick']]['height'] = 2
+    assert not validate_chain(forged)
+    assert sync_clockchain(Clockchain(), [make_state(forged)] * 2)['height'] \
+        is None
+
+    # A single peer is no majority
+    assert majority_state([states[0]]) == (None, 1)
+
+
+def test_bad_peer_states_are_dropped():
+    clockchain = Clockchain()
+    genesis = clockchain.chainlist_dicts()
+    good = make_state(genesis)
+    bad = ['junk', {'chain': [{}], 'height': 1}, dict(good, height='0'),
+           dict(good, chain=[{'ref': 'tick'}]), dict(good, stage=None)]
+    assert valid_state(good)
+    assert not any(valid_state(state) for state in bad)
+    assert sync_clockchain(clockchain, bad + [good])['agreeing'] == 1
+
+    # An anchor slot that isn't genesis must be mined and signed
+    tick = {'pubkey': 'pubkey', 'nonce': 0, 'list': [], 'prev_tick': 'x',
+            'height': 10 ** 6}
+    anchor = {hasher(tick): tick}
+    assert not validate_chain([anchor])
+    assert sync_clockchain(clockchain, [make_state([anchor])] * 2)['height'] \
+        is None
+
+    # Nothing is swapped in if the chain can't be installed
+    with pytest.raises(ValueError):
+        clockchain.install_chain([{}])
+    assert clockchain.chainlist_dicts() == genesis
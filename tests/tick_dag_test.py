@@ -0,0 +1,37 @@
+import random
+from utils.helpers import measure_tick_continuity
+from datastructures.tick_dag import TickDag
+
+
+def make_tick(prev_ref, pubkeys):
+    return {'prev_tick': prev_ref, 'list': [{'pubkey': pubkey}
+                                            for pubkey in pubkeys]}
+
+
+def test_ties_stay_bounded():
+    random.seed(2)
+    dag = TickDag(5)
+    dag.add_slot({'genesis': make_tick('none', ['a'])})
+
+    for height in range(100):
+        tips = list(dag.tips())
+        # Every slot ties, but only a couple of tips get extended
+        slot = {str(height) + '_' + str(idx): make_tick(
+            random.choice(tips[:2]), random.sample('abcde', 3))
+            for idx in range(4)}
+
+        candidate = make_tick(random.choice(tips), ['a', 'b'])
+        assert dag.score(candidate) == measure_tick_continuity(
+            {'candidate': candidate}, dag.slot_dicts())
+
+        dag.add_slot(slot)
+        assert len(dag) == min(height + 2, 5) and len(dag.tips()) == 4
+
+        # Whatever is held leads to a tip
+        alive = {node.ref for tip in dag.tips()
+                 for node in dag.ancestors(tip)}
+        assert alive == set(dag.nodes)
+
+    assert dag.pruned > 0
+    assert dag.best_tip().continuity == max(
+        node.continuity for node in dag.tips().values())
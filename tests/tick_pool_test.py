@@ -0,0 +1,20 @@
+from datastructures.tick_pool import TickPool
+
+
+def test_tick_pool_order_and_index():
+    pool = TickPool()
+    assert pool.peek() is None
+
+    first = {'this_tick': 'a'}
+    second = {'this_tick': 'b'}
+    best = {'this_tick': 'c'}
+    pool.put(first, 1.0)
+    pool.put(second, 1.0)
+    pool.put(best, 2.0)
+
+    assert len(pool) == 3
+    assert pool.peek() is best
+    # In the order asked for, every tick once
+    assert pool.get_by_refs(['c', 'x', 'a', 'c']) == [best, first]
+    # Equal continuity: first one in comes first
+    assert pool.snapshot() == [(2.0, best), (1.0, first), (1.0, second)]
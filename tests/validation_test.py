@@ -0,0 +1,101 @@
+import copy
+from benchmarks.common import signed
+from utils.pki import get_kp
+from utils.common import config
+from utils.helpers import hasher
+from utils.validation import validate_schema, schema_registry, validate_tick
+from utils.validation import verified_signatures, tick_rejection, tick_pipeline
+from datastructures.records import Ping, Tick
+
+
+def make_ping(**changes):
+    ping = {'pubkey': 'pubkey', 'nonce': 1, 'reference': 'ref',
+            'timestamp': 1521393955, 'signature': 'sig'}
+    ping.update(changes)
+    return ping
+
+
+def make_tick(pings, **changes):
+    tick = {'pubkey': 'pubkey', 'nonce': 1, 'list': pings,
+            'prev_tick': 'prev', 'height': 1, 'signature': 'sig'}
+    tick.update(changes)
+    return tick
+
+
+def test_fast_path_agrees_with_validator():
+    bad_pings = [make_ping(nonce='1'), make_ping(timestamp=1.5),
+                 make_ping(nonce=True), {'pubkey': 'pubkey'}, []]
+
+    examples = {
+        'ping_schema.json': [make_ping(), make_ping(extra=None),
+                             make_ping(timestamp=10.0)] + bad_pings,
+        'tick_schema.json': [make_tick([make_ping()]), make_tick([]),
+                             make_tick([make_ping()] * 3, height='1')]
+                            + [make_tick([make_ping(), bad])
+                               for bad in bad_pings],
+        'mutual_add_schema.json': [{'pubkey': 'k', 'port': 5000,
+                                    'signature': 's'},
+                                   {'pubkey': 'k', 'port': '5000',
+                                    'signature': 's'}]
+    }
+
+    records = {'ping_schema.json': Ping, 'tick_schema.json': Tick}
+    for schema_file, dictionaries in examples.items():
+        compiled = schema_registry[schema_file]
+        assert compiled['fast_check'] is not None
+        for dictionary in dictionaries:
+            expected = compiled['validator'].is_valid(dictionary)
+            assert validate_schema(dictionary, schema_file) == expected
+            if compiled['fast_check'](dictionary):
+                assert expected
+
+            # Records are checked through their accessors, same outcome
+            record_class = records.get(schema_file, None)
+            if record_class is not None and type(dictionary) is dict:
+                record = record_class.from_dict(dictionary)
+                assert validate_schema(record, schema_file) == expected
+
+
+def make_signed_tick():
+    keypairs = [get_kp() for _ in range(3)]
+    pings = [signed({'timestamp': 1521393955, 'reference': 'ref'}, keypair)
+             for keypair in keypairs]
+    tick = signed({'list': pings, 'prev_tick': 'prev', 'height': 1},
+                  keypairs[0])
+    tick['this_tick'] = hasher(tick, exclude=('signature',))
+    prev_tick = make_tick([make_ping(timestamp=0)], height=0)
+    return tick, prev_tick
+
+
+def test_validate_tick_does_not_modify_input(monkeypatch):
+    monkeypatch.setitem(config, 'difficulty', 1)
+    tick, prev_tick = make_signed_tick()
+    pings = tick['list']
+
+    original = copy.deepcopy(tick)
+    assert validate_tick(tick, prev_tick, ['prev'])
+    assert tick == original
+
+    # Second time around every signature comes from the verified cache
+    hits = verified_signatures.hits
+    assert validate_tick(tick, prev_tick, ['prev'])
+    assert verified_signatures.hits == hits + len(pings) + 1
+
+    tick['list'][1]['timestamp'] += 1
+    assert not validate_tick(tick, prev_tick, ['prev'])
+
+
+def test_pipeline_rejects_at_cheapest_stage(monkeypatch):
+    monkeypatch.setitem(config, 'difficulty', 1)
+    tick, prev_tick = make_signed_tick()
+    signature_checks = tick_pipeline.stats['signatures'].passed
+
+    assert tick_rejection(tick, prev_tick, ['other']) == 'reference'
+    assert tick_rejection(tick, dict(prev_tick, height=5)) == 'reference'
+    assert tick_rejection(tick, prev_tick,
+                          is_duplicate=lambda item: True) == 'dedup'
+    assert tick_rejection(dict(tick, height='1'), prev_tick) == 'structure'
+    assert tick_pipeline.stats['signatures'].passed == signature_checks
+
+    assert tick_rejection(tick, prev_tick, ['prev']) is None
+    assert tick_pipeline.stats['signatures'].passed == signature_checks + 1
@@ -0,0 +1,33 @@
+from datastructures.vote_tally import VoteTally
+
+
+def test_vote_tally_moves_votes():
+    tally = VoteTally()
+    assert tally.leaders() == []
+
+    tally.move(None, 'a')
+    tally.move(None, 'a')
+    tally.move(None, 'b')
+    assert tally.leaders() == ['a']
+    assert tally.top_score == 2
+
+    # A voter overwriting its vote from a to b makes it a tie
+    tally.move('a', 'b')
+    assert tally.get_counts() == {'a': 1, 'b': 2}
+    tally.move(None, 'a')
+    assert sorted(tally.leaders()) == ['a', 'b']
+    tally.move('a', 'c')
+    tally.move('a', 'c')
+    assert tally.get_counts() == {'b': 2, 'c': 2}
+    tally.move('b', 'a')
+    assert tally.leaders() == ['c']
+    assert tally.top_score == 2
+
+    version = tally.version
+    tally.clear()
+    assert tally.wait_for_change(version, timeout=0) != version
+    assert tally.leaders() == [] and tally.top_score == 0
+
+    # A vote moving off a ref that was cleared in between
+    tally.move('gone', 'a')
+    assert tally.get_counts() == {'a': 1}
@@ -0,0 +1,122 @@
+import pytest
+from utils import wire
+from utils.pki import get_kp, sign
+from utils.common import config
+from utils.helpers import standard_encode, hasher
+from threads.networker import Networker, JSON_HEADERS, accept_post
+from threads.flask_api import API
+from datastructures.clockchain import Clockchain
+
+
+def make_ping(keypair, **changes):
+    pubkey, privkey = keypair
+    ping = {'pubkey': pubkey, 'nonce': 12, 'reference': 'ab' * 32,
+            'timestamp': 1521393955}
+    ping['signature'] = sign(standard_encode(ping), privkey)
+    ping.update(changes)
+    return ping
+
+
+def test_round_trip_keeps_hashes():
+    keypair = get_kp()
+    pings = [make_ping(keypair), make_ping(keypair, timestamp=1.5),
+             make_ping(keypair, reference='genesis', nonce=-3)]
+    tick = {'pubkey': keypair[0], 'nonce': 7, 'list': pings * 20,
+            'prev_tick': 'cd' * 32, 'height': 3, 'signature': 'ef' * 64,
+            'this_tick': 'AB' * 32}
+    mutual_add = {'pubkey': keypair[0], 'port': 5000, 'signature': 'ef' * 64}
+
+    for route, item in [('ping', pings[0]), ('vote', pings[1]),
+                        ('ping', pings[2]), ('tick', tick),
+                        ('tick', dict(tick, list=[])),
+                        ('mutual_add', mutual_add)]:
+        frame = wire.encode(item, route)
+        assert len(frame) < len(standard_encode(item))
+        decoded = wire.decode(frame, route)
+        assert decoded == item and hasher(decoded) == hasher(item)
+
+    assert wire.encode(tick, 'tick')[0] & wire.FLAG_ZLIB
+    assert wire.encode(dict(pings[0], extra=1), 'ping') is None
+
+
+def test_invalid_frames():
+    frame = wire.encode(make_ping(get_kp()), 'ping')
+    for data, route in [(frame, 'tick'), (frame[:-1], 'ping'),
+                        (frame + b'\0', 'ping'), (b'', 'ping'),
+                        (bytes([1, 0xff]), 'ping'),
+                        (bytes([2 | wire.FLAG_ZLIB]) + b'junk', 'tick')]:
+        with pytest.raises(ValueError):
+            wire.decode(data, route)
+
+
+def test_negotiation(monkeypatch):
+    networker = Networker()
+    url = 'http://127.0.0.1:5000/forward/ping?addr=a&redistribute=1'
+    ping = make_ping(get_kp())
+
+    # Peers get json until they advertised accepting binary
+    assert networker.encode_bodies(ping, 'ping')['binary'] is None
+    networker.note_response(url, 202, {'Accept-Post': accept_post()})
+    bodies = networker.encode_bodies(ping, 'ping')
+    assert networker.body_for(url, bodies) == (bodies['binary'],
+                                               wire.BINARY_HEADERS)
+    assert networker.body_for('http://other:5000/forward/ping',
+                              bodies) == (bodies['json'], JSON_HEADERS)
+
+    networker.note_response(url, 415, {})
+    assert networker.body_for(url, bodies)[1] == JSON_HEADERS
+
+    # Receiving end takes both
+    client = API(Clockchain(), networker).create_app().test_client()
+    response = client.post('/forward/ping?addr=a&redistribute=0',
+                           data=bodies['binary'],
+                           headers=wire.BINARY_HEADERS)
+    assert response.status_code == 202
+    assert response.headers['Accept-Post'] == accept_post()
+    response = client.post('/forward/ping?addr=a&redistribute=0',
+                           data=b'junk', headers=wire.BINARY_HEADERS)
+    assert response.status_code == 415
+    response = client.post('/forward/ping?addr=a&redistribute=0',
+                           data='{}', headers={'Content-Type': 'text/plain'})
+    assert response.status_code == 415
+
+    # With binary disabled it isn't advertised, and refused
+    monkeypatch.setitem(config, 'binary_wire', False)
+    response = client.post('/forward/ping?addr=a&redistribute=0',
+                           data=bodies['binary'],
+                           headers=wire.BINARY_HEADERS)
+    assert response.status_code == 415
+    assert response.headers['Accept-Post'] \
+        == wire.COMPACT_TICK_TYPE + ', application/json'
+    networker.note_response(url, response.status_code, response.headers)
+    monkeypatch.setitem(config, 'binary_wire', True)
+    assert networker.body_for(url, bodies)[1] == JSON_HEADERS
+
+
+def test_rejected_format_resent_as_json(monkeypatch):
+    networker = Networker()
+    url = 'http://127.0.0.1:5000/forward/ping?addr=a&redistribute=1'
+    networker.note_response(url, 202, {'Accept-Post': accept_post()})
+    bodies = networker.encode_bodies(make_ping(get_kp()), 'ping')
+
+    # Peer that advertises binary, but fails to decode it
+    sent = []
+
+    class Response(object):
+        def __init__(self, status_code):
+            self.status_code = status_code
+            self.headers = {'Accept-Post': accept_post()}
+
+    def post(url, data, headers, timeout):
+        sent.append(headers)
+        return Response(415 if headers is wire.BINARY_HEADERS else 202)
+    monkeypatch.setattr(networker.sessions, 'post', post)
+
+    fanout = networker.new_fanout(1)
+    assert networker.reserve_post(fanout)
+    networker.post_to_peer(fanout, url, bodies)
+    assert sent == [wire.BINARY_HEADERS, JSON_HEADERS]
+    assert fanout.acks == 1
+
+    # Its next replies don't turn binary back on
+    assert networker.body_for(url, bodies)[1] == JSON_HEADERS
@@ -1,10 +1,15 @@
-import requests
-from flask import jsonify, request, Flask
-from utils.pki import pubkey_to_addr, verify
-from utils.helpers import remap, resolve, standard_encode, hasher, attempt
+import json
+from flask import jsonify, request, Flask, Response, abort
+from utils.pki import pubkey_to_addr, verify, crypto, pubkeys
+from utils.helpers import remap, resolve, standard_encode, attempt
 from utils.common import logger, config, credentials
-from utils.validation import validate_tick, validate_ping, validate_schema
-from expiringdict import ExpiringDict
+from utils.validation import validate_schema
+from utils.validation import verified_signatures, pipeline_stats
+from utils.validation import seen_before, remember_item, recent_items
+from threads.ingress import Ingress
+from threads.networker import accepted_types, accept_post
+from utils import wire
+from datastructures.records import Record
 
 
 class API(object):
@@ -13,49 +18,62 @@ class API(object):
         self.clockchain = clockchain
         self.networker = networker
 
-        # cache to avoid processing duplicate json forwards
-        self.duplicate_cache = ExpiringDict(
-            max_len=config['expiring_dict_max_len'],
-            max_age_seconds=config['expiring_dict_max_age'])
+        # Forwarded ticks/pings/votes are validated off the request threads
+        self.ingress = Ingress(clockchain, networker,
+                               queue_size=config['ingress_queue_size'],
+                               workers=config['ingress_workers'])
 
     def check_duplicate(self, values):
-        # Check if dict values has been received in the past x seconds already
-        if self.duplicate_cache.get(hasher(values)):
-            return True
-        else:
-            self.duplicate_cache[hasher(values)] = True
-            return False
-
-    def handle_ping(self, ping, vote=False):
-        if self.check_duplicate(ping):
-            return "duplicate request please wait 10s", 400
-
-        route = 'vote' if vote else 'ping'
-
-        if not validate_ping(ping, self.clockchain.ping_pool, vote):
+        # Check if values was added in the past dedup_window seconds. Only
+        # checks, items are remembered once validated (see Ingress.process)
+        return seen_before(values)
+
+    @staticmethod
+    def read_message(route):
+        # Peers that negotiated it post binary, others json. Formats we don't
+        # take or can't decode get a 415, the sender then falls back to json
+        mimetype = request.mimetype
+        if mimetype not in accepted_types() \
+                or (mimetype == wire.COMPACT_TICK_TYPE and route != 'tick'):
+            abort(415)
+        if mimetype == wire.CONTENT_TYPE:
+            try:
+                return wire.decode(request.get_data(), route)
+            except ValueError:
+                abort(415)
+        if mimetype == wire.COMPACT_TICK_TYPE:
+            return request.get_json(force=True, silent=True)
+        return request.get_json()
+
+    def enqueue(self, route, item):
+        # Only cheap checks here, the ingress workers validate and forward
+        if not isinstance(item, dict):
             return "Invalid " + route, 400
 
-        if vote:
-            self.clockchain.add_to_vote_pool(ping)
-        else:
-            self.clockchain.add_to_ping_pool(ping)
-
-        # TODO: Why would anyone forward others pings? Only incentivized
-        # TODO: to forward own pings (to get highest uptime)
-        # TODO: Solved if you remove peers that do not forward your ping
-        # TODO: For example by adding "shadow-peers" and checking they have it
-
-        route = 'vote' if vote else 'ping'
+        if self.check_duplicate(item):
+            return "duplicate request please wait 10s", 400
 
+        # TODO: Sanitize this input..
         redistribute = int(request.args.get('redistribute'))
-        if redistribute:
-            origin = request.args.get('addr')
-            self.networker.forward(data_dict=ping,
-                                   route=route,
-                                   origin=origin,
-                                   redistribute=redistribute)
-
-        return "Added " + route, 201
+        origin = request.args.get('addr')
+
+        # Pings of a compact tick we don't have are fetched from its sender
+        source = None
+        if route == 'tick' and 'ping_ids' in item:
+            # Bounded, and only fetched from the port it came from
+            if not wire.is_compact_tick(item):
+                return "Invalid compact tick", 400
+            source = "http://" + request.remote_addr + ":" \
+                + str(item['source_port'])
+
+        dropped = self.ingress.submit(route, item, origin, redistribute,
+                                      source)
+        if dropped == 'shed':
+            return "not accepting further " + route + "s", 400
+        if dropped == 'full':
+            return "too busy, please try again later", 503
+
+        return "Queued " + route, 202
 
     def create_app(self):
         app = Flask(__name__)
@@ -63,38 +81,19 @@ class API(object):
         # TODO: Only accept ticks/pings from peers?
         @app.route('/forward/tick', methods=['POST'])
         def forward_tick():
-            if self.networker.stage == "select":
-                return "not accepting further ticks", 400
-
-            tick = request.get_json()
-
-            if self.check_duplicate(tick):
-                return "duplicate request please wait 10s", 400
-
-            if not validate_tick(tick, self.clockchain.latest_selected_tick(),
-                                 self.clockchain.possible_previous_ticks()):
-                return "Invalid tick", 400
-
-            self.clockchain.add_to_tick_pool(tick)
-
-            # TODO: Sanitize this input..
-            redistribute = int(request.args.get('redistribute'))
-            if redistribute:
-                origin = request.args.get('addr')
-                self.networker.forward(data_dict=tick,
-                                       route='tick',
-                                       origin=origin,
-                                       redistribute=redistribute)
-
-            return "Added tick", 201
+            return self.enqueue('tick', self.read_message('tick'))
 
+        # TODO: Why would anyone forward others pings? Only incentivized
+        # TODO: to forward own pings (to get highest uptime)
+        # TODO: Solved if you remove peers that do not forward your ping
+        # TODO: For example by adding "shadow-peers" and checking they have it
         @app.route('/forward/ping', methods=['POST'])
         def forward_ping():
-            return self.handle_ping(request.get_json(), vote=False)
+            return self.enqueue('ping', self.read_message('ping'))
 
         @app.route('/forward/vote', methods=['POST'])
         def forward_vote():
-            return self.handle_ping(request.get_json(), vote=True)
+            return self.enqueue('vote', self.read_message('vote'))
 
         # TODO: In the future, create a dns seed with something similar to
         # https://github.com/sipa/bitcoin-seeder
@@ -103,7 +102,7 @@ class API(object):
         # how-do-bitcoin-clients-find-each-other/11273
         @app.route('/mutual_add', methods=['POST'])
         def mutual_add():
-            values = request.get_json()
+            values = self.read_message('mutual_add')
 
             if self.check_duplicate(values):
                 return "duplicate request please wait 10s", 400
@@ -116,6 +115,7 @@ class API(object):
             signature = values.pop("signature")
             if not verify(standard_encode(values), signature, values['pubkey']):
                 return "Invalid signature", 400
+            remember_item(dict(values, signature=signature))
 
             # Return a 503: service unavailable here
             # so that they can try adding my friends instead
@@ -134,7 +134,7 @@ class API(object):
 
             # Avoid inf loop by not adding self..
             if remote_cleaned_url != own_cleaned_url:
-                result, success = attempt(requests.get, False,
+                result, success = attempt(self.networker.sessions.get, False,
                                           url=remote_url + '/info/addr',
                                           timeout=config['timeout'])
                 if success:
@@ -149,14 +149,14 @@ class API(object):
                 if not self.networker.register_peer(remote_url, addr):
                     return "Could not register peer", 400
                 else:  # Make sure the new joiner gets my pings (if I have any)
-                    if credentials.addr in self.clockchain.ping_pool:
-                        ping = self.clockchain.ping_pool[credentials.addr]
+                    ping = self.clockchain.get_ping(credentials.pubkey)
+                    if ping is not None:
                         # Forward but do not redistribute
                         _, success = attempt(
-                            requests.post, False,
+                            self.networker.sessions.post, False,
                             url=remote_url + '/forward/ping?addr=' +
                             credentials.addr + "&redistribute=-1",
-                            json=ping, timeout=config['timeout'])
+                            json=ping.to_dict(), timeout=config['timeout'])
 
                         if not success:
                             return "couldnt forward my ping", 400
@@ -165,13 +165,36 @@ class API(object):
 
             return credentials.addr, 201
 
+        # Pings by id (see records.ping_id), for peers we sent compact ticks
+        @app.route('/info/pings', methods=['POST'])
+        def info_pings():
+            ids = request.get_json()
+            if type(ids) is not list \
+                    or len(ids) > config['compact_max_ping_ids'] \
+                    or not all(type(identifier) is str for identifier in ids):
+                return "Invalid request", 400
+            pings = self.clockchain.find_pings(ids)
+            return jsonify([ping.to_dict() if isinstance(ping, Record)
+                            else ping for ping in pings.values()]), 200
+
         @app.route('/info/clockchain', methods=['GET'])
         def info_clockchain():
             response = {
-                'chain': self.clockchain.chainlist()
+                'chain': self.clockchain.chainlist_dicts()
             }
             return jsonify(response), 200
 
+        # Chain tail, ping pool and stage in one go, for peers syncing up
+        @app.route('/info/sync', methods=['GET'])
+        def info_sync():
+            response = self.clockchain.sync_state()
+            response['stage'] = self.networker.stage
+            return jsonify(response), 200
+
+        @app.route('/info/sync_stats', methods=['GET'])
+        def info_sync_stats():
+            return jsonify(self.networker.sync_stats), 200
+
         @app.route('/info/addr', methods=['GET'])
         def info():
             return credentials.addr, 200
@@ -182,19 +205,73 @@ class API(object):
 
         @app.route('/info/ping_pool', methods=['GET'])
         def info_ping_pool():
-            return jsonify(remap(self.clockchain.ping_pool)), 200
+            return jsonify(remap(self.clockchain.ping_pool_dicts())), 200
+
+        @app.route('/info/tick_pool', methods=['GET'])
+        def info_tick_pool():
+            return jsonify([{'continuity': continuity,
+                             'tick': tick.to_dict()} for continuity, tick in
+                            self.clockchain.tick_pool.snapshot()]), 200
 
         @app.route('/info/vote_counts', methods=['GET'])
         def info_vote_counts():
             return jsonify(remap(self.clockchain.get_vote_counts())), 200
 
+        # Streams the vote tally as json lines, one per change, until the
+        # select stage (then the tally is final) so operators can watch votes
+        @app.route('/info/vote_counts/stream', methods=['GET'])
+        def info_vote_counts_stream():
+            def updates():
+                version = None
+                while True:
+                    # Timeout so that the select stage is noticed without votes
+                    new_version = self.clockchain.vote_tally.wait_for_change(
+                        version, timeout=1)
+                    finished = self.networker.stage == "select"
+                    if new_version != version or finished:
+                        snapshot = self.clockchain.vote_tally_snapshot()
+                        snapshot['stage'] = self.networker.stage
+                        yield json.dumps(snapshot) + '\n'
+                    version = new_version
+                    if finished:
+                        break
+
+            return Response(updates(), mimetype='application/x-ndjson')
+
+        @app.route('/info/connections', methods=['GET'])
+        def info_connections():
+            return jsonify(self.networker.sessions.stats()), 200
+
+        @app.route('/info/forwarding', methods=['GET'])
+        def info_forwarding():
+            return jsonify(self.networker.forward_stats_dict()), 200
+
+        @app.route('/info/ingress', methods=['GET'])
+        def info_ingress():
+            return jsonify(self.ingress.stats()), 200
+
+        @app.route('/info/validation', methods=['GET'])
+        def info_validation():
+            return jsonify(pipeline_stats()), 200
+
+        @app.route('/info/caches', methods=['GET'])
+        def info_caches():
+            return jsonify({'verified_signatures': verified_signatures.stats(),
+                            'dedup': recent_items.stats(),
+                            'pubkeys': pubkeys.stats(),
+                            **crypto.stats()}), 200
+
         # This is done to unify logging visually.
         # Otherwise ugly Werkzeug logging is used (which is disabled in commons)
         @app.after_request
         def after(response):
+            # Reading a streamed body here would consume the stream
+            body = "<stream>" if response.is_streamed else \
+                response.get_data().decode("utf-8").rstrip()
             logger.debug(request.remote_addr + " " + request.method + " "
                          + request.path + ": [" + str(response.status_code)
-                         + "] " + response.get_data().decode("utf-8").rstrip())
+                         + "] " + body)
+            response.headers['Accept-Post'] = accept_post()
             return response
 
         return app
@@ -0,0 +1,243 @@
+import time
+import threading
+from queue import Queue, Full, Empty
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.common import logger, config
+from utils.helpers import handle_exception
+from utils.pipeline import StageStats
+from utils.validation import tick_rejection, ping_rejection
+from utils.validation import claim_item, release_item
+from utils import wire
+
+# Queues are drained in this order when several have work waiting
+ROUTES = ('tick', 'vote', 'ping')
+
+# Stages during which items of a route are of no use any more: ticks come
+# too late once they are being selected, and pings once votes are cast
+SHED_STAGES = {'tick': ('select',), 'ping': ('vote',), 'vote': ()}
+
+
+class Ingress(object):
+    """
+    Bounded queues between the API handlers and the clockchain. Handlers only
+    do cheap checks and submit, a fixed pool of workers validates, adds to the
+    pools and forwards. When a queue is full new items are dropped instead of
+    piling up, and items of a route are shed during stages they are useless in
+    (checked on submit, and again when they come out of the queue).
+    Compact ticks with pings we don't have wait for those on a small fetch
+    pool, so a slow sender doesn't hold up the workers
+    """
+    def __init__(self, clockchain, networker, queue_size, workers,
+                 forward=None, fetch_workers=config['compact_fetch_workers'],
+                 fetch_queue=config['compact_fetch_queue'],
+                 fetch_timeout=config['compact_fetch_timeout']):
+        self.clockchain = clockchain
+        self.networker = networker
+        # forward(data_dict, route, origin, redistribute), from the workers
+        self.forward = forward if forward is not None else networker.forward
+
+        self.queues = {route: Queue(maxsize=queue_size) for route in ROUTES}
+        # Released once per queued item, so that a worker that acquires it
+        # always finds an item in one of the queues
+        self.queued = threading.Semaphore(0)
+
+        self.lock = threading.Lock()
+        self.counts = {route: {'accepted': 0, 'dropped': 0, 'shed': 0,
+                               'invalid': 0, 'added': 0}
+                       for route in ROUTES}
+        # Time from submit until processed, "passed" if it got added
+        self.latency = {route: StageStats() for route in ROUTES}
+        # Pings of compact ticks found locally, and fetched from the sender
+        self.compact = {'ticks': 0, 'known_pings': 0, 'fetched_pings': 0,
+                        'fetches_dropped': 0}
+
+        self.fetcher = ThreadPoolExecutor(max_workers=fetch_workers)
+        # Fetches running or waiting for the fetcher, beyond that ticks that
+        # need one are dropped
+        self.fetch_slots = threading.BoundedSemaphore(fetch_queue)
+        self.fetch_timeout = fetch_timeout
+
+        self.workers = [threading.Thread(target=self.worker, daemon=True)
+                        for _ in range(workers)]
+        for thread in self.workers:
+            thread.start()
+
+    def count(self, route, key):
+        with self.lock:
+            self.counts[route][key] += 1
+
+    def shed(self, route):
+        return self.networker.stage in SHED_STAGES[route]
+
+    def submit(self, route, item, origin, redistribute, source=None):
+        """
+        Queue an item for validation, returns right away
+
+        :param route: <str> 'tick', 'vote' or 'ping'
+        :param source: <str> url of the peer that sent a compact tick
+        :return: <str> why the item was dropped ('shed' or 'full'),
+            None if it was queued
+        """
+        if self.shed(route):
+            self.count(route, 'shed')
+            return 'shed'
+        try:
+            self.queues[route].put_nowait((item, origin, redistribute,
+                                           source, time.perf_counter()))
+        except Full:
+            self.count(route, 'dropped')
+            return 'full'
+        self.count(route, 'accepted')
+        self.queued.release()
+        return None
+
+    def worker(self):
+        while True:
+            self.queued.acquire()
+            for route in ROUTES:
+                try:
+                    entry = self.queues[route].get_nowait()
+                except Empty:
+                    continue
+                try:
+                    self.process(route, *entry)
+                except Exception as e:
+                    handle_exception(e)
+                break
+
+    def reject(self, route, submitted):
+        self.count(route, 'invalid')
+        self.latency[route].record(time.perf_counter() - submitted, False)
+
+    def expand(self, compact, origin, redistribute, source, submitted):
+        # Full tick of a compact one, from the pings in our pools. If some
+        # are missing they are fetched from the peer that sent it, and the
+        # rebuilt tick is queued again. None if it isn't ready (yet)
+        ids = compact['ping_ids']
+        pings = self.clockchain.find_pings(ids)
+        missing = [identifier for identifier in dict.fromkeys(ids)
+                   if identifier not in pings]
+
+        with self.lock:
+            self.compact['ticks'] += 1
+            self.compact['known_pings'] += len(ids) - len(missing)
+        if len(missing) == 0:
+            return wire.expand_tick(compact, [pings[identifier]
+                                              for identifier in ids])
+
+        if source is None:
+            self.reject('tick', submitted)
+            return None
+        if not self.fetch_slots.acquire(blocking=False):
+            with self.lock:
+                self.compact['fetches_dropped'] += 1
+            self.reject('tick', submitted)
+            return None
+        self.fetcher.submit(self.fetch, compact, pings, missing, origin,
+                            redistribute, source, submitted)
+        return None
+
+    def fetch(self, compact, pings, missing, origin, redistribute, source,
+              submitted):
+        try:
+            fetched = self.networker.fetch_pings(source, missing,
+                                                 timeout=self.fetch_timeout)
+        except Exception as e:
+            handle_exception(e)
+            fetched = {}
+        finally:
+            self.fetch_slots.release()
+
+        found = [identifier for identifier in missing
+                 if identifier in fetched]
+        with self.lock:
+            self.compact['fetched_pings'] += len(found)
+        if len(found) < len(missing):
+            self.reject('tick', submitted)
+            return
+
+        pings.update(fetched)
+        ids = compact['ping_ids']
+        tick = wire.expand_tick(compact, [pings[identifier]
+                                          for identifier in ids])
+        try:
+            self.queues['tick'].put_nowait((tick, origin, redistribute, None,
+                                            submitted))
+        except Full:
+            self.count('tick', 'dropped')
+            return
+        self.queued.release()
+
+    def process(self, route, item, origin, redistribute, source, submitted):
+        # The stage may have moved on while the item was queued
+        if self.shed(route):
+            self.count(route, 'shed')
+            return
+
+        # The rebuilt tick is validated like any other, its hash and
+        # signature are over the full tick
+        if route == 'tick' and wire.is_compact_tick(item):
+            item = self.expand(item, origin, redistribute, source, submitted)
+            if item is None:
+                return
+
+        # The dedup stage claims the item's key until it is added or
+        # rejected, copies processed by other workers meanwhile are dropped
+        claimed = []
+
+        def is_duplicate(candidate):
+            key = claim_item(candidate)
+            if key is None:
+                return True
+            claimed.append(key)
+            return False
+
+        added = False
+        try:
+            if route == 'tick':
+                rejection = tick_rejection(
+                    item, self.clockchain.latest_selected_tick(),
+                    self.clockchain.possible_previous_ticks(),
+                    is_duplicate=is_duplicate)
+            else:
+                rejection = ping_rejection(item, self.clockchain.ping_pool,
+                                           vote=route == 'vote',
+                                           is_duplicate=is_duplicate)
+
+            if rejection is None:
+                if route == 'tick':
+                    self.clockchain.add_to_tick_pool(item)
+                elif route == 'vote':
+                    self.clockchain.add_to_vote_pool(item)
+                else:
+                    self.clockchain.add_to_ping_pool(item)
+                added = True
+        finally:
+            for key in claimed:
+                release_item(key, added)
+
+        if added:
+            self.count(route, 'added')
+            if redistribute:
+                self.forward(data_dict=item,
+                             route=route,
+                             origin=origin,
+                             redistribute=redistribute)
+        else:
+            logger.debug("Ingress " + route + " rejected at " + rejection)
+            self.count(route, 'invalid')
+
+        self.latency[route].record(time.perf_counter() - submitted,
+                                   rejection is None)
+
+    def stats(self):
+        with self.lock:
+            counts = {route: dict(self.counts[route]) for route in ROUTES}
+        for route in ROUTES:
+            counts[route]['depth'] = self.queues[route].qsize()
+            counts[route]['capacity'] = self.queues[route].maxsize
+            counts[route]['latency'] = self.latency[route].to_dict()
+        with self.lock:
+            counts['compact_ticks'] = dict(self.compact)
+        return counts
@@ -1,14 +1,42 @@
 import json
 import time
 import random
-import requests
 
 from utils.pki import sign
-from threading import Timer, Thread
+from threading import Timer, Thread, Lock, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 from utils.common import logger, config, credentials
 from utils.helpers import standard_encode, attempt
+from utils.sessions import PeerSessions
+from utils.pipeline import StageStats
+from utils.fanout import Fanout
+from utils import wire
+from datastructures.records import ping_id
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+# Formats our API takes, json always and the others if enabled in config
+def accepted_types():
+    types = []
+    if config['binary_wire']:
+        types.append(wire.CONTENT_TYPE)
+    if config['compact_ticks']:
+        types.append(wire.COMPACT_TICK_TYPE)
+    return types + [JSON_HEADERS['Content-Type']]
+
+
+# Sent on every API response, so that peers know they can post binary
+def accept_post():
+    return ', '.join(accepted_types())
+
+
+# A post the peer answered 415 to is sent once more, as json (body_for
+# picks json after note_response). Status is False if the post failed
+def resend_as_json(status, headers):
+    return status == 415 and headers is not JSON_HEADERS
 
 
 class Networker(object):
@@ -18,6 +46,29 @@ class Networker(object):
         self.port = 0
         self.ready = False
         self.stage = "ping"  # Stages are ping->tick->vote->select
+        # Filled in by Timeminer when it synced with peers after joining
+        self.sync_stats = {}
+        # Keep-alive connections per peer, use instead of requests.get/post
+        self.sessions = PeerSessions(config['peer_pool_size'])
+        # Forwards to peers run concurrently on a bounded pool of workers
+        self.forward_pool = ThreadPoolExecutor(
+            max_workers=config['forward_workers'])
+        # Posts queued or in flight, beyond forward_queue_size they are
+        # dropped instead of piling up in the pool's queue
+        self.forward_slots = BoundedSemaphore(config['forward_queue_size'])
+        self.forward_dropped = 0
+        self.dropped_lock = Lock()
+        # Latency per post, and per fan-out until the last post finished
+        self.forward_stats = {'posts': StageStats(),
+                              'fanouts': StageStats()}
+        # Locations of peers that advertised accepting binary messages, and
+        # compact ticks
+        self.binary_peers = set()
+        self.compact_peers = set()
+        # Peers that answered 415 to one of those, they get json from then on
+        self.json_only_peers = set()
+        self.bytes_sent = {'json': 0, 'binary': 0, 'compact': 0}
+        self.bytes_lock = Lock()
         self.join_network_thread = Thread(target=self.join_network_worker)
         # Timer for activation thread (uses resettable timer to find out port)
 
@@ -43,9 +94,11 @@ class Networker(object):
         self.peers[netloc] = peer_addr
         return True
 
-    def forward(self, data_dict, route, origin=None, redistribute=0):
+    def forward(self, data_dict, route, origin=None, redistribute=0,
+                quorum=0):
         """
-        Forward any json content to another peer
+        Forward any json content to all peers, concurrently. Returns right
+        away, unless asked to wait for a quorum of acknowledgements
 
         :param data_dict: dictionary which becomes json content
         :param route: which route it's addressed at
@@ -53,7 +106,31 @@ class Networker(object):
         :param origin: origin of this forward
         :param redistribute: Amount of hops (redistributions through peers)
             this json message has passed through
-        :return: void
+        :param quorum: <int> amount of peers that must acknowledge (2xx)
+            before returning, 0 to not wait
+        :return: <bool> whether quorum was reached (always True if 0)
+        """
+        urls = self.forward_urls(route, origin, redistribute)
+        if len(urls) == 0:
+            return quorum == 0
+
+        # Encoded once here: the caller may reuse data_dict after we return
+        bodies = self.encode_bodies(data_dict, route)
+        fanout = self.new_fanout(len(urls))
+        for url in urls:
+            if self.reserve_post(fanout):
+                self.forward_pool.submit(self.post_to_peer, fanout, url,
+                                         bodies)
+
+        if quorum > 0:
+            return fanout.wait_for_acks(quorum, config['forward_timeout'])
+        return True
+
+    def forward_urls(self, route, origin, redistribute):
+        """
+        Where to forward a message to, see forward()
+
+        :return: <list> of urls to post the message to, can be empty
         """
         # If max hops = 1, means no redistribution of data received from peers
         # Works for fully connected network (for testing purposes)
@@ -62,42 +139,146 @@ class Networker(object):
 
         # Sender set forwarding flag to do-not-forward
         if redistribute == -1:
-            return
+            return []
         # Dont forward to peers if exceeding certain amount of hops
-        if redistribute < config['max_hops']:
-            redistribute = redistribute + 1
-            # TODO: What happens if malicious actor fakes the ?addr= ?? or the
-            # amount of hops?
-            # list() used to avoid dict size change exception
-            for peer in list(self.peers):
-                # Check key exists + check we do not send msg back to originator
-                if peer in self.peers and origin != self.peers[peer]:
-                    # Add self.addr in query to identify self to peers
-                    # If origin addr is not target peer addr
-                    _, success = attempt(
-                        requests.post, False, url=peer + '/forward/' + route +
-                        '?addr=' + origin + "&redistribute=" + str(redistribute),
-                        json=data_dict, timeout=config['timeout'])
-                    # if not success:
-                    #    logger.debug("Couldnt forward to " + peer + " removin")
-                    #    self.unregister_peer(peer)
+        if redistribute >= config['max_hops']:
+            return []
+
+        redistribute = redistribute + 1
+        # TODO: What happens if malicious actor fakes the ?addr= ?? or the
+        # amount of hops?
+        # list() used to avoid dict size change exception
+        # Check key exists + check we do not send msg back to originator
+        targets = [peer for peer in list(self.peers)
+                   if origin != self.peers.get(peer, origin)]
+
+        # Add self.addr in query to identify self to peers
+        # If origin addr is not target peer addr
+        return [peer + '/forward/' + route + '?addr=' + origin
+                + "&redistribute=" + str(redistribute) for peer in targets]
+
+    def new_fanout(self, total):
+        return Fanout(total, on_complete=self.record_fanout)
+
+    def encode_bodies(self, data_dict, route):
+        # Binary is only encoded if a peer will get it. None if the message
+        # can't be encoded exactly, then every peer gets json
+        binary = None
+        if config['binary_wire'] and len(self.binary_peers) > 0:
+            binary = wire.encode(data_dict, route)
+        compact = None
+        if route == 'tick' and config['compact_ticks'] \
+                and len(self.compact_peers) > 0:
+            compact = wire.compact_tick(data_dict, self.port)
+            if compact is not None:
+                compact = json.dumps(compact)
+        return {'json': json.dumps(data_dict), 'binary': binary,
+                'compact': compact}
+
+    # Also used by the Sanic API, which posts through its own async client
+    def body_for(self, url, bodies):
+        peer = self.sessions.location(url)
+        if bodies.get('compact', None) is not None \
+                and peer in self.compact_peers:
+            body, headers, kind = bodies['compact'], \
+                wire.COMPACT_TICK_HEADERS, 'compact'
+        elif bodies['binary'] is not None and peer in self.binary_peers:
+            body, headers, kind = bodies['binary'], wire.BINARY_HEADERS, \
+                'binary'
+        else:
+            body, headers, kind = bodies['json'], JSON_HEADERS, 'json'
+        with self.bytes_lock:
+            self.bytes_sent[kind] += len(body)
+        return body, headers
+
+    def note_response(self, url, status_code, headers):
+        # Peers advertise the formats they accept on every response, and
+        # answer 415 to a format they don't (any more)
+        peer = self.sessions.location(url)
+        if status_code == 415:
+            self.json_only_peers.add(peer)
+            self.binary_peers.discard(peer)
+            self.compact_peers.discard(peer)
+            return
+        if peer in self.json_only_peers:
+            return
+        accepted = [content_type.strip() for content_type
+                    in headers.get('Accept-Post', '').split(',')]
+        if wire.CONTENT_TYPE in accepted:
+            self.binary_peers.add(peer)
+        if wire.COMPACT_TICK_TYPE in accepted:
+            self.compact_peers.add(peer)
+
+    # Also used by the Sanic API. False if the post got dropped, otherwise
+    # the post must give its slot back with forward_slots.release()
+    def reserve_post(self, fanout):
+        if self.forward_slots.acquire(blocking=False):
+            return True
+        with self.dropped_lock:
+            self.forward_dropped += 1
+        fanout.finish(False)
+        return False
+
+    def post_to_peer(self, fanout, url, bodies):
+        try:
+            start = time.perf_counter()
+            for _ in range(2):
+                body, headers = self.body_for(url, bodies)
+                result, success = attempt(self.sessions.post, False, url=url,
+                                          data=body, headers=headers,
+                                          timeout=config['forward_timeout'])
+                if success:
+                    self.note_response(url, result.status_code,
+                                       result.headers)
+                # Sent again as json if the peer couldn't take the format
+                if not resend_as_json(success and result.status_code,
+                                      headers):
+                    break
+            acknowledged = success and 200 <= result.status_code < 300
+            self.record_post(fanout, time.perf_counter() - start,
+                             acknowledged)
+        finally:
+            self.forward_slots.release()
+
+    # Also used by the Sanic API, which posts through its own async client
+    def record_post(self, fanout, seconds, acknowledged):
+        self.forward_stats['posts'].record(seconds, acknowledged)
+        fanout.finish(acknowledged)
+
+    def record_fanout(self, fanout):
+        self.forward_stats['fanouts'].record(fanout.seconds,
+                                             fanout.acks == fanout.total)
+
+    def forward_stats_dict(self):
+        stats = {name: stats.to_dict()
+                 for name, stats in self.forward_stats.items()}
+        with self.bytes_lock:
+            stats['bytes_sent'] = dict(self.bytes_sent)
+        stats['binary_peers'] = len(self.binary_peers)
+        stats['compact_peers'] = len(self.compact_peers)
+        with self.dropped_lock:
+            stats['dropped'] = self.forward_dropped
+        return stats
 
     def unregister_peer(self, url):
         netloc = self.get_full_location(url)
         if netloc in self.peers:
             del self.peers[netloc]
+        self.binary_peers.discard(self.sessions.location(netloc))
+        self.compact_peers.discard(self.sessions.location(netloc))
+        self.json_only_peers.discard(self.sessions.location(netloc))
+        self.sessions.evict(netloc)
 
     @staticmethod
     def get_full_location(url):
         return "http://" + urlparse(url).netloc
 
     # This allows to get a subset of peers peers for adding
-    @staticmethod
-    def get_sample_of_peers_from(peers, sample_size=config['max_peers']):
+    def get_sample_of_peers_from(self, peers, sample_size=config['max_peers']):
         peers_of_peers = set()
         # Get peers of peers and add to set (set has no duplicates)
         for peer in list(peers):
-            result, success = attempt(requests.get, False,
+            result, success = attempt(self.sessions.get, False,
                                       url=peer + '/info/peers',
                                       timeout=config['timeout'])
             if success:
@@ -112,6 +293,60 @@ class Networker(object):
 
         return random.sample(list(peers_of_peers), sample_size)
 
+    def get_sync_states(self, sample_size=config['sync_peers']):
+        """
+        Download chain tail, ping pool and stage of several peers in parallel
+
+        :param sample_size: <int> amount of peers to ask
+        :return: <list> of the /info/sync responses that came back
+        """
+        peers = list(self.peers)
+        peers = random.sample(peers, min(sample_size, len(peers)))
+        if len(peers) == 0:
+            return []
+
+        with ThreadPoolExecutor(max_workers=len(peers)) as executor:
+            results = list(executor.map(
+                lambda peer: attempt(self.sessions.get, False,
+                                     url=peer + '/info/sync',
+                                     timeout=config['timeout']), peers))
+
+        states = []
+        for peer, (result, success) in zip(peers, results):
+            if success and result.status_code == 200:
+                try:
+                    states.append(json.loads(result.text))
+                except ValueError:
+                    logger.debug("Invalid sync state from " + peer)
+            else:
+                logger.debug("Couldn't get sync state of " + peer)
+        return states
+
+    def fetch_pings(self, source, ids, timeout=config['timeout']):
+        """
+        Get pings by id from the peer that sent us a compact tick
+
+        :param source: <str> url of the peer, eg. 'http://192.168.0.5:5000'
+        :param ids: <list> ping ids, see records.ping_id
+        :param timeout: <float> seconds to wait for the peer
+        :return: <dict> {id: ping dict} of the requested pings it had
+        """
+        result, success = attempt(self.sessions.post, False,
+                                  url=source + '/info/pings', json=ids,
+                                  timeout=timeout)
+        if not success or result.status_code != 200:
+            logger.debug("Couldn't fetch pings from " + source)
+            return {}
+        try:
+            pings = result.json()
+        except ValueError:
+            pings = None
+        if type(pings) is not list:
+            return {}
+        wanted = set(ids)
+        return {ping_id(ping): ping for ping in pings
+                if type(ping) is dict and ping_id(ping) in wanted}
+
     def send_mutual_add_requests(self, peerslist):
         successful_adds = 0
         # Mutual add peers
@@ -124,13 +359,14 @@ class Networker(object):
                 content['signature'] = signature
                 status_code = None
                 response = None
-                result, success = attempt(requests.post, False,
+                result, success = attempt(self.sessions.post, False,
                                           url=peer + '/mutual_add',
                                           json=content,
                                           timeout=config['timeout'])
                 if success:
                     status_code = result.status_code
                     response = result.text
+                    self.note_response(peer, status_code, result.headers)
                 else:
                     logger.debug("Couldn't connect to " + peer)
 
@@ -164,11 +400,13 @@ class Networker(object):
         # Then add those peers
         self.send_mutual_add_requests(peer_samples)
 
-        # TODO: Sync latest datastructures with peers (choosing the majority?)
+        # Latest datastructures get synced with the majority of peers by the
+        # Timeminer as soon as we're ready, see Timeminer.sync_with_network
 
         # Continuously try add new peers until my peerlist is above minimum size
         while True:
             time.sleep(4)  # TODO: Put in config
+            self.sessions.evict_idle(config['peer_idle_timeout'])
             if len(self.peers) < config['min_peers']:
                 logger.debug("peerlist below minimum, trying to add more peers")
                 peer_samples = self.get_sample_of_peers_from(self.peers)
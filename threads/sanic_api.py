@@ -1,102 +1,201 @@
-import requests
+import time
+import asyncio
+import aiohttp
+from json import dumps
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 from sanic import Sanic
 from sanic.response import json, text
-from utils.pki import pubkey_to_addr, verify
-from utils.helpers import remap, resolve, standard_encode, hasher, attempt
+from sanic.exceptions import SanicException
+from utils.pki import pubkey_to_addr, verify, crypto, pubkeys
+from utils.helpers import remap, resolve, standard_encode
 from utils.common import logger, config, credentials
-from utils.validation import validate_tick, validate_ping, validate_schema
-from expiringdict import ExpiringDict
+from utils.validation import validate_schema
+from utils.validation import verified_signatures, pipeline_stats
+from utils.validation import seen_before, remember_item, recent_items
+from utils.pipeline import StageStats
+from threads.networker import accepted_types, accept_post, resend_as_json
+from utils import wire
+from datastructures.records import Record
+from threads.ingress import Ingress
 
 
 class API(object):
+    """
+    Non-blocking API: the event loop only parses requests and awaits.
+    Forwarded items are validated by the ingress workers, other blocking
+    work (signatures, DNS) runs on a bounded executor, and outbound peer
+    calls go through an aiohttp client with pooled keep-alive connections
+    """
     def __init__(self, clockchain, networker):
 
         self.clockchain = clockchain
         self.networker = networker
 
-        # cache to avoid processing duplicate json forwards
-        self.duplicate_cache = ExpiringDict(
-            max_len=config['expiring_dict_max_len'],
-            max_age_seconds=config['expiring_dict_max_age'])
+        self.executor = ThreadPoolExecutor(
+            max_workers=config['validation_workers'])
+        self.http = None  # aiohttp.ClientSession, created on server start
+        self.loop = None
+
+        # Forwarded ticks/pings/votes are validated by the ingress workers
+        self.ingress = Ingress(clockchain, networker,
+                               queue_size=config['ingress_queue_size'],
+                               workers=config['ingress_workers'],
+                               forward=self.forward_from_worker)
+
+        # How late the event loop wakes up from a sleep: the time it was
+        # kept busy. "rejected" counts samples late by a whole interval
+        self.loop_lag = StageStats()
+        self.loop_lag_last = 0.0
+        self.loop_lag_max = 0.0
+
+    def check_duplicate(self, values):
+        # Check if values was added in the past dedup_window seconds. Only
+        # checks, items are remembered once validated (see Ingress.process)
+        return seen_before(values)
+
+    async def blocking(self, function, *args, **kwargs):
+        # Run function on the executor, so that the event loop stays free
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, partial(function, *args, **kwargs))
+
+    async def forward(self, data_dict, route, origin, redistribute):
+        # Same as Networker.forward, but posting from the event loop
+        urls = self.networker.forward_urls(route, origin, redistribute)
+        if len(urls) == 0:
+            return
+
+        bodies = self.networker.encode_bodies(data_dict, route)
+        fanout = self.networker.new_fanout(len(urls))
+        for url in urls:
+            if self.networker.reserve_post(fanout):
+                asyncio.ensure_future(self.post_to_peer(fanout, url, bodies))
+
+    async def post_to_peer(self, fanout, url, bodies):
+        start = time.perf_counter()
+        try:
+            for _ in range(2):
+                body, headers = self.networker.body_for(url, bodies)
+                async with self.http.post(
+                        url, data=body, headers=headers,
+                        timeout=aiohttp.ClientTimeout(
+                            total=config['forward_timeout'])) as response:
+                    self.networker.note_response(url, response.status,
+                                                 response.headers)
+                    acknowledged = 200 <= response.status < 300
+                if not resend_as_json(response.status, headers):
+                    break
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            acknowledged = False
+        finally:
+            self.networker.forward_slots.release()
+        self.networker.record_post(fanout, time.perf_counter() - start,
+                                   acknowledged)
+
+    async def monitor_loop_lag(self):
+        interval = config['loop_lag_interval']
+        loop = asyncio.get_event_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - expected)
+            self.loop_lag_last = lag
+            self.loop_lag_max = max(self.loop_lag_max, lag)
+            self.loop_lag.record(lag, lag < interval)
+
+    def forward_from_worker(self, data_dict, route, origin, redistribute):
+        # Ingress workers are threads, the posts go out from the event loop.
+        # Until the server started (or once it stopped) there is none
+        loop = self.loop
+        if loop is None or not loop.is_running():
+            self.networker.forward(data_dict=data_dict, route=route,
+                                   origin=origin, redistribute=redistribute)
+            return
+        asyncio.run_coroutine_threadsafe(
+            self.forward(data_dict, route, origin, redistribute), loop)
+
+    @staticmethod
+    def read_message(request, route):
+        # Peers that negotiated it post binary, others json. Formats we don't
+        # take or can't decode get a 415, the sender then falls back to json
+        content_type = request.headers.get('Content-Type', '')
+        content_type = content_type.split(';')[0].strip()
+        if content_type not in accepted_types() or (
+                content_type == wire.COMPACT_TICK_TYPE and route != 'tick'):
+            raise SanicException("Unsupported content type", status_code=415)
+        if content_type == wire.CONTENT_TYPE:
+            try:
+                return wire.decode(request.body, route)
+            except ValueError:
+                raise SanicException("Undecodable " + route, status_code=415)
+        return request.json
+
+    def enqueue(self, request, route):
+        # Only cheap checks here, the ingress workers validate and forward
+        item = self.read_message(request, route)
+        if not isinstance(item, dict):
+            return text("Invalid " + route, status=400)
 
-    async def check_duplicate(self, values):
-        # Check if dict values has been received in the past x seconds already
-        if self.duplicate_cache.get(hasher(values)):
-            return True
-        else:
-            self.duplicate_cache[hasher(values)] = True
-            return False
+        if self.check_duplicate(item):
+            return text("duplicate request please wait 10s", status=400)
 
-    async def handle_ping(self, request, vote=False):
-        ping = request.json
+        # TODO: Sanitize this input..
+        redistribute = int(request.args.get('redistribute'))
+        origin = request.args.get('addr')
 
-        route = 'vote' if vote else 'ping'
+        # Pings of a compact tick we don't have are fetched from its sender
+        source = None
+        if route == 'tick' and 'ping_ids' in item:
+            # Bounded, and only fetched from the port it came from
+            if not wire.is_compact_tick(item):
+                return text("Invalid compact tick", status=400)
+            source = "http://" + request.ip + ":" + str(item['source_port'])
 
-        if await self.check_duplicate(ping):
-            return text("duplicate request please wait 10s", status=400)
+        dropped = self.ingress.submit(route, item, origin, redistribute,
+                                      source)
+        if dropped == 'shed':
+            return text("not accepting further " + route + "s", status=400)
+        if dropped == 'full':
+            return text("too busy, please try again later", status=503)
 
-        if not validate_ping(ping, self.clockchain.ping_pool, vote):
-            return text("Invalid " + route, status=400)
+        return text("Queued " + route, status=202)
 
-        if vote:
-            self.clockchain.add_to_vote_pool(ping)
-        else:
-            self.clockchain.add_to_ping_pool(ping)
-
-        # TODO: Why would anyone forward others pings? Only incentivized
-        # TODO: to forward own pings (to get highest uptime)
-        # TODO: Solved if you remove peers that do not forward your ping
-        # TODO: For example by adding "shadow-peers" and checking they have it
+    def create_app(self):
+        app = Sanic('timechain')
 
-        redistribute = int(request.args.get('redistribute'))
-        if redistribute:
-            origin = request.args.get('addr')
-            self.networker.forward(data_dict=ping,
-                                   route=route,
-                                   origin=origin,
-                                   redistribute=redistribute)
+        @app.listener('before_server_start')
+        async def start_client(app, loop):
+            self.loop = loop
+            self.http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=config['peer_pool_size']))
+            asyncio.ensure_future(self.monitor_loop_lag())
 
-        return text("Added " + route, status=201)
+        @app.middleware('response')
+        async def advertise_formats(request, response):
+            response.headers['Accept-Post'] = accept_post()
 
-    def create_app(self):
-        app = Sanic()
+        @app.listener('after_server_stop')
+        async def stop_client(app, loop):
+            await self.http.close()
 
         # TODO: Only accept ticks/pings from peers?
         @app.route('/forward/tick', methods=['POST'])
         async def forward_tick(request):
-            if self.networker.stage == "select":
-                return text("not accepting further ticks", status=400)
-
-            tick = request.json
-
-            if await self.check_duplicate(tick):
-                return text("duplicate request please wait 10s", status=400)
-
-            if not validate_tick(tick, self.clockchain.latest_selected_tick(),
-                                 self.clockchain.possible_previous_ticks()):
-                return text("Invalid tick", status=400)
-
-            self.clockchain.add_to_tick_pool(tick)
-
-            # TODO: Sanitize this input..
-            redistribute = int(request.args.get('redistribute'))
-            if redistribute:
-                origin = request.args.get('addr')
-                self.networker.forward(data_dict=tick,
-                                       route='tick',
-                                       origin=origin,
-                                       redistribute=redistribute)
-
-            return text("Added tick", status=201)
+            return self.enqueue(request, 'tick')
 
+        # TODO: Why would anyone forward others pings? Only incentivized
+        # TODO: to forward own pings (to get highest uptime)
+        # TODO: Solved if you remove peers that do not forward your ping
+        # TODO: For example by adding "shadow-peers" and checking they have it
         @app.route('/forward/ping', methods=['POST'])
         async def forward_ping(request):
-            return await self.handle_ping(request, vote=False)
+            return self.enqueue(request, 'ping')
 
         @app.route('/forward/vote', methods=['POST'])
         async def forward_vote(request):
-            return await self.handle_ping(request, vote=True)
+            return self.enqueue(request, 'vote')
 
         # TODO: In the future, create a dns seed with something similar to
         # https://github.com/sipa/bitcoin-seeder
@@ -105,9 +204,9 @@ class API(object):
         # how-do-bitcoin-clients-find-each-other/11273
         @app.route('/mutual_add', methods=['POST'])
         async def mutual_add(request):
-            values = request.json
+            values = self.read_message(request, 'mutual_add')
 
-            if await self.check_duplicate(values):
+            if self.check_duplicate(values):
                 return text("duplicate request please wait 10s", status=400)
 
             # Verify json schema
@@ -116,8 +215,10 @@ class API(object):
 
             # Verify that pubkey and signature match
             signature = values.pop("signature")
-            if not verify(standard_encode(values), signature, values['pubkey']):
+            if not await self.blocking(verify, standard_encode(values),
+                                       signature, values['pubkey']):
                 return text("Invalid signature", status=400)
+            remember_item(dict(values, signature=signature))
 
             # Return a 503: service unavailable here
             # so that they can try adding my friends instead
@@ -128,7 +229,7 @@ class API(object):
             # TODO: Do schema validation for integer sizes / string lengths..
             remote_port = int(values.get('port'))
 
-            remote_url = resolve(request.ip)
+            remote_url = await self.blocking(resolve, request.ip)
             remote_url = "http://" + remote_url + ":" + str(remote_port)
 
             own_url = "http://" + request.host
@@ -136,14 +237,15 @@ class API(object):
             remote_cleaned_url = self.networker.get_full_location(remote_url)
             own_cleaned_url = self.networker.get_full_location(own_url)
 
+            timeout = aiohttp.ClientTimeout(total=config['timeout'])
+
             # Avoid inf loop by not adding self..
             if remote_cleaned_url != own_cleaned_url:
-                result, success = attempt(requests.get, False,
-                                          url=remote_url + '/info/addr',
-                                          timeout=config['timeout'])
-                if success:
-                    addr = result.text
-                else:
+                try:
+                    async with self.http.get(remote_url + '/info/addr',
+                                             timeout=timeout) as response:
+                        addr = await response.text()
+                except (aiohttp.ClientError, asyncio.TimeoutError):
                     return text("couldn't get addr", status=400)
                 # Verify that the host's address matches the key pair used
                 # to sign the mutual_add request
@@ -154,29 +256,52 @@ class API(object):
                 if not self.networker.register_peer(remote_url, addr):
                     return text("Could not register peer", status=400)
                 else:  # Make sure the new joiner gets my pings (if I have any)
-                    if credentials.addr in self.clockchain.ping_pool:
-                        ping = self.clockchain.ping_pool[credentials.addr]
+                    ping = self.clockchain.get_ping(credentials.pubkey)
+                    if ping is not None:
                         # Forward but do not redistribute
-                        _, success = attempt(
-                            requests.post, False,
-                            url=remote_url + '/forward/ping?addr=' +
-                            credentials.addr + "&redistribute=-1",
-                            json=ping, timeout=config['timeout'])
-
-                        if not success:
+                        try:
+                            async with self.http.post(
+                                    remote_url + '/forward/ping?addr=' +
+                                    credentials.addr + "&redistribute=-1",
+                                    json=ping.to_dict(), timeout=timeout):
+                                pass
+                        except (aiohttp.ClientError, asyncio.TimeoutError):
                             return text("couldnt forward my ping", status=400)
             else:
                 return text("cannot add self", status=400)
 
             return text(credentials.addr, status=201)
 
+        # Pings by id (see records.ping_id), for peers we sent compact ticks
+        @app.route('/info/pings', methods=['POST'])
+        async def info_pings(request):
+            ids = request.json
+            if type(ids) is not list \
+                    or len(ids) > config['compact_max_ping_ids'] \
+                    or not all(type(identifier) is str for identifier in ids):
+                return text("Invalid request", status=400)
+            pings = await self.blocking(self.clockchain.find_pings, ids)
+            return json([ping.to_dict() if isinstance(ping, Record)
+                         else ping for ping in pings.values()], status=200)
+
         @app.route('/info/clockchain', methods=['GET'])
         async def info_clockchain(request):
             response = {
-                'chain': self.clockchain.chainlist()
+                'chain': self.clockchain.chainlist_dicts()
             }
             return json(response, status=200)
 
+        # Chain tail, ping pool and stage in one go, for peers syncing up
+        @app.route('/info/sync', methods=['GET'])
+        async def info_sync(request):
+            response = self.clockchain.sync_state()
+            response['stage'] = self.networker.stage
+            return json(response, status=200)
+
+        @app.route('/info/sync_stats', methods=['GET'])
+        async def info_sync_stats(request):
+            return json(self.networker.sync_stats, status=200)
+
         @app.route('/info/addr', methods=['GET'])
         async def info(request):
             return text(credentials.addr, status=200)
@@ -188,17 +313,75 @@ class API(object):
 
         @app.route('/info/ping_pool', methods=['GET'])
         async def info_ping_pool(request):
-            return json(remap(self.clockchain.ping_pool), status=200)
+            return json(remap(self.clockchain.ping_pool_dicts()), status=200)
+
+        @app.route('/info/tick_pool', methods=['GET'])
+        async def info_tick_pool(request):
+            return json([{'continuity': continuity,
+                          'tick': tick.to_dict()} for continuity, tick in
+                         self.clockchain.tick_pool.snapshot()], status=200)
 
         @app.route('/info/vote_counts', methods=['GET'])
         async def info_vote_counts(request):
             return json(remap(self.clockchain.get_vote_counts()), status=200)
 
+        # Streams the vote tally as json lines, one per change, until the
+        # select stage (then the tally is final) so operators can watch votes
+        @app.route('/info/vote_counts/stream', methods=['GET'])
+        async def info_vote_counts_stream(request):
+            response = await request.respond(
+                content_type='application/x-ndjson')
+            version = None
+            while True:
+                new_version = self.clockchain.vote_tally.version
+                finished = self.networker.stage == "select"
+                if new_version != version or finished:
+                    snapshot = self.clockchain.vote_tally_snapshot()
+                    snapshot['stage'] = self.networker.stage
+                    await response.send(dumps(snapshot) + '\n')
+                version = new_version
+                if finished:
+                    break
+                await asyncio.sleep(0.1)
+            await response.eof()
+
+        @app.route('/info/connections', methods=['GET'])
+        async def info_connections(request):
+            return json(self.networker.sessions.stats(), status=200)
+
+        @app.route('/info/forwarding', methods=['GET'])
+        async def info_forwarding(request):
+            return json(self.networker.forward_stats_dict(), status=200)
+
+        @app.route('/info/ingress', methods=['GET'])
+        async def info_ingress(request):
+            return json(self.ingress.stats(), status=200)
+
+        @app.route('/info/loop_lag', methods=['GET'])
+        async def info_loop_lag(request):
+            return json({'last': self.loop_lag_last,
+                         'max': self.loop_lag_max,
+                         **self.loop_lag.to_dict()}, status=200)
+
+        @app.route('/info/validation', methods=['GET'])
+        async def info_validation(request):
+            return json(pipeline_stats(), status=200)
+
+        @app.route('/info/caches', methods=['GET'])
+        async def info_caches(request):
+            return json({'verified_signatures': verified_signatures.stats(),
+                         'dedup': recent_items.stats(),
+                         'pubkeys': pubkeys.stats(),
+                         **crypto.stats()}, status=200)
+
         # This is done to unify logging visually.
         @app.middleware('response')
         async def logging_for_sanic(request, response):
+            # Streaming responses have no body to log
+            body = response.body if response.body is not None \
+                else b'<stream>'
             logger.debug(request.ip + " " + request.method + " "
                          + request.path + ": [" + str(response.status)
-                         + "] " + response.body.decode('utf-8').replace('\\', ''))
+                         + "] " + body.decode('utf-8').replace('\\', ''))
 
         return app
@@ -1,7 +1,11 @@
 from utils.validation import validate_ping, validate_tick
-from utils.helpers import utcnow, standard_encode, mine, median_ts
+from utils.helpers import utcnow, standard_encode, median_ts
+from utils.helpers import handle_exception
+from utils.mining import mine_parallel
+from utils.sync import sync_clockchain
 from utils.common import logger, credentials, config
 from utils.pki import sign
+from datastructures.records import Ping, Tick
 import time
 import random
 import threading
@@ -12,7 +16,13 @@ class Timeminer(object):
 
         self.clockchain = clockchain
         self.networker = networker
-        self.added_ping = False
+        self.start_time = time.time()
+        self.synced = False
+        # Ping and tick worker take turns: ping stage, then tick->vote->select
+        # Each worker blocks on its own event until it is its turn
+        self.ping_turn = threading.Event()
+        self.tick_turn = threading.Event()
+        self.ping_turn.set()
         self.ping_thread = threading.Thread(target=self.ping_worker)
         self.tick_thread = threading.Thread(target=self.tick_worker)
         self.ping_thread.start()
@@ -31,21 +41,24 @@ class Timeminer(object):
 
         stage = 'vote' if vote else 'ping'
 
-        _, nonce = mine(ping)
+        _, nonce = mine_parallel(ping)
         ping['nonce'] = nonce
 
         signature = sign(standard_encode(ping), credentials.privkey)
         ping['signature'] = signature
 
+        # Kept as record from here on, peers get the wire dict
+        record = Ping.from_dict(ping)
+
         # Validate own ping
-        if not validate_ping(ping, self.clockchain.ping_pool, vote):
+        if not validate_ping(record, self.clockchain.ping_pool, vote):
             logger.debug("Failed own " + stage + " validation")
             return False
 
         if vote:
-            self.clockchain.add_to_vote_pool(ping)
+            self.clockchain.add_to_vote_pool(record)
         else:
-            self.clockchain.add_to_ping_pool(ping)
+            self.clockchain.add_to_ping_pool(record)
 
         route = 'vote' if vote else 'ping'
 
@@ -60,15 +73,16 @@ class Timeminer(object):
 
     def generate_and_process_tick(self):
         height = self.clockchain.current_height() + 1
+        pings = list(self.clockchain.ping_pool.values())
 
         tick = {
-            'list': list(self.clockchain.ping_pool.values()),
+            'list': [ping.to_dict() for ping in pings],
             'pubkey': credentials.pubkey,
             'prev_tick': self.clockchain.prev_tick_ref(),
             'height': height
         }
 
-        this_tick, nonce = mine(tick)
+        this_tick, nonce = mine_parallel(tick)
 
         tick['nonce'] = nonce
 
@@ -79,6 +93,9 @@ class Timeminer(object):
         # this_tick is not actually necessary according to tick schema
         tick['this_tick'] = this_tick
 
+        # The record shares its pings with the ping pool
+        record = Tick.from_dict({**tick, 'list': pings})
+
         prev_tick = self.clockchain.latest_selected_tick()
 
         possible_previous = self.clockchain.possible_previous_ticks()
@@ -86,12 +103,18 @@ class Timeminer(object):
         # Validate own tick
         retries = 0
         while retries < config['tick_retries']:
-            if not validate_tick(tick, prev_tick, possible_previous,
+            if not validate_tick(record, prev_tick, possible_previous,
                                  verbose=False):
                 retries = retries + 1
                 time.sleep(config['tick_retries_sleep'])
             else:
-                self.clockchain.add_to_tick_pool(tick)
+                if 'time_to_first_valid_tick' not in self.networker.sync_stats:
+                    seconds = time.time() - self.start_time
+                    self.networker.sync_stats['time_to_first_valid_tick'] = \
+                        seconds
+                    logger.info("First valid tick after " + str(int(seconds))
+                                + "s")
+                self.clockchain.add_to_tick_pool(record)
                 # Forward to peers (this must be after all validation)
                 self.networker.forward(data_dict=tick, route='tick',
                                        origin=credentials.addr,
@@ -102,9 +125,53 @@ class Timeminer(object):
         logger.debug("Failed own tick validation too many times. not forwarded")
         return False
 
+    # Bulk download chain tail, ping pool and stage of several peers, so that
+    # our first tick already references the chain the network is on
+    def sync_with_network(self):
+        start = time.time()
+        try:
+            result = sync_clockchain(self.clockchain,
+                                     self.networker.get_sync_states())
+        except Exception as e:
+            # Peers' answers are untrusted, don't let one stop the ping worker
+            handle_exception(e)
+            return
+        if result['stage'] is not None:
+            self.networker.stage = result['stage']
+
+        result['seconds'] = time.time() - start
+        self.networker.sync_stats.update(result)
+        logger.info("Synced with " + str(result['agreeing']) + "/"
+                    + str(result['peers']) + " agreeing peers: height "
+                    + str(result['height']) + ", " + str(result['pings'])
+                    + " pings in " + "{:.2f}".format(result['seconds']) + "s")
+
+    def wait_for_next_ping_stage(self):
+        # Network's tick stage starts cycle_time_multiplier cycles after the
+        # latest selected tick, the ping stage follows tick, vote and select
+        cycle_time = config['cycle_time']
+        next_ping_ts = median_ts(self.clockchain.latest_selected_tick()) \
+            + (config['cycle_time_multiplier'] + 2) * cycle_time
+        wait_time = next_ping_ts - utcnow()
+        logger.debug("Waiting " + str(int(max(wait_time, 0)))
+                     + "s for the network's next ping stage")
+        if wait_time > 0:
+            time.sleep(wait_time)
+
     def ping_worker(self):
         while True:
-            if self.networker.ready and not self.added_ping:
+            self.ping_turn.wait()
+            if self.networker.ready:
+                if not self.synced:
+                    self.sync_with_network()
+                    self.synced = True
+                    # Join the cycle at the stage the network is in
+                    if self.networker.stage == "tick":
+                        self.ping_turn.clear()
+                        self.tick_turn.set()
+                        continue
+                    if self.networker.stage in ("vote", "select"):
+                        self.wait_for_next_ping_stage()
 
                 self.networker.stage = "ping"
 
@@ -116,14 +183,16 @@ class Timeminer(object):
                 if not successful:
                     continue
 
-                self.added_ping = True
+                self.ping_turn.clear()
+                self.tick_turn.set()
             else:
                 time.sleep(1)
 
     def tick_worker(self):
         while True:
-            # added_ping acts as a switch between "pingmode" and "tickmode"
-            if self.networker.ready and self.added_ping:
+            # Wait for the ping worker to hand over ("pingmode" -> "tickmode")
+            self.tick_turn.wait()
+            if self.networker.ready:
                 # Always construct tick in the following order:
                 # 1) Init 2) Mine+nonce 3) Add signature
                 # This is because the order of nonce and sig creation matters
@@ -176,11 +245,15 @@ class Timeminer(object):
                 # Use a ping to vote for highest continuity tick in tick_pool
 
                 # TODO: What happens if I just selfishly vote for my own tick?
-                active_tick_ref = self.clockchain.current_tick_ref()
-
-                self.generate_and_process_ping(active_tick_ref, vote=True)
+                # Blocks until the tick pool has a tick, for at most a stage
+                active_tick_ref = self.clockchain.current_tick_ref(
+                    timeout=cycle_time / 2)
 
-                logger.debug("Voted for: " + str(active_tick_ref))
+                if active_tick_ref is not None:
+                    self.generate_and_process_ping(active_tick_ref, vote=True)
+                    logger.debug("Voted for: " + str(active_tick_ref))
+                else:
+                    logger.debug("No ticks received, nothing to vote for")
 
                 end = time.time()
 
@@ -200,6 +273,7 @@ class Timeminer(object):
                 self.clockchain.select_highest_voted_to_chain()
                 # TODO: If nothing was added to chain.. sth obv. wrong! Resync?
 
-                self.added_ping = False
+                self.tick_turn.clear()
+                self.ping_turn.set()
             else:
                 time.sleep(1)
@@ -1,7 +1,7 @@
 import logging
 import json
 import os.path
-from utils.pki import get_kp, pubkey_to_addr
+from utils.pki import get_kp, pubkey_to_addr, crypto
 from logging.handlers import TimedRotatingFileHandler
 
 # Load config path
@@ -14,6 +14,10 @@ dir_path = os.path.abspath(os.path.join(this_file_path, os.pardir))
 with open(dir_path + '/config.json') as config_file:
     config = json.load(config_file)
 
+# Size the key and address caches of the crypto context
+crypto.verifying_keys.max_size = config['key_cache_size']
+crypto.addresses.max_size = config['addr_cache_size']
+
 if config['api_backend'] == "flask":
     # Remove annoying misformatted flask output, gets replaced by own logging
     flasklogger = logging.getLogger('werkzeug')
@@ -0,0 +1,47 @@
+import time
+from threading import Condition
+
+
+class Fanout(object):
+    """
+    Completion of one message sent to several peers at once: how many posts
+    finished and how many of them were acknowledged (2xx). on_complete gets
+    called with the fanout once the last post finished
+    """
+    def __init__(self, total, on_complete=None):
+        self.total = total
+        self.done = 0
+        self.acks = 0
+        self.start = time.perf_counter()
+        self.seconds = None  # Time until the last post finished
+        self.on_complete = on_complete
+        self.condition = Condition()
+
+    def finish(self, acknowledged):
+        with self.condition:
+            self.done += 1
+            if acknowledged:
+                self.acks += 1
+            complete = self.done == self.total
+            if complete:
+                self.seconds = time.perf_counter() - self.start
+            self.condition.notify_all()
+
+        if complete and self.on_complete is not None:
+            self.on_complete(self)
+
+    def wait_for_acks(self, quorum, timeout=None):
+        """
+        :return: <bool> whether quorum peers acknowledged, blocks until they
+            did, every post finished, or timeout passed
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.acks >= quorum or self.done == self.total,
+                timeout)
+            return self.acks >= quorum
+
+    def wait(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.done == self.total,
+                                           timeout)
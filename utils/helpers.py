@@ -1,9 +1,9 @@
 import json
 import pytz
 import socket
-import random
 import hashlib
 from utils.common import logger, config
+from datastructures.records import Record, pubkey_id
 from datetime import datetime
 import traceback
 import requests
@@ -25,14 +25,23 @@ def resolve(ip):
 
 
 # Encode dicts (messages loaded from JSON for example) in standard way
-def standard_encode(dictionary):
+# Keys in exclude are left out of the encoding, without touching the dict
+# Records (datastructures/records.py) hand out their cached encoding instead
+def standard_encode(dictionary, exclude=()):
+    if isinstance(dictionary, Record):
+        return dictionary.encode(exclude)
+    if exclude:
+        dictionary = {key: value for key, value in dictionary.items()
+                      if key not in exclude}
     return bytes(
         json.dumps(dictionary, sort_keys=True, separators=(',', ':')),
         'utf-8')
 
 
-def hasher(dictionary):
-    return hashlib.sha256(standard_encode(dictionary)).hexdigest()
+def hasher(dictionary, exclude=()):
+    if isinstance(dictionary, Record):
+        return dictionary.hash(exclude)
+    return hashlib.sha256(standard_encode(dictionary, exclude)).hexdigest()
 
 
 def median_ts(tick):
@@ -49,8 +58,8 @@ def measure_tick_continuity(tick_dict, chain):
 
     continuity_dict = {}
     tot_sum = 0
-    # TODO: Do running calculation in clockchain instead
-    # TODO: so we dont recalculate this every time?
+    # Clockchain keeps a running calculation (see TickDag.score) instead
+    # of calling this, this remains as reference for it
 
     # Traverse block-tree backwards
     for idx, possible_ticks in enumerate(reversed(extended_chain)):
@@ -63,10 +72,11 @@ def measure_tick_continuity(tick_dict, chain):
             prev_ref = chosen_tick['prev_tick']
 
         for ping in chosen_tick['list']:
-            if ping["pubkey"] in continuity_dict:
-                continuity_dict[ping["pubkey"]] += 1
+            pubkey = pubkey_id(ping)
+            if pubkey in continuity_dict:
+                continuity_dict[pubkey] += 1
             else:
-                continuity_dict[ping["pubkey"]] = 1
+                continuity_dict[pubkey] = 1
 
     # TODO: Is this not gameable by having tons of pubkeys/ticks/pings?
     for pubkey in continuity_dict:
@@ -78,20 +88,6 @@ def measure_tick_continuity(tick_dict, chain):
     return tot_sum / len(extended_chain)
 
 
-# TODO: Do this in C or other efficient lib..
-def mine(content=None):
-    # Importing here to avoid circular dependency
-    from utils.validation import validate_difficulty
-    nonce = random.randrange(config['max_randint'])
-    while True:
-        content['nonce'] = nonce
-        hashed = hasher(content)
-        if validate_difficulty(hashed):
-            break
-        nonce += random.randrange(config['nonce_jump'])
-    return hashed, nonce
-
-
 # Function to make a request.post/.get, with an option to allow retries
 def attempt(request, retry, **kwargs):
     if retry:
@@ -0,0 +1,171 @@
+# Optional numba backend for mining: SHA-256 over the mining template,
+# compiled to machine code and run over whole batches of nonces per call.
+# Every operand is cast to uint32 explicitly, numba would otherwise promote
+# uint32 arithmetic with python ints to int64 and break the rotations.
+#
+# It is not faster than the default python backend: a compiled scalar
+# SHA-256 block (~300ns) loses to OpenSSL's behind hashlib, which the
+# python backend spends most of its time in, and batches aren't split over
+# threads since the mining pool already runs a process per core. See
+# benchmarks/jit_mining_bench.py. It is kept, opt-in ("mining_backend":
+# "numba"), as a reference of the template search that runs without the
+# interpreter, for builds where hashlib has no fast SHA-256
+try:
+    import numpy as np
+    from numba import njit, uint32
+    available = True
+except ImportError:
+    available = False
+
+if available:
+    K = np.array([
+        0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1,
+        0x923f82a4, 0xab1c5ed5, 0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3,
+        0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174, 0xe49b69c1, 0xefbe4786,
+        0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+        0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147,
+        0x06ca6351, 0x14292967, 0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13,
+        0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85, 0xa2bfe8a1, 0xa81a664b,
+        0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+        0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a,
+        0x5b9cca4f, 0x682e6ff3, 0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208,
+        0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2], dtype=np.uint32)
+
+    H0 = np.array([
+        0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c,
+        0x1f83d9ab, 0x5be0cd19], dtype=np.uint32)
+
+    @njit(cache=True)
+    def rotr(x, n):
+        return uint32((x >> uint32(n)) | (x << uint32(32 - n)))
+
+    @njit(cache=True)
+    def compress(state, buf, offset, k, w):
+        for t in range(16):
+            i = offset + 4 * t
+            w[t] = (uint32(buf[i]) << uint32(24)) \
+                | (uint32(buf[i + 1]) << uint32(16)) \
+                | (uint32(buf[i + 2]) << uint32(8)) | uint32(buf[i + 3])
+        for t in range(16, 64):
+            s0 = rotr(w[t - 15], 7) ^ rotr(w[t - 15], 18) \
+                ^ (w[t - 15] >> uint32(3))
+            s1 = rotr(w[t - 2], 17) ^ rotr(w[t - 2], 19) \
+                ^ (w[t - 2] >> uint32(10))
+            w[t] = uint32(w[t - 16] + s0 + w[t - 7] + s1)
+
+        a, b, c, d = state[0], state[1], state[2], state[3]
+        e, f, g, h = state[4], state[5], state[6], state[7]
+        for t in range(64):
+            s1 = rotr(e, 6) ^ rotr(e, 11) ^ rotr(e, 25)
+            ch = (e & f) ^ (~e & g)
+            temp1 = uint32(h + s1 + ch + k[t] + w[t])
+            s0 = rotr(a, 2) ^ rotr(a, 13) ^ rotr(a, 22)
+            maj = (a & b) ^ (a & c) ^ (b & c)
+            temp2 = uint32(s0 + maj)
+            h = g
+            g = f
+            f = e
+            e = uint32(d + temp1)
+            d = c
+            c = b
+            b = a
+            a = uint32(temp1 + temp2)
+
+        state[0] = uint32(state[0] + a)
+        state[1] = uint32(state[1] + b)
+        state[2] = uint32(state[2] + c)
+        state[3] = uint32(state[3] + d)
+        state[4] = uint32(state[4] + e)
+        state[5] = uint32(state[5] + f)
+        state[6] = uint32(state[6] + g)
+        state[7] = uint32(state[7] + h)
+
+    @njit(cache=True)
+    def trailing_zeros_ok(state, difficulty):
+        # Same as validation.validate_difficulty on the hex digest: the last
+        # `difficulty` hex characters are the lowest nibbles of the last words
+        for nibble in range(difficulty):
+            word = state[7 - nibble // 8]
+            if ((word >> (4 * (nibble % 8))) & 0xF) != 0:
+                return False
+        return True
+
+    @njit(cache=True)
+    def search_batch(midstate, tail, suffix, prefix_len, start, step, count,
+                     difficulty, k):
+        # Returns the index i of the first nonce start + i*step in the batch
+        # whose hash satisfies difficulty, or -1 if there is none
+        buf = np.zeros(len(tail) + 20 + len(suffix) + 72, np.uint8)
+        buf[:len(tail)] = tail
+        state = np.empty(8, np.uint32)
+        w = np.empty(64, np.uint32)
+
+        # The tail stays in place, the suffix and padding after the digits
+        # are only laid out again when the amount of digits changes
+        laid_digits = 0
+        end = 0
+        for i in range(count):
+            nonce = start + i * step
+
+            n_digits = 1
+            n = nonce // 10
+            while n > 0:
+                n_digits += 1
+                n //= 10
+
+            if n_digits != laid_digits:
+                pos = len(tail) + n_digits
+                buf[pos:pos + len(suffix)] = suffix
+                pos += len(suffix)
+                # Standard SHA-256 padding over the length of the message
+                bit_len = (prefix_len + n_digits + len(suffix)) * 8
+                buf[pos] = 0x80
+                pos += 1
+                while pos % 64 != 56:
+                    buf[pos] = 0
+                    pos += 1
+                for j in range(8):
+                    buf[pos + j] = (bit_len >> (56 - 8 * j)) & 0xFF
+                end = pos + 8
+                laid_digits = n_digits
+
+            n = nonce
+            for j in range(len(tail) + n_digits - 1, len(tail) - 1, -1):
+                buf[j] = 48 + n % 10
+                n //= 10
+
+            state[:] = midstate
+            for offset in range(0, end, 64):
+                compress(state, buf, offset, k, w)
+
+            if trailing_zeros_ok(state, difficulty):
+                return i
+
+        return -1
+
+
+class JitTemplate(object):
+    """
+    Compiled counterpart of mining.MiningTemplate. The full 64 byte blocks of
+    the prefix are compressed once, the remaining tail is re-hashed together
+    with the nonce digits and the suffix for every nonce in a batch
+    """
+    def __init__(self, prefix, suffix):
+        full_blocks = len(prefix) - len(prefix) % 64
+        prefix_array = np.frombuffer(prefix, dtype=np.uint8)
+
+        self.midstate = H0.copy()
+        w = np.empty(64, np.uint32)
+        for offset in range(0, full_blocks, 64):
+            compress(self.midstate, prefix_array, offset, K, w)
+
+        self.tail = prefix_array[full_blocks:].copy()
+        self.suffix = np.frombuffer(suffix, dtype=np.uint8).copy()
+        self.prefix_len = len(prefix)
+
+        # Compile (or load numba's cache) now, not on the first batch
+        self.search(0, 1, 0, 0)
+
+    def search(self, start, step, count, difficulty):
+        return search_batch(self.midstate, self.tail, self.suffix,
+                            self.prefix_len, start, step, count, difficulty, K)
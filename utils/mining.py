@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from queue import Empty
+
+from utils import jit_mining
+from utils.common import logger, config
+# Workers start from a fork server, settings go along with the jobs
+from utils.pki import mp_context
+
+# Statistics of the most recent mining run, e.g. for logging/info endpoints
+last_run = {'processes': 0, 'hashes': 0, 'seconds': 0.0, 'hashrate': 0.0}
+# Held while mining with a pool and while updating last_run
+mining_lock = threading.Lock()
+# MiningPool per amount of processes, started on first use
+pools = {}
+
+
+def use_jit():
+    if config['mining_backend'] != 'numba':
+        return False
+    if not jit_mining.available:
+        logger.debug("numba not available, using python mining backend")
+        return False
+    return True
+
+
+def mining_processes():
+    processes = config['mining_processes']
+    if processes <= 0:  # 0 means: use every core we have
+        processes = os.cpu_count() or 1
+    return processes
+
+
+class MiningTemplate(object):
+    """
+    Canonical encoding of content split around its nonce, so that mining only
+    has to hash the nonce digits and whatever follows it. The prefix is fed
+    into a sha256 object once, and every attempt continues from a copy of it
+    """
+    def __init__(self, content):
+        before = []
+        after = []
+        # Same key order and separators as helpers.standard_encode
+        for key in sorted(content):
+            if key == 'nonce':
+                continue
+            item = json.dumps(key) + ':' + json.dumps(
+                content[key], sort_keys=True, separators=(',', ':'))
+            (before if key < 'nonce' else after).append(item)
+
+        prefix = '{' + ''.join(item + ',' for item in before) + '"nonce":'
+        suffix = ''.join(',' + item for item in after) + '}'
+        self.load(bytes(prefix, 'utf-8'), bytes(suffix, 'utf-8'), use_jit())
+
+    def load(self, prefix, suffix, jit):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.midstate = hashlib.sha256(self.prefix)
+
+        # Compiled batch search over the same bytes, see utils/jit_mining.py
+        self.jit = None
+        if jit:
+            self.jit = jit_mining.JitTemplate(self.prefix, self.suffix)
+
+    # Sent to the pool workers as bytes, hash states don't pickle
+    def __getstate__(self):
+        return self.prefix, self.suffix, self.jit is not None
+
+    def __setstate__(self, state):
+        self.load(*state)
+
+    def encode(self, nonce):
+        return self.prefix + bytes(str(nonce), 'utf-8') + self.suffix
+
+    # Equal to helpers.hasher(content) with content['nonce'] = nonce
+    def hash(self, nonce):
+        sha = self.midstate.copy()
+        sha.update(bytes(str(nonce), 'utf-8'))
+        sha.update(self.suffix)
+        return sha.hexdigest()
+
+
+def search_nonces(template, start, step, found=None, counter=None, slot=0,
+                  difficulty=None, batch_size=None):
+    """
+    Test nonces start, start+step, start+2*step, .. until a valid one is found
+
+    :param template: <MiningTemplate> of the ping or tick to mine
+    :param start: <int> first nonce to try
+    :param step: <int> distance between nonces, the amount of shards
+    :param found: <Event> set by whichever worker finds a nonce first
+    :param counter: <Array> shared per-worker hash counts
+    :param slot: <int> index of this worker in counter
+    :param difficulty: <int> defaults to config['difficulty']
+    :param batch_size: <int> defaults to config['mining_batch_size']
+    :return: <tuple> (hash, nonce, hashes tried), hash+nonce None if cancelled
+    """
+    if difficulty is None:
+        difficulty = config['difficulty']
+    if batch_size is None:
+        batch_size = config['mining_batch_size']
+    zeros = "0" * difficulty
+    nonce = start
+    tried = 0
+
+    while found is None or not found.is_set():
+        if template.jit is not None:
+            idx = template.jit.search(nonce, step, batch_size, difficulty)
+            if idx >= 0:
+                nonce += idx * step
+                tried += idx + 1
+                if counter is not None:
+                    counter[slot] = tried
+                return template.hash(nonce), nonce, tried
+            nonce += batch_size * step
+            tried += batch_size
+            if counter is not None:
+                counter[slot] = tried
+            continue
+
+        for _ in range(batch_size):
+            hashed = template.hash(nonce)
+            tried += 1
+            # Same check as validation.validate_difficulty
+            if hashed[-difficulty:] == zeros:
+                if counter is not None:
+                    counter[slot] = tried
+                return hashed, nonce, tried
+            nonce += step
+
+        # Publish progress per batch, so that a cancelled worker still counts
+        if counter is not None:
+            counter[slot] = tried
+
+    return None, None, tried
+
+
+def pool_worker(jobs, found, results, counter, slot):
+    # Mines one job after the other, until some worker found the nonce
+    while True:
+        job_id, template, start, step, difficulty, batch_size = jobs.get()
+        counter[slot] = 0
+        hashed, nonce, _ = search_nonces(template, start, step, found,
+                                         counter, slot, difficulty,
+                                         batch_size)
+        if hashed is not None:
+            found.set()
+        results.put((job_id, hashed, nonce))
+
+
+class MiningPool(object):
+    """
+    Mining processes started once and kept, each mining run shards the nonce
+    space over them. Not thread safe, used under mining_lock
+    """
+    def __init__(self, processes):
+        self.processes = processes
+        self.job_id = 0
+        self.found = mp_context.Event()
+        self.results = mp_context.Queue()
+        # One slot per worker, no lock needed since nobody shares a slot
+        self.counter = mp_context.Array('Q', processes, lock=False)
+        self.jobs = [mp_context.Queue() for _ in range(processes)]
+        self.workers = [mp_context.Process(target=pool_worker, daemon=True,
+                                           args=(self.jobs[idx], self.found,
+                                                 self.results, self.counter,
+                                                 idx))
+                        for idx in range(processes)]
+        for worker in self.workers:
+            worker.start()
+
+    def alive(self):
+        return all(worker.is_alive() for worker in self.workers)
+
+    def mine(self, template, base):
+        """
+        :return: <tuple> (hash, nonce, hashes tried), hash+nonce None if
+            workers died
+        """
+        self.job_id += 1
+        self.found.clear()
+        for idx, jobs in enumerate(self.jobs):
+            jobs.put((self.job_id, template, base + idx, self.processes,
+                      config['difficulty'], config['mining_batch_size']))
+
+        # Every worker answers once it found a nonce or got cancelled, so
+        # that none is still busy with this job when the next one comes
+        hashed, nonce = None, None
+        pending = self.processes
+        while pending > 0:
+            try:
+                job_id, found_hash, found_nonce = self.results.get(timeout=1)
+            except Empty:
+                if not self.alive():
+                    return None, None, sum(self.counter)
+                continue
+            if job_id != self.job_id:
+                continue
+            pending -= 1
+            if found_hash is not None and hashed is None:
+                # First result wins, cancel everybody else straight away
+                hashed, nonce = found_hash, found_nonce
+                self.found.set()
+        return hashed, nonce, sum(self.counter)
+
+    def terminate(self):
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+
+
+def mine_parallel(content, processes=None):
+    """
+    Mine content by sharding the nonce space over a pool of processes,
+    falls back to an in-process search of the same nonce sequence when there
+    is only one core
+
+    :param content: <dict> ping or tick to mine
+    :param processes: <int> amount of workers, defaults to mining_processes()
+    :return: <tuple> (hash, nonce) of the first valid nonce found
+    """
+    if processes is None:
+        processes = mining_processes()
+
+    start_time = time.time()
+    base = random.randrange(config['max_randint'])
+    template = MiningTemplate(content)
+
+    if processes < 2:
+        hashed, nonce, hashes = search_nonces(template, base, 1)
+    else:
+        with mining_lock:
+            pool = pools.get(processes, None)
+            if pool is None:
+                pool = pools[processes] = MiningPool(processes)
+            hashed, nonce, hashes = pool.mine(template, base)
+            if hashed is None:
+                pool.terminate()
+                del pools[processes]
+
+        if hashed is None:
+            logger.info("Mining workers died, mining in-process instead")
+            hashed, nonce, extra_hashes = search_nonces(template, base, 1)
+            hashes += extra_hashes
+            processes = 1
+
+    content['nonce'] = nonce
+
+    seconds = time.time() - start_time
+    with mining_lock:
+        last_run['processes'] = processes
+        last_run['hashes'] = hashes
+        last_run['seconds'] = seconds
+        last_run['hashrate'] = hashes / seconds if seconds > 0 else 0.0
+
+    logger.debug("Mined nonce with " + str(processes) + " process(es): "
+                 + str(hashes) + " hashes in " + "{:.2f}".format(seconds)
+                 + "s (" + str(int(hashes / seconds if seconds > 0 else 0))
+                 + " H/s)")
+
+    return hashed, nonce
@@ -0,0 +1,63 @@
+import time
+from threading import Lock
+
+# Upper bounds (seconds) of the stage timing histogram buckets
+TIMING_BUCKETS = [0.0001, 0.001, 0.01, 0.1, 1.0, float('inf')]
+
+
+class StageStats(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.passed = 0
+        self.rejected = 0
+        self.seconds = 0.0
+        self.histogram = [0] * len(TIMING_BUCKETS)
+
+    def record(self, seconds, passed):
+        with self.lock:
+            if passed:
+                self.passed += 1
+            else:
+                self.rejected += 1
+            self.seconds += seconds
+            for idx, bound in enumerate(TIMING_BUCKETS):
+                if seconds <= bound:
+                    self.histogram[idx] += 1
+                    break
+
+    def to_dict(self):
+        with self.lock:
+            return {'passed': self.passed,
+                    'rejected': self.rejected,
+                    'seconds': self.seconds,
+                    'histogram': {'<=' + str(bound): count for bound, count
+                                  in zip(TIMING_BUCKETS, self.histogram)}}
+
+
+class Pipeline(object):
+    """
+    Runs an item through a list of (name, check) stages, cheapest first, and
+    stops at the first stage that rejects it. check(item, context) -> bool,
+    context is a dict shared by the stages of one run (parameters like the
+    previous tick, and intermediate results such as encodings)
+    """
+    def __init__(self, name, stages):
+        self.name = name
+        self.stages = stages
+        self.stats = {stage_name: StageStats() for stage_name, _ in stages}
+
+    def run(self, item, context):
+        """
+        :return: <str> name of the rejecting stage, None if item passed all
+        """
+        for stage_name, check in self.stages:
+            start = time.perf_counter()
+            passed = check(item, context)
+            self.stats[stage_name].record(time.perf_counter() - start, passed)
+            if not passed:
+                return stage_name
+        return None
+
+    def to_dict(self):
+        return {stage_name: self.stats[stage_name].to_dict()
+                for stage_name, _ in self.stages}
@@ -1,13 +1,61 @@
 import hashlib
 import binascii
+import multiprocessing
+from threading import RLock
 import ecdsa
 import base58
+from datastructures.lru_cache import LRUCache
+from datastructures.pubkey_table import PubkeyTable
 
 
 # Assuming all input and output is hex (apart from get_kp where input is string)
 # Message is always bytes
 
 
+class CryptoContext(object):
+    """
+    Parsed keys and derived addresses, so that the same pubkeys showing up in
+    every ping/vote/tick only get parsed and hashed once. Sizes get set from
+    config by utils.common, which can't be imported here (circular import)
+    """
+    def __init__(self, key_cache_size=10000, addr_cache_size=10000):
+        self.verifying_keys = LRUCache(key_cache_size)
+        # Practically only holds the node's own credentials.privkey
+        self.signing_keys = LRUCache(4)
+        self.addresses = LRUCache(addr_cache_size)
+
+    def verifying_key(self, pubkey):
+        vk = self.verifying_keys.get(pubkey)
+        if vk is None:
+            vk = ecdsa.VerifyingKey.from_string(tobytes(pubkey),
+                                                curve=ecdsa.SECP256k1)
+            self.verifying_keys.put(pubkey, vk)
+        return vk
+
+    def signing_key(self, privkey):
+        sk = self.signing_keys.get(privkey)
+        if sk is None:
+            binary_pk = binascii.unhexlify(privkey.encode('ascii'))
+            sk = ecdsa.SigningKey.from_string(binary_pk, curve=ecdsa.SECP256k1)
+            self.signing_keys.put(privkey, sk)
+        return sk
+
+    def addr(self, pubkey):
+        addr = self.addresses.get(pubkey)
+        if addr is None:
+            addr = compute_addr(pubkey)
+            self.addresses.put(pubkey, addr)
+        return addr
+
+    def stats(self):
+        return {'verifying_keys': self.verifying_keys.stats(),
+                'signing_keys': self.signing_keys.stats(),
+                'addresses': self.addresses.stats()}
+
+
+crypto = CryptoContext()
+
+
 def get_kp(privkey=None):
     if not privkey:
         sk = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)
@@ -24,6 +72,10 @@ def get_kp(privkey=None):
 
 
 def pubkey_to_addr(pubkey):
+    return crypto.addr(pubkey)
+
+
+def compute_addr(pubkey):
     pubkey = '04' + pubkey  # add tag byte 0x04 (octet string)
 
     shad_once = hashlib.sha256(binascii.unhexlify(pubkey)).hexdigest()
@@ -50,19 +102,114 @@ def pubkey_to_addr(pubkey):
     return addr.decode("utf-8")
 
 
+# Process-wide pubkey ids, see datastructures/pubkey_table.py
+pubkeys = PubkeyTable(compute_addr)
+
+
 def sign(message, privkey):
-    binary_pk = binascii.unhexlify(privkey.encode('ascii'))
-    sk = ecdsa.SigningKey.from_string(binary_pk, curve=ecdsa.SECP256k1)
+    sk = crypto.signing_key(privkey)
     sig = tohex(sk.sign(message))
     return sig
 
 
 def verify(message, sig, pubkey):
-    vk = ecdsa.VerifyingKey.from_string(tobytes(pubkey), curve=ecdsa.SECP256k1)
+    vk = crypto.verifying_key(pubkey)
     verified = vk.verify(tobytes(sig), message)
     return verified
 
 
+# Worker processes (the verify pool here, the mining pool in utils.mining)
+# start from a fork server: forking the node itself could copy locks held by
+# its threads. The server imports what the workers need once, so that
+# commons (keypair, log handlers) aren't initialized again per worker
+mp_context = multiprocessing.get_context('forkserver')
+mp_context.set_forkserver_preload(['utils.common', 'utils.mining'])
+
+# Process pool for batch verification, see start_verify_pool
+verify_pool = None
+verify_pool_size = 0
+# Set by a worker as soon as it finds an invalid signature, so that the
+# other workers skip the rest of their chunks
+verify_failed = None
+# One batch at a time: a batch already keeps every worker busy
+verify_lock = RLock()
+
+
+def init_verify_worker(failed_event):
+    global verify_failed
+    verify_failed = failed_event
+
+
+def verify_safely(message, sig, pubkey):
+    try:
+        return verify(message, sig, pubkey)
+    except ecdsa.BadSignatureError:
+        return False
+
+
+def verify_chunk(chunk):
+    for message, sig, pubkey in chunk:
+        if verify_failed.is_set():
+            return None  # Another worker already failed this batch
+        if not verify_safely(message, sig, pubkey):
+            verify_failed.set()
+            return False
+    return True
+
+
+def start_verify_pool(processes):
+    """
+    Start the verify pool, at startup before the node's threads run.
+    verify_batch starts it on first use otherwise (e.g. in tests)
+
+    :param processes: <int> size of the process pool
+    """
+    global verify_pool, verify_pool_size, verify_failed
+
+    with verify_lock:
+        if verify_pool is not None and verify_pool_size == processes:
+            return
+        if verify_pool is not None:
+            verify_pool.terminate()
+        verify_failed = mp_context.Event()
+        verify_pool = mp_context.Pool(processes,
+                                      initializer=init_verify_worker,
+                                      initargs=(verify_failed,))
+        verify_pool_size = processes
+
+
+def verify_batch(items, processes=1, chunk_size=16):
+    """
+    Verify many signatures, on a pool of processes if there are enough
+
+    :param items: <list> of (message, sig, pubkey) tuples
+    :param processes: <int> size of the process pool
+    :param chunk_size: <int> signatures per task handed to a worker
+    :return: <bool> True if every signature is valid. Stops at first failure
+    """
+    if processes < 2 or len(items) <= chunk_size:
+        for message, sig, pubkey in items:
+            if not verify_safely(message, sig, pubkey):
+                return False
+        return True
+
+    chunks = [items[i:i + chunk_size]
+              for i in range(0, len(items), chunk_size)]
+
+    with verify_lock:
+        start_verify_pool(processes)
+        verify_failed.clear()
+        valid = True
+        # Keep consuming after a failure: the remaining chunks return at once,
+        # and the next batch must not start while they are still running
+        for result in verify_pool.imap_unordered(verify_chunk, chunks):
+            if result is False:
+                valid = False
+        verify_failed.clear()
+
+        return valid
+
+
 def tohex(b):
     return binascii.hexlify(b).decode('ascii').lower()
 
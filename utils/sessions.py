@@ -0,0 +1,95 @@
+import time
+import requests
+from threading import Lock
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
+
+class PeerSessions(object):
+    """
+    One keep-alive requests.Session per peer, so that the many small
+    forwards to the same peer reuse their TCP connections instead of opening
+    a new one each. Sessions are created on first use, and closed when their
+    peer gets unregistered or they sat idle for too long. Thread safe
+    """
+    def __init__(self, pool_size=4):
+        self.pool_size = pool_size
+        self.sessions = {}  # Peer location -> session
+        self.last_used = {}
+        self.lock = Lock()
+        # Totals of sessions closed already
+        self.closed = {'sessions': 0, 'requests': 0, 'connections': 0}
+
+    @staticmethod
+    def location(url):
+        parsed = urlparse(url)
+        return parsed.scheme + "://" + parsed.netloc
+
+    def session(self, url):
+        peer = self.location(url)
+        with self.lock:
+            session = self.sessions.get(peer, None)
+            if session is None:
+                session = requests.Session()
+                # Retries are left to helpers.attempt()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.pool_size,
+                                      max_retries=0)
+                session.mount('http://', adapter)
+                self.sessions[peer] = session
+            self.last_used[peer] = time.time()
+            return session
+
+    # Drop-in for requests.get/requests.post, e.g. with helpers.attempt()
+    def get(self, url, **kwargs):
+        return self.session(url).get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session(url).post(url, **kwargs)
+
+    def evict(self, url):
+        peer = self.location(url)
+        with self.lock:
+            session = self.sessions.pop(peer, None)
+            self.last_used.pop(peer, None)
+            if session is None:
+                return
+            counts = self.counts(session)
+            self.closed['sessions'] += 1
+            self.closed['requests'] += counts['requests']
+            self.closed['connections'] += counts['connections']
+        session.close()
+
+    def evict_idle(self, max_idle):
+        # Seeds and peers that never got registered don't get unregistered
+        now = time.time()
+        with self.lock:
+            idle = [peer for peer, last_used in self.last_used.items()
+                    if now - last_used > max_idle]
+        for peer in idle:
+            self.evict(peer)
+
+    @staticmethod
+    def counts(session):
+        # Requests made and TCP connections opened by the session's pools
+        requests_made = 0
+        connections = 0
+        for adapter in session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    requests_made += pool.num_requests
+                    connections += pool.num_connections
+        return {'requests': requests_made, 'connections': connections}
+
+    def stats(self):
+        with self.lock:
+            totals = dict(self.closed)
+            totals['open_sessions'] = len(self.sessions)
+            for session in self.sessions.values():
+                counts = self.counts(session)
+                totals['requests'] += counts['requests']
+                totals['connections'] += counts['connections']
+        totals['reused'] = totals['requests'] - totals['connections']
+        return totals
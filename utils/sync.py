@@ -0,0 +1,123 @@
+# Syncing the chain tail, ping pool and stage of a new joiner with its peers
+from collections import Counter
+
+from utils.common import logger, config
+from utils.helpers import hasher
+from utils.validation import tick_rejection, validate_ping
+from utils.validation import validate_schema, validate_sig_hash
+from datastructures.clockchain import GENESIS_TICK
+
+STAGES = ('ping', 'tick', 'vote', 'select')
+
+
+def valid_state(state):
+    # Shape of a peer's /info/sync response, checked before any of it is used
+    if type(state) is not dict or type(state.get('chain', None)) is not list \
+            or len(state['chain']) == 0 \
+            or type(state.get('ping_pool', None)) is not list \
+            or state.get('stage', None) not in STAGES:
+        return False
+    for slot in state['chain']:
+        if type(slot) is not dict or len(slot) == 0:
+            return False
+        for tick in slot.values():
+            if type(tick) is not dict or type(tick.get('height', None)) \
+                    is not int or type(tick.get('prev_tick', None)) is not str:
+                return False
+    # Ticks of a slot share their height
+    height = next(iter(state['chain'][-1].values()))['height']
+    return type(state.get('height', None)) is int \
+        and state['height'] == height
+
+
+def tip_of(state):
+    # A peer's tip: the refs of the latest slot of its chain
+    return tuple(sorted(state['chain'][-1].keys()))
+
+
+def majority_state(states, min_agreeing=config['sync_min_agreeing']):
+    """
+    Pick the state of the peers that agree on the most common tip, highest
+    chain first if two tips are equally common. It needs more than half of
+    the peers, and at least min_agreeing of them
+
+    :param states: <list> of well formed /info/sync responses of peers
+    :return: <tuple> (state, amount of peers agreeing), state is None if no
+        tip has a majority
+    """
+    if len(states) == 0:
+        return None, 0
+
+    tip_counts = Counter(tip_of(state) for state in states)
+    best = max(states, key=lambda state: (tip_counts[tip_of(state)],
+                                          state['height']))
+    agreeing = tip_counts[tip_of(best)]
+    if agreeing * 2 <= len(states) or agreeing < min_agreeing:
+        return None, agreeing
+    return best, agreeing
+
+
+def valid_anchor(slot):
+    # The first slot has no slot before it to validate against. Its ticks
+    # must match their refs, and be the genesis tick or mined and signed
+    for ref, tick in slot.items():
+        if ref != hasher(tick, exclude=('signature', 'this_tick')):
+            return False
+        if tick['height'] == 0 and ref == GENESIS_TICK['this_tick']:
+            continue
+        if not validate_schema(tick, 'tick_schema.json') \
+                or not validate_sig_hash(tick, ('signature', 'this_tick')):
+            return False
+    return True
+
+
+def validate_chain(chainlist):
+    # Every tick of a downloaded chain tail must be a valid tick on top of the
+    # slot before it. The first slot is the anchor the majority agreed on
+    if not valid_anchor(chainlist[0]):
+        logger.debug("Synced chain has an invalid anchor")
+        return False
+    for prev_slot, slot in zip(chainlist, chainlist[1:]):
+        previous_tick = next(iter(prev_slot.values()))
+        for ref, tick in slot.items():
+            if ref != hasher(tick, exclude=('signature', 'this_tick')):
+                logger.debug("Synced tick does not match its reference")
+                return False
+            if tick_rejection(tick, previous_tick, prev_slot) is not None:
+                logger.debug("Synced chain contains invalid tick")
+                return False
+    return True
+
+
+def sync_clockchain(clockchain, states):
+    """
+    Validate the majority state of the peers and install it in clockchain
+
+    :return: <dict> what was synced
+    """
+    peers = len(states)
+    states = [state for state in states if valid_state(state)]
+    state, agreeing = majority_state(states)
+    result = {'peers': peers, 'agreeing': agreeing, 'height': None,
+              'pings': 0, 'stage': None}
+    if state is None:
+        logger.info("No majority among the sync states of peers")
+        return result
+
+    if state['height'] > clockchain.current_height():
+        if validate_chain(state['chain']):
+            clockchain.install_chain(state['chain'])
+            result['height'] = state['height']
+        else:
+            logger.info("Majority chain of peers failed validation")
+
+    # Pings of every peer are welcome, as long as they are valid
+    for peer_state in states:
+        for ping in peer_state['ping_pool']:
+            if type(ping) is dict \
+                    and validate_ping(ping, clockchain.ping_pool):
+                clockchain.add_to_ping_pool(ping)
+                result['pings'] += 1
+
+    result['stage'] = state['stage']
+    return result
@@ -1,17 +1,86 @@
 import os
-import copy
-import ecdsa
+import hashlib
+from threading import Lock
 import jsonref
-from utils.pki import verify, pubkey_to_addr
-from jsonschema import validate
+from utils.pki import verify_batch, start_verify_pool, pubkeys
+from jsonschema.validators import validator_for
 
-from utils.helpers import hasher, handle_exception, standard_encode, median_ts
-from utils.helpers import utcnow
+from utils.helpers import handle_exception, standard_encode, median_ts
+from utils.helpers import utcnow, hasher
 
 from utils.common import config, dir_path, logger
+from utils.pipeline import Pipeline
+from datastructures.lru_cache import LRUCache
+from datastructures.dedup_filter import DedupFilter
+from datastructures.records import Record
+
+
+# Python types accepted per json schema type by the fast path. Anything else
+# (bools as integers, floats, subclasses..) is left to the full validator.
+# Records are checked through their wire dict accessors, a tick record's
+# pings come as a tuple of records
+fast_types = {
+    'object': lambda value: type(value) is dict or isinstance(value, Record),
+    'array': lambda value: type(value) in (list, tuple),
+    'string': lambda value: type(value) is str,
+    'integer': lambda value: type(value) is int,
+}
+
+# Schema keywords the fast path knows how to check
+fast_keywords = {'type', 'properties', 'required', 'items', 'minItems'}
+
+
+def compile_fast_check(schema):
+    """
+    Turn a simple schema into a plain python check. The check returning True
+    means the full validator would accept too, False means "not sure"
+
+    :param schema: <dict> schema with all $refs resolved
+    :return: <function> or None if the schema uses unsupported keywords
+    """
+    if not set(schema.keys()) <= fast_keywords \
+            or schema.get('type') not in fast_types:
+        return None
+
+    type_check = fast_types[schema['type']]
+    required = list(schema.get('required', []))
+    min_items = schema.get('minItems', 0)
+
+    properties = {}
+    for key, subschema in schema.get('properties', {}).items():
+        properties[key] = compile_fast_check(subschema)
+        if properties[key] is None:
+            return None
+
+    items = None
+    if 'items' in schema:
+        items = compile_fast_check(schema['items'])
+        if items is None:
+            return None
+
+    def fast_check(value):
+        if not type_check(value):
+            return False
+        if required or properties:
+            for key in required:
+                if key not in value:
+                    return False
+            for key, check in properties.items():
+                if key in value and not check(value[key]):
+                    return False
+        if items is not None or min_items:
+            if len(value) < min_items:
+                return False
+            if items is not None:
+                for item in value:
+                    if not items(item):
+                        return False
+        return True
 
+    return fast_check
 
-def validate_schema(dictionary, schema_file):
+
+def load_schema(schema_file):
     absolute_path = dir_path + '/schemas/' + schema_file
 
     base_path = os.path.dirname(absolute_path)
@@ -20,8 +89,35 @@ def validate_schema(dictionary, schema_file):
     with open(absolute_path) as schema_bytes:
         schema = jsonref.loads(schema_bytes.read(), base_uri=base_uri,
                                jsonschema=True)
+
+    validator_class = validator_for(schema)
+    validator_class.check_schema(schema)
+
+    return {'validator': validator_class(schema),
+            'fast_check': compile_fast_check(schema)}
+
+
+# Schemas get loaded, resolved and compiled once, instead of on every message
+schema_registry = {schema_file: load_schema(schema_file) for schema_file in
+                   sorted(os.listdir(dir_path + '/schemas'))
+                   if schema_file.endswith('.json')}
+
+
+def validate_schema(dictionary, schema_file):
+    if schema_file not in schema_registry:
+        schema_registry[schema_file] = load_schema(schema_file)
+    compiled = schema_registry[schema_file]
+
+    # Known well-formed shape, no need for the generic validator
+    fast_check = compiled['fast_check']
+    if fast_check is not None and fast_check(dictionary):
+        return True
+
+    # Only records the fast path wasn't sure about get rebuilt as dicts
+    if isinstance(dictionary, Record):
+        dictionary = dictionary.to_dict()
     try:
-        validate(dictionary, schema)
+        compiled['validator'].validate(dictionary)
     except Exception as e:
         handle_exception(e)
         return False
@@ -53,111 +149,324 @@ def validate_ping_timestamp(ping):
     return True
 
 
-def validate_sig_hash(item):
-    # The reason this is a combined check on sig+hash (instead of split methods)
-    # Is that check must be atomic, as sig+hash mutate the tick in certain order
+# (hash, signature, pubkey) of items whose signature was verified already.
+# The same pings arrive on their own and again inside every competing tick
+verified_signatures = LRUCache(config['sig_cache_size'])
 
-    # Deepcopy used to not modify instance we received
-    item_copy = copy.deepcopy(item)
-    signature = item_copy.pop('signature', None)
 
-    if signature is None:
-        logger.debug("Could not find signature in validate sighash..")
-        return False
+# Signatures of items added in the last dedup_window seconds. The API only
+# checks it, keys are remembered once an item got validated and added, so
+# that a forged copy of an item (or one dropped by a full queue) can't keep
+# the real one out. Meanwhile the key is claimed, see claim_item
+recent_items = DedupFilter(window_seconds=config['dedup_window'],
+                           buckets=config['dedup_buckets'],
+                           capacity=config['dedup_capacity'],
+                           false_positive_rate=config['dedup_false_positive'],
+                           exact_size=config['dedup_exact_size'])
+
+
+def dedup_key(item):
+    # Items are keyed on their signature, those without one on their hash
+    signature = item.get('signature', None) if isinstance(item, dict) \
+        else None
+    if type(signature) is not str:
+        signature = hasher(item)
+    return signature
+
+
+def seen_before(item):
+    return recent_items.seen(dedup_key(item), remember=False)
+
+
+def remember_item(item):
+    recent_items.add(dedup_key(item))
+
+
+# Keys of items an ingress worker is validating right now: copies that come
+# out of the queues meanwhile are duplicates too
+in_flight = set()
+in_flight_lock = Lock()
+
 
-    # Check hash
-    if not validate_difficulty(hasher(item_copy)):
+def claim_item(item):
+    """
+    Claim item for validation, unless it was added in the dedup window or a
+    copy of it is being validated already
+
+    :return: <str> its dedup key, to pass to release_item once validated.
+        None if it is a duplicate
+    """
+    key = dedup_key(item)
+    with in_flight_lock:
+        if key in in_flight or recent_items.seen(key, remember=False):
+            return None
+        in_flight.add(key)
+    return key
+
+
+def release_item(key, added):
+    """
+    :param key: <str> dedup key from claim_item
+    :param added: <bool> True if the item was valid and added, later copies
+        are then duplicates. Otherwise the next copy gets validated
+    """
+    with in_flight_lock:
+        if added:
+            recent_items.add(key)
+        in_flight.discard(key)
+
+
+def verify_processes():
+    processes = config['verify_processes']
+    if processes <= 0:  # 0 means: use every core we have
+        processes = os.cpu_count() or 1
+    return processes
+
+
+def start_verify_workers():
+    # Before the node's threads run, the pool is started on first use else
+    if verify_processes() > 1:
+        start_verify_pool(verify_processes())
+
+
+def check_difficulty(item, exclude, signed):
+    # Hash the signed body of item, and remember the encoding for the
+    # signature stage. The item is only read: keys in exclude are left out
+    # of the encoding instead of popped off a copy
+    encoded_message = standard_encode(item, exclude)
+    if isinstance(item, Record):
+        hashed = item.hash(exclude)
+    else:
+        hashed = hashlib.sha256(encoded_message).hexdigest()
+
+    if not validate_difficulty(hashed):
         logger.debug("Invalid hash for item: "
-                     + str(item_copy) + " "
-                     + hasher(item_copy))
+                     + str(encoded_message) + " " + hashed)
         return False
 
-    # Validate signature
-    try:
-        encoded_message = standard_encode(item_copy)
-        if not verify(encoded_message, signature, item_copy['pubkey']):
-            return False
-    except ecdsa.BadSignatureError:
+    signed.append((item, encoded_message, hashed))
+    return True
+
+
+def verify_signatures(signed):
+    # Verify everything that check_difficulty() collected in one batch,
+    # except for items whose exact signature was proven valid before
+    pending_signatures = []
+    for item, encoded_message, hashed in signed:
+        cache_key = (hashed, item['signature'], item['pubkey'])
+        if not verified_signatures.get(cache_key):
+            pending_signatures.append(
+                ((encoded_message, item['signature'], item['pubkey']),
+                 cache_key))
+
+    return verify_pending_signatures(pending_signatures)
+
+
+def verify_pending_signatures(pending_signatures):
+    items = [item for item, _ in pending_signatures]
+    if not verify_batch(items, verify_processes(), config['verify_chunk_size']):
         # TODO : When new joiner joins, make sure peers relay latest hash
-        logger.debug("Bad signature!" + str(item_copy) + " " + str(signature))
+        logger.debug("Bad signature in batch of " + str(len(items)))
         return False
 
+    for _, cache_key in pending_signatures:
+        verified_signatures.put(cache_key, True)
     return True
 
 
-def validate_tick(tick, previous_tick=None, possible_previous_ticks=None,
-                  verbose=True):
-    # Doing validation on a copy so that the original keeps its "this_tick" ref
-    # Otherwise the tick dict will be modified by any operations done here
-    tick_copy = copy.deepcopy(tick)
-    prev_tick_copy = copy.deepcopy(previous_tick)
+def validate_sig_hash(item, exclude=('signature',)):
+    # The reason this is a combined check on sig+hash (instead of split methods)
+    # Is that check must be atomic, as sig+hash mutate the tick in certain order
+    if item.get('signature', None) is None:
+        logger.debug("Could not find signature in validate sighash..")
+        return False
 
-    # This is used to keep track of the hash of the tick as debug information
-    # Popping it off as it is not supposed to be an actual part of a tick
-    tick_copy.pop('this_tick', None)
+    signed = []
+    if not check_difficulty(item, exclude, signed):
+        return False
 
-    if not validate_schema(tick_copy, 'tick_schema.json'):
-        logger.debug("Tick failed schema validation")
+    return verify_signatures(signed)
+
+
+# ---- Validation stages, ordered by cost in the pipelines below ----
+# Each stage is check(item, context) -> bool, see utils/pipeline.py
+
+def check_duplicate(item, context):
+    is_duplicate = context.get('is_duplicate', None)
+    if is_duplicate is not None and is_duplicate(item):
+        logger.debug(context['stage'] + " was a duplicate")
         return False
+    return True
 
-    # Check hash and sig keeping in mind signature might be popped off
-    if not validate_sig_hash(tick_copy):
-        logger.debug("Tick failed signature and hash checking")
+
+def check_tick_structure(tick, context):
+    if not validate_schema(tick, 'tick_schema.json'):
+        logger.debug("Tick failed schema validation")
         return False
+    return True
 
+
+def check_tick_reference(tick, context):
+    previous_tick = context['previous_tick']
     if previous_tick is not None:
-        if tick_copy['height'] != prev_tick_copy['height'] + 1:
+        if tick['height'] != previous_tick['height'] + 1:
             logger.debug("Tick failed height check")
             return False
 
+    possible_previous_ticks = context['possible_previous_ticks']
     if possible_previous_ticks is not None:
-        if not tick_copy['prev_tick'] in possible_previous_ticks:
+        if not tick['prev_tick'] in possible_previous_ticks:
             logger.debug("Tick failed referencing any 1 of prev possible ticks")
             return False
 
+    return True
+
+
+def check_tick_difficulty(tick, context):
+    # "this_tick" is used to keep track of the hash of the tick as debug info
+    # It is not supposed to be an actual part of a tick, so it is not hashed
+    if not check_difficulty(tick, ('signature', 'this_tick'),
+                            context['signed']):
+        logger.debug("Tick failed hash checking")
+        return False
+
+    for ping in tick['list']:
+        if not check_difficulty(ping, ('signature',), context['signed']):
+            logger.debug("tick invalid due to containing invalid ping")
+            return False
+
+    return True
+
+
+def check_tick_timestamp(tick, context):
     # TODO: This forces lower bound, but should also include upper bound?
-    if not validate_tick_timediff(prev_tick_copy):  # Verbose: fails often
-        logger.debug("Tick failed minimum timediff check") if verbose else None
+    if not validate_tick_timediff(context['previous_tick']):
+        # Verbose: fails often
+        logger.debug("Tick failed minimum timediff check") \
+            if context['verbose'] else None
         return False
 
-    # Check all pings in list
-    for ping in tick_copy['list']:
-        # TODO: Check if tick's pings are in my own pool?
-        # TODO: So they dont just send any random pings
-        valid_ping = validate_ping(ping)
-        if not valid_ping:
+    for ping in tick['list']:
+        if not validate_ping_timestamp(ping):
             logger.debug("tick invalid due to containing invalid ping")
             return False
 
     return True
 
 
-def validate_ping(ping, ping_pool=None, vote=False):
-    stage = 'vote' if vote else 'ping'
+def check_signatures(item, context):
+    # TODO: Check if tick's pings are in my own pool?
+    # TODO: So they dont just send any random pings
+    if not verify_signatures(context['signed']):
+        logger.debug(context['stage'] + " failed signature checking")
+        return False
+    return True
+
+
+def check_ping_structure(ping, context):
     if not validate_schema(ping, 'ping_schema.json'):
-        logger.debug(stage + " failed schema validation")
+        logger.debug(context['stage'] + " failed schema validation")
         return False
+    return True
 
+
+def check_ping_reference(ping, context):
+    ping_pool = context['ping_pool']
     if ping_pool is not None:
-        if vote:
-            if pubkey_to_addr(ping['pubkey']) not in ping_pool:
+        # Pools are keyed on pubkey id. Unknown pubkeys aren't interned here,
+        # since this ping isn't validated yet
+        pubkey = ping.pubkey if isinstance(ping, Record) \
+            else pubkeys.lookup(ping['pubkey'])
+        if context['stage'] == 'vote':
+            if pubkey not in ping_pool:
                 logger.debug("Voters's pubkey not found in pingpool")
                 return False
 
             # Voting twice just overwrites your past vote!
         else:
-            if pubkey_to_addr(ping['pubkey']) in ping_pool:
-                logger.debug(stage + " was already in pool")
+            if pubkey in ping_pool:
+                logger.debug(context['stage'] + " was already in pool")
                 return False
 
-    # Check hash and sig, keeping in mind signature might be popped off
-    if not validate_sig_hash(ping):
-        logger.debug(stage + " failed sighash validation")
+    return True
+
+
+def check_ping_difficulty(ping, context):
+    if not check_difficulty(ping, ('signature',), context['signed']):
+        logger.debug(context['stage'] + " failed hash checking")
         return False
+    return True
+
 
+def check_ping_timestamp(ping, context):
     # TODO: Do sanity check on a pings timestamp in relation to current time etc
     if not validate_ping_timestamp(ping):  # <-- empty stub function atm..
-        logger.debug(stage + " failed sanity check on timestamp")
+        logger.debug(context['stage'] + " failed sanity check on timestamp")
         return False
-
     return True
+
+
+ping_stages = [('dedup', check_duplicate),
+               ('structure', check_ping_structure),
+               ('reference', check_ping_reference),
+               ('difficulty', check_ping_difficulty),
+               ('timestamp', check_ping_timestamp),
+               ('signatures', check_signatures)]
+
+tick_pipeline = Pipeline('tick', [('dedup', check_duplicate),
+                                  ('structure', check_tick_structure),
+                                  ('reference', check_tick_reference),
+                                  ('difficulty', check_tick_difficulty),
+                                  ('timestamp', check_tick_timestamp),
+                                  ('signatures', check_signatures)])
+ping_pipeline = Pipeline('ping', ping_stages)
+vote_pipeline = Pipeline('vote', ping_stages)
+
+
+def tick_rejection(tick, previous_tick=None, possible_previous_ticks=None,
+                   verbose=True, is_duplicate=None):
+    """
+    Run tick through the validation pipeline. Validation only reads tick and
+    previous_tick, so the original keeps its "this_tick" ref. Both can be wire
+    dicts or records, records reuse their cached encodings
+
+    :param is_duplicate: <function> dedup check of the caller, if any
+    :return: <str> name of the stage that rejected the tick, None if valid
+    """
+    context = {'stage': 'tick',
+               'previous_tick': previous_tick,
+               'possible_previous_ticks': possible_previous_ticks,
+               'verbose': verbose,
+               'is_duplicate': is_duplicate,
+               'signed': []}
+    return tick_pipeline.run(tick, context)
+
+
+def validate_tick(tick, previous_tick=None, possible_previous_ticks=None,
+                  verbose=True):
+    return tick_rejection(tick, previous_tick, possible_previous_ticks,
+                          verbose) is None
+
+
+def ping_rejection(ping, ping_pool=None, vote=False, is_duplicate=None):
+    """
+    Run ping or vote through the validation pipeline
+
+    :param is_duplicate: <function> dedup check of the caller, if any
+    :return: <str> name of the stage that rejected the ping, None if valid
+    """
+    context = {'stage': 'vote' if vote else 'ping',
+               'ping_pool': ping_pool,
+               'is_duplicate': is_duplicate,
+               'signed': []}
+    pipeline = vote_pipeline if vote else ping_pipeline
+    return pipeline.run(ping, context)
+
+
+def validate_ping(ping, ping_pool=None, vote=False):
+    return ping_rejection(ping, ping_pool, vote) is None
+
+
+def pipeline_stats():
+    return {pipeline.name: pipeline.to_dict()
+            for pipeline in [tick_pipeline, ping_pipeline, vote_pipeline]}
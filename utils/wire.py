@@ -0,0 +1,240 @@
+import json
+import zlib
+from datastructures.records import Record, ping_id
+from utils.common import config
+
+# Binary encoding of the peer messages, as an alternative to json on the
+# wire. It is only a transport format: decoding gives back the exact wire
+# dict, and signatures and hashes are still computed over standard_encode.
+#
+# Frame: one header byte (message kind, FLAG_ZLIB if the rest is compressed)
+# followed by the body. A body is two varint bitmaps over the fields of the
+# kind's layout (present, stored as json text), then every present field:
+#   - fixed width hex fields (pubkeys, signatures, refs) as raw bytes
+#   - integers as zigzag varints
+#   - a tick's list as a varint count followed by the ping bodies
+# A value that doesn't fit its field (e.g. a placeholder ref, a float
+# timestamp) is stored as varint length + its json text, so that it still
+# round trips exactly. Messages with keys outside the layout aren't encoded.
+
+CONTENT_TYPE = 'application/x-timechain'
+BINARY_HEADERS = {'Content-Type': CONTENT_TYPE}
+
+# Ticks can also go as json with their pings replaced by ids (see
+# records.ping_id), to peers that received most of those pings already
+COMPACT_TICK_TYPE = 'application/x-timechain-compact-tick'
+COMPACT_TICK_HEADERS = {'Content-Type': COMPACT_TICK_TYPE}
+
+FLAG_ZLIB = 0x80
+# Bodies at least this long get compressed, if that makes them smaller
+COMPRESS_MIN_BYTES = 1024
+# Bounds for decoding untrusted input
+MAX_DECOMPRESSED_BYTES = 16 * 1024 ** 2
+MAX_VARINT_BYTES = 16
+
+INT = 'int'
+PINGS = 'pings'
+
+PING_LAYOUT = (('pubkey', 64), ('nonce', INT), ('reference', 32),
+               ('timestamp', INT), ('signature', 64))
+TICK_LAYOUT = (('pubkey', 64), ('nonce', INT), ('list', PINGS),
+               ('prev_tick', 32), ('height', INT), ('signature', 64),
+               ('this_tick', 32))
+MUTUAL_ADD_LAYOUT = (('pubkey', 64), ('port', INT), ('signature', 64))
+PING_FIELDS = {field for field, _ in PING_LAYOUT}
+
+# Message kind per route, and its code in the frame header
+KINDS = {'ping': 1, 'vote': 1, 'tick': 2, 'mutual_add': 3}
+LAYOUTS = {1: PING_LAYOUT, 2: TICK_LAYOUT, 3: MUTUAL_ADD_LAYOUT}
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    value = 0
+    shift = 0
+    for idx in range(MAX_VARINT_BYTES):
+        if offset >= len(data):
+            raise ValueError("truncated varint")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+    raise ValueError("varint too long")
+
+
+def write_field(out, value, field_type):
+    # Appends value to out, returns False (leaving out as it was) if value
+    # doesn't fit field_type
+    if field_type == INT:
+        if type(value) is not int or not -2 ** 63 <= value < 2 ** 63:
+            return False
+        write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+    elif field_type == PINGS:
+        if type(value) is not list or not all(
+                type(ping) is dict and ping.keys() <= PING_FIELDS
+                for ping in value):
+            return False
+        write_varint(out, len(value))
+        for ping in value:
+            write_body(out, ping, PING_LAYOUT)
+    else:
+        # Fixed width hex, lowercase only so it decodes to the same string
+        if type(value) is not str or len(value) != field_type * 2:
+            return False
+        try:
+            raw = bytes.fromhex(value)
+        except ValueError:
+            return False
+        if len(raw) != field_type or raw.hex() != value:
+            return False
+        out += raw
+    return True
+
+
+def write_body(out, item, layout):
+    present = 0
+    as_json = 0
+    fields = bytearray()
+    for idx, (field, field_type) in enumerate(layout):
+        if field not in item:
+            continue
+        present |= 1 << idx
+        value = item[field]
+        if not write_field(fields, value, field_type):
+            as_json |= 1 << idx
+            text = json.dumps(value).encode('utf-8')
+            write_varint(fields, len(text))
+            fields += text
+    write_varint(out, present)
+    write_varint(out, as_json)
+    out += fields
+
+
+def read_body(data, offset, layout):
+    item = {}
+    present, offset = read_varint(data, offset)
+    as_json, offset = read_varint(data, offset)
+    if present >> len(layout):
+        raise ValueError("unknown fields")
+
+    for idx, (field, field_type) in enumerate(layout):
+        if not present & (1 << idx):
+            continue
+        if as_json & (1 << idx):
+            length, offset = read_varint(data, offset)
+            if offset + length > len(data):
+                raise ValueError("truncated field")
+            item[field] = json.loads(bytes(data[offset:offset + length])
+                                     .decode('utf-8'))
+            offset += length
+        elif field_type == INT:
+            value, offset = read_varint(data, offset)
+            item[field] = value // 2 if value % 2 == 0 else -(value + 1) // 2
+        elif field_type == PINGS:
+            count, offset = read_varint(data, offset)
+            pings = []
+            for _ in range(count):
+                ping, offset = read_body(data, offset, PING_LAYOUT)
+                pings.append(ping)
+            item[field] = pings
+        else:
+            if offset + field_type > len(data):
+                raise ValueError("truncated field")
+            item[field] = bytes(data[offset:offset + field_type]).hex()
+            offset += field_type
+    return item, offset
+
+
+def encode(item, route):
+    """
+    :param item: <dict> wire dict of a message
+    :param route: <str> 'ping', 'vote', 'tick' or 'mutual_add'
+    :return: <bytes> binary frame, None if item can't be encoded exactly
+    """
+    kind = KINDS[route]
+    layout = LAYOUTS[kind]
+    if type(item) is not dict \
+            or not set(item) <= {field for field, _ in layout}:
+        return None
+
+    body = bytearray()
+    write_body(body, item, layout)
+    if len(body) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(bytes(body))
+        if len(compressed) < len(body):
+            return bytes([kind | FLAG_ZLIB]) + compressed
+    return bytes([kind]) + bytes(body)
+
+
+def decode(data, route):
+    """
+    :param data: <bytes> binary frame
+    :param route: <str> route it was received on
+    :return: <dict> wire dict of the message
+    :raises ValueError: if data isn't a valid frame for the route
+    """
+    if len(data) == 0 or data[0] & ~FLAG_ZLIB != KINDS[route]:
+        raise ValueError("not a " + route + " frame")
+
+    body = memoryview(data)[1:]
+    if data[0] & FLAG_ZLIB:
+        decompressor = zlib.decompressobj()
+        try:
+            body = decompressor.decompress(body, MAX_DECOMPRESSED_BYTES)
+        except zlib.error as e:
+            raise ValueError(str(e))
+        if decompressor.unconsumed_tail:
+            raise ValueError("frame too large")
+
+    # Bad json text or utf-8 raise ValueError subclasses too
+    item, offset = read_body(body, 0, LAYOUTS[KINDS[route]])
+    if offset != len(body):
+        raise ValueError("trailing bytes")
+    return item
+
+
+def compact_tick(tick, source_port):
+    """
+    :param tick: <dict> wire dict of a tick
+    :param source_port: <int> port of this node, where the receiver can
+        fetch the pings it doesn't have
+    :return: <dict> the tick with "ping_ids" instead of its "list", None if
+        its pings can't all be told apart by id
+    """
+    pings = tick.get('list', None)
+    if type(pings) is not list:
+        return None
+    ids = [ping_id(ping) if type(ping) is dict else None for ping in pings]
+    if None in ids or len(set(ids)) != len(ids):
+        return None
+
+    compact = {key: value for key, value in tick.items() if key != 'list'}
+    compact['ping_ids'] = ids
+    compact['source_port'] = source_port
+    return compact
+
+
+def is_compact_tick(item):
+    # Receivers fetch missing pings from source_port, so bound what it asks
+    return type(item) is dict and type(item.get('ping_ids', None)) is list \
+        and len(item['ping_ids']) <= config['compact_max_ping_ids'] \
+        and type(item.get('source_port', None)) is int \
+        and 0 < item['source_port'] < 65536 \
+        and all(type(identifier) is str for identifier in item['ping_ids'])
+
+
+def expand_tick(compact, pings):
+    # The full tick back, with pings in the order of the compact tick's ids
+    tick = {key: value for key, value in compact.items()
+            if key not in ('ping_ids', 'source_port')}
+    tick['list'] = [ping.to_dict() if isinstance(ping, Record) else ping
+                    for ping in pings]
+    return tick